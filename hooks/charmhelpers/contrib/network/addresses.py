@@ -0,0 +1,344 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# This file is part of charm-helpers.
+#
+# charm-helpers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charm-helpers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A snapshot of the host's addresses, indexed by prefix.
+
+netifaces needs a call per interface, and the helpers in ip.py used to
+repeat the walk (building a netaddr.IPNetwork per address) for every
+lookup. On a hypervisor with hundreds of tap devices that adds up quickly.
+Here the addresses are read once per hook with a single rtnetlink dump and
+indexed so that "which local address lies in network X" and "which
+interface owns address Y" are answered without walking the interfaces::
+
+    snapshot = address_snapshot()
+    snapshot.address_in_network('10.0.0.0/24')
+    snapshot.owner('10.0.0.5')
+
+Tap devices (the VM interfaces on a compute node) are left out of lookups
+unless they are asked for explicitly. If netlink is unavailable the
+snapshot is built from netifaces instead.
+"""
+
+import bisect
+import collections
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+RT_SCOPE_LINK = 253
+
+_NLMSGHDR = struct.Struct('=LHHLL')
+_RTATTR = struct.Struct('=HH')
+_IFINFOMSG = struct.Struct('=BxHiII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+
+TAP_PREFIXES = ('tap',)
+
+FAMILY_BITS = {4: 32, 6: 128}
+_AF_VERSION = {socket.AF_INET: 4, socket.AF_INET6: 6}
+
+Address = collections.namedtuple(
+    'Address',
+    ['iface', 'version', 'addr', 'prefixlen', 'broadcast', 'scope'])
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attributes(data, offset, end):
+    attrs = {}
+    while offset + _RTATTR.size <= end:
+        length, kind = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs.setdefault(kind, data[offset + _RTATTR.size:offset + length])
+        offset += _align(length)
+    return attrs
+
+
+def _name(raw):
+    return raw.split(b'\0')[0].decode('UTF-8')
+
+
+def _dump(sock, msg_type, payload, seq):
+    """Send a dump request and yield (type, body) for each reply."""
+    header = _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type,
+                            NLM_F_REQUEST | NLM_F_DUMP, seq, 0)
+    sock.send(header + payload)
+    while True:
+        data = sock.recv(65536)
+        offset = 0
+        while offset + _NLMSGHDR.size <= len(data):
+            length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+            if length < _NLMSGHDR.size:
+                return
+            if kind == NLMSG_DONE:
+                return
+            if kind == NLMSG_ERROR:
+                raise OSError('netlink dump failed')
+            yield kind, data[offset:offset + length]
+            offset += _align(length)
+
+
+def netlink_addresses():
+    """Return (interface names, [Address]) from a netlink dump."""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        names = collections.OrderedDict()
+        for kind, msg in _dump(sock, RTM_GETLINK,
+                               _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0),
+                               1):
+            if kind != RTM_NEWLINK:
+                continue
+            start = _NLMSGHDR.size
+            _, _, index, _, _ = _IFINFOMSG.unpack_from(msg, start)
+            attrs = _attributes(msg, start + _IFINFOMSG.size, len(msg))
+            if IFLA_IFNAME in attrs:
+                names[index] = _name(attrs[IFLA_IFNAME])
+
+        addresses = []
+        for kind, msg in _dump(sock, RTM_GETADDR,
+                               _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0),
+                               2):
+            if kind != RTM_NEWADDR:
+                continue
+            start = _NLMSGHDR.size
+            family, prefixlen, _, scope, index = _IFADDRMSG.unpack_from(
+                msg, start)
+            if family not in _AF_VERSION:
+                continue
+            attrs = _attributes(msg, start + _IFADDRMSG.size, len(msg))
+            raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if raw is None:
+                continue
+            iface = names.get(index, str(index))
+            if IFA_LABEL in attrs:
+                # IPv4 aliases (eth0:1) are reported under their label.
+                iface = _name(attrs[IFA_LABEL])
+            broadcast = attrs.get(IFA_BROADCAST)
+            if broadcast is not None:
+                broadcast = socket.inet_ntop(family, broadcast)
+            addresses.append(Address(iface, _AF_VERSION[family],
+                                     socket.inet_ntop(family, raw),
+                                     prefixlen, broadcast, scope))
+        interfaces = list(names.values())
+        interfaces.extend(sorted(set(entry.iface for entry in addresses) -
+                                 set(interfaces)))
+        return interfaces, addresses
+    finally:
+        sock.close()
+
+
+def _prefixlen(netmask, version):
+    if version == 6:
+        netmask = netmask.split('/')[-1] if '/' in netmask else netmask
+        if netmask.isdigit():
+            return int(netmask)
+    family = socket.AF_INET6 if version == 6 else socket.AF_INET
+    value = _to_int(socket.inet_pton(family, netmask))
+    return bin(value).count('1')
+
+
+def netifaces_addresses():
+    """Return (interface names, [Address]) using netifaces."""
+    import netifaces
+    families = {netifaces.AF_INET: 4, netifaces.AF_INET6: 6}
+    addresses = []
+    interfaces = netifaces.interfaces()
+    for iface in interfaces:
+        for family, version in families.items():
+            for entry in netifaces.ifaddresses(iface).get(family, []):
+                addr = entry['addr'].split('%')[0]
+                netmask = entry.get('netmask')
+                prefixlen = FAMILY_BITS[version]
+                if netmask:
+                    prefixlen = _prefixlen(netmask, version)
+                scope = 0
+                if addr.lower().startswith('fe80'):
+                    scope = RT_SCOPE_LINK
+                addresses.append(Address(iface, version, addr, prefixlen,
+                                         entry.get('broadcast'), scope))
+    return list(interfaces), addresses
+
+
+def _to_int(packed):
+    value = 0
+    for byte in bytearray(packed):
+        value = (value << 8) | byte
+    return value
+
+
+def _parse(address):
+    """Return (version, int) for an address literal."""
+    address = address.split('%')[0]
+    for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+        try:
+            return version, _to_int(socket.inet_pton(family, address))
+        except (socket.error, ValueError):
+            continue
+    raise ValueError("Address (%s) is not in correct presentation format" %
+                     address)
+
+
+def _parse_network(network):
+    """Return (version, network int, prefixlen) for a CIDR."""
+    if '/' in network:
+        address, prefixlen = network.split('/', 1)
+    else:
+        address, prefixlen = network, None
+    try:
+        version, value = _parse(address)
+        bits = FAMILY_BITS[version]
+        prefixlen = bits if prefixlen is None else int(prefixlen)
+        if not 0 <= prefixlen <= bits:
+            raise ValueError(prefixlen)
+    except ValueError:
+        raise ValueError("Network (%s) is not in CIDR presentation format" %
+                         network)
+    return version, value & _mask(version, prefixlen), prefixlen
+
+
+def _mask(version, prefixlen):
+    bits = FAMILY_BITS[version]
+    return ((1 << prefixlen) - 1) << (bits - prefixlen)
+
+
+def is_tap(iface):
+    return iface.startswith(TAP_PREFIXES)
+
+
+class AddressSnapshot(object):
+    """The host's addresses at one point in time.
+
+    Addresses are kept in a sorted list per IP version, so the local
+    addresses inside a network are found with two bisections, and in a
+    dict keyed by (version, prefix length, network) for mapping an address
+    to the local network that contains it.
+    """
+    def __init__(self, interfaces, addresses):
+        self.interfaces = interfaces
+        self.addresses = addresses
+        self._sorted = {4: [], 6: []}
+        self._networks = {4: {}, 6: {}}
+        self._by_addr = {}
+        for order, entry in enumerate(addresses):
+            version, value = _parse(entry.addr)
+            self._sorted[version].append((value, order))
+            self._by_addr.setdefault((version, value), []).append(order)
+            key = (entry.prefixlen,
+                   value & _mask(version, entry.prefixlen))
+            self._networks[version].setdefault(key, []).append(order)
+        for entries in self._sorted.values():
+            entries.sort()
+        self._prefixlens = {
+            version: sorted(set(p for p, _ in networks), reverse=True)
+            for version, networks in self._networks.items()}
+
+    @classmethod
+    def take(cls):
+        try:
+            return cls(*netlink_addresses())
+        except (AttributeError, socket.error, OSError, struct.error):
+            # No netlink on this platform, or it is filtered.
+            return cls(*netifaces_addresses())
+
+    def _select(self, orders, include_taps, link_local):
+        for order in sorted(orders):
+            entry = self.addresses[order]
+            if not include_taps and is_tap(entry.iface):
+                continue
+            if not link_local and entry.scope == RT_SCOPE_LINK:
+                continue
+            return entry
+        return None
+
+    def address_in_network(self, network, include_taps=False):
+        """Return the first local address inside network, or None.
+
+        Link-local addresses are never returned.
+        """
+        version, value, prefixlen = _parse_network(network)
+        entries = self._sorted[version]
+        last = value | (~_mask(version, prefixlen) &
+                        _mask(version, FAMILY_BITS[version]))
+        start = bisect.bisect_left(entries, (value, -1))
+        end = bisect.bisect_right(entries, (last, len(self.addresses)))
+        entry = self._select([order for _, order in entries[start:end]],
+                             include_taps, link_local=False)
+        return entry and entry.addr
+
+    def network_for(self, address, include_taps=False):
+        """Return the local Address whose network contains address."""
+        version, value = _parse(address)
+        networks = self._networks[version]
+        # Longest prefix first, as the routing table would match it.
+        for prefixlen in self._prefixlens[version]:
+            key = (prefixlen, value & _mask(version, prefixlen))
+            entry = self._select(networks.get(key, []), include_taps,
+                                 link_local=False)
+            if entry is not None:
+                return entry
+        return None
+
+    def owner(self, address, include_taps=False):
+        """Return the interface that has address configured, or None."""
+        orders = self._by_addr.get(_parse(address), [])
+        entry = self._select(orders, include_taps, link_local=True)
+        return entry and entry.iface
+
+    def for_interface(self, iface, version=None):
+        """Return the Addresses configured on iface."""
+        return [entry for entry in self.addresses if entry.iface == iface and
+                (version is None or entry.version == version)]
+
+
+_snapshot = None
+
+
+def address_snapshot(refresh=False):
+    """Return the snapshot for this hook, taking it on first use."""
+    global _snapshot
+    if _snapshot is None or refresh:
+        _snapshot = AddressSnapshot.take()
+    return _snapshot
+
+
+def netmask(entry):
+    """Return the netmask of an Address in the form netifaces gives it."""
+    family = socket.AF_INET6 if entry.version == 6 else socket.AF_INET
+    bits = FAMILY_BITS[entry.version]
+    packed = bytearray()
+    value = _mask(entry.version, entry.prefixlen)
+    for shift in range(bits - 8, -8, -8):
+        packed.append((value >> shift) & 0xff)
+    return socket.inet_ntop(family, bytes(packed))
@@ -23,6 +23,11 @@ import socket
 from functools import partial
 
 from charmhelpers.core.hookenv import unit_get
+from charmhelpers.contrib.network.addresses import (
+    RT_SCOPE_LINK,
+    address_snapshot,
+    netmask,
+)
 from charmhelpers.fetch import apt_install, apt_update
 from charmhelpers.core.hookenv import (
     log,
@@ -76,25 +81,12 @@ def get_address_in_network(network, fallback=None, fatal=False):
             return None
 
     networks = network.split() or [network]
+    snapshot = address_snapshot()
     for network in networks:
         _validate_cidr(network)
-        network = netaddr.IPNetwork(network)
-        for iface in netifaces.interfaces():
-            addresses = netifaces.ifaddresses(iface)
-            if network.version == 4 and netifaces.AF_INET in addresses:
-                addr = addresses[netifaces.AF_INET][0]['addr']
-                netmask = addresses[netifaces.AF_INET][0]['netmask']
-                cidr = netaddr.IPNetwork("%s/%s" % (addr, netmask))
-                if cidr in network:
-                    return str(cidr.ip)
-
-            if network.version == 6 and netifaces.AF_INET6 in addresses:
-                for addr in addresses[netifaces.AF_INET6]:
-                    if not addr['addr'].startswith('fe80'):
-                        cidr = netaddr.IPNetwork("%s/%s" % (addr['addr'],
-                                                            addr['netmask']))
-                        if cidr in network:
-                            return str(cidr.ip)
+        addr = snapshot.address_in_network(str(netaddr.IPNetwork(network)))
+        if addr is not None:
+            return addr
 
     if fallback is not None:
         return fallback
@@ -154,35 +146,20 @@ def _get_for_address(address, key):
         of the configured interface, for example 'netmask'.
     :returns str: Requested attribute or None if address is not bindable.
     """
-    address = netaddr.IPAddress(address)
-    for iface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(iface)
-        if address.version == 4 and netifaces.AF_INET in addresses:
-            addr = addresses[netifaces.AF_INET][0]['addr']
-            netmask = addresses[netifaces.AF_INET][0]['netmask']
-            network = netaddr.IPNetwork("%s/%s" % (addr, netmask))
-            cidr = network.cidr
-            if address in cidr:
-                if key == 'iface':
-                    return iface
-                else:
-                    return addresses[netifaces.AF_INET][0][key]
-
-        if address.version == 6 and netifaces.AF_INET6 in addresses:
-            for addr in addresses[netifaces.AF_INET6]:
-                if not addr['addr'].startswith('fe80'):
-                    network = netaddr.IPNetwork("%s/%s" % (addr['addr'],
-                                                           addr['netmask']))
-                    cidr = network.cidr
-                    if address in cidr:
-                        if key == 'iface':
-                            return iface
-                        elif key == 'netmask' and cidr:
-                            return str(cidr).split('/')[1]
-                        else:
-                            return addr[key]
+    entry = address_snapshot().network_for(address)
+    if entry is None:
+        return None
 
-    return None
+    if key == 'iface':
+        return entry.iface
+    elif key == 'netmask':
+        if entry.version == 6:
+            return str(entry.prefixlen)
+        return netmask(entry)
+    elif key == 'addr':
+        return entry.addr
+    else:
+        return getattr(entry, key)
 
 
 get_iface_for_address = partial(_get_for_address, key='iface')
@@ -218,7 +195,8 @@ def get_iface_addr(iface='eth0', inet_type='AF_INET', inc_aliases=False,
     except AttributeError:
         raise Exception("Unknown inet type '%s'" % str(inet_type))
 
-    interfaces = netifaces.interfaces()
+    snapshot = address_snapshot()
+    interfaces = snapshot.interfaces
     if inc_aliases:
         ifaces = []
         for _iface in interfaces:
@@ -239,13 +217,23 @@ def get_iface_addr(iface='eth0', inet_type='AF_INET', inc_aliases=False,
         else:
             ifaces = [iface]
 
+    version = {'AF_INET': 4, 'AF_INET6': 6}.get(inet_type)
     addresses = []
     for netiface in ifaces:
-        net_info = netifaces.ifaddresses(netiface)
-        if inet_num in net_info:
-            for entry in net_info[inet_num]:
-                if 'addr' in entry and entry['addr'] not in exc_list:
-                    addresses.append(entry['addr'])
+        if version is None:
+            # Link layer and other non-IP addresses are not in the snapshot.
+            net_info = netifaces.ifaddresses(netiface)
+            found = [entry['addr'] for entry in net_info.get(inet_num, [])
+                     if 'addr' in entry]
+        else:
+            found = []
+            for entry in snapshot.for_interface(netiface, version):
+                if entry.version == 6 and entry.scope == RT_SCOPE_LINK:
+                    # Scoped the way netifaces reports link-local addresses.
+                    found.append('%s%%%s' % (entry.addr, netiface))
+                else:
+                    found.append(entry.addr)
+        addresses.extend(addr for addr in found if addr not in exc_list)
 
     if fatal and not addresses:
         raise Exception("Interface '%s' doesn't have any %s addresses." %
@@ -259,21 +247,14 @@ get_ipv4_addr = partial(get_iface_addr, inet_type='AF_INET')
 
 def get_iface_from_addr(addr):
     """Work out on which interface the provided address is configured."""
-    for iface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(iface)
-        for inet_type in addresses:
-            for _addr in addresses[inet_type]:
-                _addr = _addr['addr']
-                # link local
-                ll_key = re.compile("(.+)%.*")
-                raw = re.match(ll_key, _addr)
-                if raw:
-                    _addr = raw.group(1)
-
-                if _addr == addr:
-                    log("Address '%s' is configured on iface '%s'" %
-                        (addr, iface))
-                    return iface
+    try:
+        iface = address_snapshot().owner(addr.split('%')[0],
+                                         include_taps=True)
+    except ValueError:
+        iface = None
+    if iface is not None:
+        log("Address '%s' is configured on iface '%s'" % (addr, iface))
+        return iface
 
     msg = "Unable to infer net iface on which '%s' is configured" % (addr)
     raise Exception(msg)
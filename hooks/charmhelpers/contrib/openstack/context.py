@@ -57,6 +57,7 @@ from charmhelpers.core.host import (
     get_nic_hwaddr,
     mkdir,
     write_file,
+    write_file_if_changed,
     pwgen,
 )
 from charmhelpers.contrib.hahelpers.cluster import (
@@ -503,9 +504,9 @@ class AMQPContext(OSContextGenerator):
 
                         ca_path = os.path.join(
                             self.ssl_dir, 'rabbit-client-ca.pem')
-                        with open(ca_path, 'w') as fh:
-                            fh.write(b64decode(ctxt['rabbit_ssl_ca']))
-                            ctxt['rabbit_ssl_ca'] = ca_path
+                        write_file_if_changed(
+                            ca_path, b64decode(ctxt['rabbit_ssl_ca']))
+                        ctxt['rabbit_ssl_ca'] = ca_path
 
                     # Sufficient information found = break out!
                     break
@@ -871,8 +872,7 @@ class NeutronContext(OSContextGenerator):
         else:
             _file = '/etc/nova/neutron_plugin.conf'
 
-        with open(_file, 'wb') as out:
-            out.write(self.plugin + '\n')
+        write_file_if_changed(_file, self.plugin + '\n')
 
     def ovs_ctxt(self):
         driver = neutron_plugin_attribute(self.plugin, 'driver',
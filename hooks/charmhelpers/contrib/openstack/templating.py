@@ -20,11 +20,14 @@ import six
 
 from charmhelpers.fetch import apt_install, apt_update
 from charmhelpers.core.hookenv import (
+    atexit,
     log,
+    DEBUG,
     ERROR,
     INFO
 )
 from charmhelpers.contrib.openstack.utils import OPENSTACK_CODENAMES
+from charmhelpers.core.host import write_file_if_changed
 
 try:
     from jinja2 import FileSystemLoader, ChoiceLoader, Environment, exceptions
@@ -89,7 +92,7 @@ class OSConfigTemplate(object):
     Associates a config file template with a list of context generators.
     Responsible for constructing a template context based on those generators.
     """
-    def __init__(self, config_file, contexts):
+    def __init__(self, config_file, contexts, evaluate=None):
         self.config_file = config_file
 
         if hasattr(contexts, '__call__'):
@@ -97,12 +100,14 @@ class OSConfigTemplate(object):
         else:
             self.contexts = contexts
 
+        # Called with each context generator to get its result.
+        self.evaluate = evaluate or (lambda context: context())
         self._complete_contexts = []
 
     def context(self):
         ctxt = {}
         for context in self.contexts:
-            _ctxt = context()
+            _ctxt = self.evaluate(context)
             if _ctxt:
                 ctxt.update(_ctxt)
                 # track interfaces for every complete context.
@@ -204,6 +209,10 @@ class OSConfigRenderer(object):
         self.openstack_release = openstack_release
         self.templates = {}
         self._tmpl_env = None
+        # Context generator results, by generator identity.
+        self._context_results = {}
+        self.evaluations = 0
+        self.evaluations_avoided = 0
 
         if None in [Environment, ChoiceLoader, FileSystemLoader]:
             # if this code is running, the object is created pre-install hook.
@@ -217,9 +226,42 @@ class OSConfigRenderer(object):
         during rendering.
         """
         self.templates[config_file] = OSConfigTemplate(config_file=config_file,
-                                                       contexts=contexts)
+                                                       contexts=contexts,
+                                                       evaluate=self._evaluate)
         log('Registered config file: %s' % config_file, level=INFO)
 
+    def _evaluate(self, context):
+        """
+        Call a context generator, or return its result from earlier in this
+        hook if it has been called already. Generators shared between
+        templates, and calls from complete_contexts(), render() and write(),
+        are then evaluated once.
+        """
+        key = id(context)
+        if key in self._context_results:
+            self.evaluations_avoided += 1
+            return self._context_results[key][1]
+        if not self._context_results:
+            atexit(self._report)
+        result = context()
+        # Keep the generator referenced so that its id stays unique.
+        self._context_results[key] = (context, result)
+        self.evaluations += 1
+        return result
+
+    def reset_contexts(self):
+        """
+        Forget all context generator results, for when their inputs have
+        changed within the hook.
+        """
+        self._context_results = {}
+        for template in six.itervalues(self.templates):
+            template._complete_contexts = []
+
+    def _report(self):
+        log('Context generators: %d evaluated, %d evaluations avoided' %
+            (self.evaluations, self.evaluations_avoided), level=DEBUG)
+
     def _get_tmpl_env(self):
         if not self._tmpl_env:
             loader = get_loader(self.templates_dir, self.openstack_release)
@@ -259,6 +301,8 @@ class OSConfigRenderer(object):
     def write(self, config_file):
         """
         Write a single config file, raises if config file is not registered.
+        The file is only written if its rendered contents differ from what
+        is on disk; returns True if it was.
         """
         if config_file not in self.templates:
             log('Config not registered: %s' % config_file, level=ERROR)
@@ -266,16 +310,19 @@ class OSConfigRenderer(object):
 
         _out = self.render(config_file)
 
-        with open(config_file, 'wb') as out:
-            out.write(_out)
+        if not write_file_if_changed(config_file, _out):
+            log('Template %s unchanged.' % config_file, level=DEBUG)
+            return False
 
         log('Wrote template %s.' % config_file, level=INFO)
+        return True
 
     def write_all(self):
         """
-        Write out all registered config files.
+        Write out all registered config files, returning the set of files
+        that changed.
         """
-        [self.write(k) for k in six.iterkeys(self.templates)]
+        return set(k for k in six.iterkeys(self.templates) if self.write(k))
 
     def set_release(self, openstack_release):
         """
@@ -70,7 +70,8 @@ from charmhelpers.contrib.python.packages import (
 )
 
 from charmhelpers.core.host import lsb_release, mounts, umount, service_running
-from charmhelpers.fetch import apt_install, apt_cache, install_remote
+from charmhelpers.fetch import apt_install, install_remote
+from charmhelpers.fetch.dpkgstatus import dpkg_status_index, upstream_version
 from charmhelpers.contrib.storage.linux.utils import is_block_device, zap_disk
 from charmhelpers.contrib.storage.linux.loopback import ensure_loopback_device
 
@@ -259,29 +260,26 @@ def get_swift_codename(version):
 
 def get_os_codename_package(package, fatal=True):
     '''Derive OpenStack release codename from an installed package.'''
-    import apt_pkg as apt
-
-    cache = apt_cache()
+    index = dpkg_status_index()
+    version = index.installed_version(package)
 
-    try:
-        pkg = cache[package]
-    except:
+    if version is None and not index.known(package):
         if not fatal:
             return None
-        # the package is unknown to the current apt cache.
+        # the package is unknown to dpkg.
         e = 'Could not determine version of package with no installation '\
             'candidate: %s' % package
         error_out(e)
 
-    if not pkg.current_ver:
+    if version is None:
         if not fatal:
             return None
         # package is known, but no version is currently installed.
         e = 'Could not determine version of uninstalled package: %s' % package
         error_out(e)
 
-    vers = apt.upstream_version(pkg.current_ver.ver_str)
-    if 'swift' in pkg.name:
+    vers = upstream_version(version)
+    if 'swift' in package:
         # Fully x.y.z match for swift versions
         match = re.match('^(\d+)\.(\d+)\.(\d+)', vers)
     else:
@@ -299,7 +297,7 @@ def get_os_codename_package(package, fatal=True):
     else:
         # < Liberty co-ordinated project versions
         try:
-            if 'swift' in pkg.name:
+            if 'swift' in package:
                 return get_swift_codename(vers)
             else:
                 return OPENSTACK_CODENAMES[vers]
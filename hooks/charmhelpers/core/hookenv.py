@@ -32,6 +32,8 @@ import subprocess
 import sys
 import errno
 import tempfile
+import atexit as _interpreter_atexit
+from collections import OrderedDict
 from subprocess import CalledProcessError
 
 import six
@@ -47,7 +49,125 @@ INFO = "INFO"
 DEBUG = "DEBUG"
 MARKER = object()
 
-cache = {}
+class HookCache(object):
+    """Memoised results of hook tool calls for the current hook execution.
+
+    Entries are grouped per function and keyed by the hashed call
+    arguments. Every string argument is also indexed, so that entries
+    for a given unit or relation id can be invalidated without scanning
+    the whole cache. If ``maxsize`` is set, the least recently used
+    entries are evicted once the cache grows beyond it.
+
+    The hit, miss and eviction counters are logged when the hook
+    completes.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._reported = False
+        self.clear()
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        # (func, key) -> value, least recently used first.
+        self._entries = OrderedDict()
+        self._by_func = {}
+        self._by_tag = {}
+        # (func, key) -> tags, kept apart from the key, which is only a
+        # repr for unhashable arguments.
+        self._tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(args, kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable arguments (lists, dicts) fall back to their repr.
+            key = repr(key)
+        return key
+
+    @staticmethod
+    def _unwrap(func):
+        return getattr(func, '_wrapped', func)
+
+    def get(self, func, key, default=None):
+        entry = (func, key)
+        try:
+            value = self._entries.pop(entry)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[entry] = value
+        self.hits += 1
+        return value
+
+    def set(self, func, key, value, tags=()):
+        if not self._reported:
+            self._reported = True
+            atexit(self.report)
+        entry = (func, key)
+        self._discard(entry)
+        self._entries[entry] = value
+        self._by_func.setdefault(func, set()).add(entry)
+        self._tags[entry] = tags
+        for tag in tags:
+            self._by_tag.setdefault(tag, set()).add(entry)
+        while self.maxsize is not None and len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def _discard(self, entry):
+        if self._entries.pop(entry, MARKER) is MARKER:
+            return
+        self._by_func[entry[0]].discard(entry)
+        for tag in self._tags.pop(entry):
+            entries = self._by_tag.get(tag)
+            if entries is not None:
+                entries.discard(entry)
+
+    def invalidate(self, func=None, tag=None):
+        """Drop the entries of func, the entries with tag among their
+        string arguments, or only the entries matching both.
+
+        :returns: the number of entries dropped.
+        """
+        if func is not None:
+            entries = self._by_func.get(self._unwrap(func), set())
+            if tag is not None:
+                entries = entries & self._by_tag.get(tag, set())
+        elif tag is not None:
+            entries = self._by_tag.get(tag, set())
+        else:
+            entries = list(self._entries)
+        entries = list(entries)
+        for entry in entries:
+            self._discard(entry)
+        return len(entries)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def report(self):
+        log('Hook cache: {entries} entries, {hits} hits, {misses} misses, '
+            '{evictions} evictions'.format(**self.stats()), level=DEBUG)
+
+
+def _cache_tags(args, kwargs):
+    """The string arguments of a call, to tag its HookCache entry with"""
+    return tuple(v for v in args + tuple(kwargs.values())
+                 if isinstance(v, six.string_types))
+
+
+cache = HookCache()
 
 
 def cached(func):
@@ -65,37 +185,37 @@ def cached(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = str((func, args, kwargs))
-        try:
-            return cache[key]
-        except KeyError:
-            pass  # Drop out of the exception handler scope.
+        key = cache.make_key(args, kwargs)
+        res = cache.get(func, key, MARKER)
+        if res is not MARKER:
+            return res
         res = func(*args, **kwargs)
-        cache[key] = res
+        cache.set(func, key, res, _cache_tags(args, kwargs))
         return res
     wrapper._wrapped = func
     return wrapper
 
 
 def flush(key):
-    """Flushes any entries from function cache where the
-    key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
-    for item in flush_list:
-        del cache[item]
+    """Flushes any entries from function cache where key is one of the
+    arguments the function was called with"""
+    cache.invalidate(tag=key)
 
 
 def log(message, level=None):
     """Write a message to the juju log"""
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    if log_buffer.enabled:
+        log_buffer.add(message, level)
+    else:
+        _juju_log(message, level)
+
+
+def _juju_log(message, level=None):
     command = ['juju-log']
     if level:
         command += ['-l', level]
-    if not isinstance(message, six.string_types):
-        message = repr(message)
     command += [message]
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
@@ -111,6 +231,84 @@ def log(message, level=None):
             raise
 
 
+_LOG_LEVELS = [DEBUG, INFO, WARNING, ERROR, CRITICAL]
+
+
+def _log_level_rank(level):
+    """Order log levels; juju-log treats a missing level as INFO"""
+    try:
+        return _LOG_LEVELS.index(level or INFO)
+    except ValueError:
+        return _LOG_LEVELS.index(INFO)
+
+
+class LogBuffer(object):
+    """Collects log messages in memory instead of forking juju-log for
+    each of them.
+
+    Once enabled, messages below ``min_level`` are dropped and the rest
+    are queued with their level. The queue is written out as a few
+    juju-log calls, one per run of messages sharing a level, when the
+    hook completes, when the interpreter exits (so that the messages
+    leading up to a crash are not lost), or straight away when an ERROR
+    or CRITICAL message is logged.
+    """
+    # juju-log gets the message as one argument; keep well below the
+    # kernel's per-argument limit of 128KiB.
+    MAX_BATCH_SIZE = 32 * 1024
+
+    def __init__(self):
+        self.enabled = False
+        self.min_level = DEBUG
+        self.messages = []
+        self._registered = False
+
+    def enable(self, min_level=DEBUG):
+        """Start buffering messages at or above min_level"""
+        self.enabled = True
+        self.min_level = min_level
+        if not self._registered:
+            self._registered = True
+            atexit(self.flush)
+            _interpreter_atexit.register(self.flush)
+
+    def disable(self):
+        """Write out anything buffered and go back to one call per
+        message"""
+        self.flush()
+        self.enabled = False
+
+    def add(self, message, level=None):
+        rank = _log_level_rank(level)
+        if rank < _log_level_rank(self.min_level):
+            return
+        self.messages.append((level, message))
+        if rank >= _log_level_rank(ERROR):
+            self.flush()
+
+    def batches(self, messages):
+        """Coalesce consecutive messages of the same level"""
+        level, batch, size = None, [], 0
+        for msg_level, message in messages:
+            if batch and (msg_level != level or
+                          size + len(message) > self.MAX_BATCH_SIZE):
+                yield level, '\n'.join(batch)
+                batch, size = [], 0
+            level = msg_level
+            batch.append(message)
+            size += len(message) + 1
+        if batch:
+            yield level, '\n'.join(batch)
+
+    def flush(self):
+        messages, self.messages = self.messages, []
+        for level, message in self.batches(messages):
+            _juju_log(message, level)
+
+
+log_buffer = LogBuffer()
+
+
 class Serializable(UserDict):
     """Wrapper, an object that can be serialized to yaml or json"""
 
@@ -345,24 +543,110 @@ def config(scope=None):
         return None
 
 
-@cached
+class RelationSnapshot(object):
+    """An in-memory index of the relation data seen by the current hook.
+
+    Each (relation id, unit) settings bag is fetched with a single
+    ``relation-get --format=json - <unit>`` call the first time any of
+    its attributes is asked for; every later lookup, including lookups
+    of other attributes, is answered from the index. Relation ids and
+    related units are indexed in the same way.
+
+    The snapshot counts the ``relation-*`` tool invocations it makes and
+    the ones it saves, so that the effect can be reported at the end of
+    the hook.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._units = {}
+        self._bags = {}
+        self.forks = 0
+        self.forks_saved = 0
+        self._reported = False
+
+    def reset(self):
+        """Forget everything, e.g. when a hook modifies relation data"""
+        self._ids.clear()
+        self._units.clear()
+        self._bags.clear()
+
+    def invalidate(self, rid=None, unit=None):
+        """Drop the indexed settings matching rid and/or unit."""
+        for key in [k for k in self._bags
+                    if (rid is None or k[0] == rid) and
+                    (unit is None or k[1] == unit)]:
+            del self._bags[key]
+
+    def _fork(self, args):
+        self.forks += 1
+        if not self._reported:
+            self._reported = True
+            atexit(self.report)
+        return json.loads(subprocess.check_output(args).decode('UTF-8'))
+
+    def relation_ids(self, reltype):
+        if reltype in self._ids:
+            self.forks_saved += 1
+            return self._ids[reltype]
+        ids = self._fork(['relation-ids', '--format=json', reltype]) or []
+        self._ids[reltype] = ids
+        return ids
+
+    def related_units(self, relid):
+        if relid in self._units:
+            self.forks_saved += 1
+            return self._units[relid]
+        args = ['relation-list', '--format=json']
+        if relid is not None:
+            args.extend(('-r', relid))
+        units = self._fork(args) or []
+        self._units[relid] = units
+        return units
+
+    def settings(self, unit=None, rid=None):
+        """Return the settings bag of unit on rid, or None"""
+        key = (rid, unit)
+        if key in self._bags:
+            self.forks_saved += 1
+            return self._bags[key]
+        args = ['relation-get', '--format=json']
+        if rid:
+            args.extend(('-r', rid))
+        args.append('-')
+        if unit:
+            args.append(unit)
+        try:
+            bag = self._fork(args)
+        except ValueError:
+            bag = None
+        except CalledProcessError as e:
+            if e.returncode != 2:
+                raise
+            bag = None
+        self._bags[key] = bag
+        return bag
+
+    def stats(self):
+        return {'forks': self.forks, 'forks_saved': self.forks_saved}
+
+    def report(self):
+        log('Relation snapshot: {forks} relation tool calls, {forks_saved} '
+            'avoided'.format(**self.stats()), level=DEBUG)
+
+
+relation_snapshot = RelationSnapshot()
+
+
 def relation_get(attribute=None, unit=None, rid=None):
     """Get relation information"""
-    _args = ['relation-get', '--format=json']
-    if rid:
-        _args.append('-r')
-        _args.append(rid)
-    _args.append(attribute or '-')
-    if unit:
-        _args.append(unit)
-    try:
-        return json.loads(subprocess.check_output(_args).decode('UTF-8'))
-    except ValueError:
+    settings = relation_snapshot.settings(unit=unit, rid=rid)
+    if settings is None:
         return None
-    except CalledProcessError as e:
-        if e.returncode == 2:
-            return None
-        raise
+    if attribute is None:
+        # Callers are free to mutate what they get back.
+        return copy.deepcopy(settings)
+    return settings.get(attribute)
 
 
 def relation_set(relation_id=None, relation_settings=None, **kwargs):
@@ -398,7 +682,9 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
                 relation_cmd_line.append('{}={}'.format(key, value))
         subprocess.check_call(relation_cmd_line)
     # Flush cache of any relation-gets for local unit
+    relation_snapshot.invalidate(unit=local_unit())
     flush(local_unit())
+    cache.invalidate(relations)
 
 
 def relation_clear(r_id=None):
@@ -412,27 +698,18 @@ def relation_clear(r_id=None):
                  **settings)
 
 
-@cached
 def relation_ids(reltype=None):
     """A list of relation_ids"""
     reltype = reltype or relation_type()
-    relid_cmd_line = ['relation-ids', '--format=json']
     if reltype is not None:
-        relid_cmd_line.append(reltype)
-        return json.loads(
-            subprocess.check_output(relid_cmd_line).decode('UTF-8')) or []
+        return list(relation_snapshot.relation_ids(reltype))
     return []
 
 
-@cached
 def related_units(relid=None):
     """A list of related units"""
     relid = relid or relation_id()
-    units_cmd_line = ['relation-list', '--format=json']
-    if relid is not None:
-        units_cmd_line.extend(('-r', relid))
-    return json.loads(
-        subprocess.check_output(units_cmd_line).decode('UTF-8')) or []
+    return list(relation_snapshot.related_units(relid))
 
 
 @cached
@@ -855,6 +1132,7 @@ def is_leader():
     return json.loads(subprocess.check_output(cmd).decode('UTF-8'))
 
 
+@cached
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
 def leader_get(attribute=None):
     """Juju leader get value(s)"""
@@ -876,6 +1154,7 @@ def leader_set(settings=None, **kwargs):
         else:
             cmd.append('{}={}'.format(k, v))
     subprocess.check_call(cmd)
+    cache.invalidate(leader_get)
 
 
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
@@ -30,6 +30,7 @@ import random
 import string
 import subprocess
 import hashlib
+import tempfile
 from contextlib import contextmanager
 from collections import OrderedDict
 
@@ -300,6 +301,72 @@ def write_file(path, content, owner='root', group='root', perms=0o444):
         target.write(content)
 
 
+class FileWrites(object):
+    """Log of the files write_file_if_changed() was asked to write, and
+    whether each write changed anything."""
+    def __init__(self):
+        self._log = []
+
+    def record(self, path, changed):
+        self._log.append((path, changed))
+
+    def mark(self):
+        """Return a position to pass to :meth:`since`."""
+        return len(self._log)
+
+    def since(self, mark):
+        """Return {path: changed} for the writes made after mark."""
+        writes = {}
+        for path, changed in self._log[mark:]:
+            writes[path] = writes.get(path, False) or changed
+        return writes
+
+
+file_writes = FileWrites()
+
+
+def write_file_if_changed(path, content, owner=None, group=None, perms=None):
+    """Write a byte string to path, but only if it differs from what is
+    there already.
+
+    The file is replaced through an atomic rename, so readers never see a
+    partial file. Owner, group and permissions default to those of the file
+    being replaced, or root:root 0644 for a new file.
+
+    :returns: bool: True if the file was written.
+    """
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as current:
+            unchanged = current.read() == content
+    except (IOError, OSError):
+        st = None
+        unchanged = False
+    uid = pwd.getpwnam(owner).pw_uid if owner else (st.st_uid if st else 0)
+    gid = grp.getgrnam(group).gr_gid if group else (st.st_gid if st else 0)
+    if perms is None:
+        perms = (st.st_mode & 0o7777) if st else 0o644
+    if unchanged and (st.st_uid, st.st_gid, st.st_mode & 0o7777) == (
+            uid, gid, perms):
+        file_writes.record(path, False)
+        return False
+
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.{}.'.format(basename))
+    try:
+        with os.fdopen(fd, 'wb') as target:
+            if os.getuid() == 0:
+                os.fchown(target.fileno(), uid, gid)
+            os.fchmod(target.fileno(), perms)
+            target.write(content)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+    file_writes.record(path, True)
+    return True
+
+
 def fstab_remove(mp):
     """Remove the given mountpoint entry from /etc/fstab"""
     return Fstab.remove_by_mountpoint(mp)
@@ -401,6 +468,19 @@ def path_hash(path):
     }
 
 
+def path_stat(path):
+    """Return {filename: (mtime, size, inode)} for all files matching
+    'path'. Much cheaper than :func:`path_hash`, as no file is read."""
+    stats = {}
+    for filename in glob.iglob(path):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        stats[filename] = (st.st_mtime, st.st_size, st.st_ino)
+    return stats
+
+
 def check_hash(path, checksum, hash_type='md5'):
     """Validate a file using a cryptographic checksum.
 
@@ -421,7 +501,8 @@ class ChecksumError(ValueError):
     pass
 
 
-def restart_on_change(restart_map, stopstart=False):
+def restart_on_change(restart_map, stopstart=False, restart_functions=None,
+                      can_restart_now_f=None, restart_services_f=None):
     """Restart services based on configuration files changing
 
     This function is used a decorator, for example::
@@ -439,16 +520,64 @@ def restart_on_change(restart_map, stopstart=False):
     restarted if any file matching the pattern got changed, created
     or removed. Standard wildcards are supported, see documentation
     for the 'glob' module for more information.
+
+    restart_map may also be a callable returning such a dict, in which
+    case it is only evaluated when the decorated function is called.
+
+    Files written with :func:`write_file_if_changed` during the call are
+    judged by whether that actually changed them. Any other file counts as
+    changed if its mtime, size or inode did.
+
+    restart_functions maps service names to functions to call, with the
+    service name, instead of restarting them, for services that can apply a
+    new configuration in place. A function returns False if it could not.
+
+    can_restart_now_f, if given, is called with each service name and the
+    list of changed files that call for its restart. If it returns False
+    the service is not restarted now; the function is then responsible for
+    restarting it later.
+
+    restart_services_f, if given, is called with the list of services to
+    restart and restart_functions, instead of restarting them one at a
+    time; it is then responsible for calling the restart functions too. It
+    is not used with stopstart.
     """
+    if restart_functions is None:
+        restart_functions = {}
+
     def wrap(f):
         def wrapped_f(*args, **kwargs):
-            checksums = {path: path_hash(path) for path in restart_map}
+            _restart_map = restart_map
+            if callable(_restart_map):
+                _restart_map = _restart_map()
+            stats = {path: path_stat(path) for path in _restart_map}
+            mark = file_writes.mark()
             f(*args, **kwargs)
-            restarts = []
-            for path in restart_map:
-                if path_hash(path) != checksums[path]:
-                    restarts += restart_map[path]
-            services_list = list(OrderedDict.fromkeys(restarts))
+            writes = file_writes.since(mark)
+            restarts = OrderedDict()
+            for path in _restart_map:
+                if path in writes:
+                    changed = writes[path]
+                else:
+                    changed = path_stat(path) != stats[path]
+                if changed:
+                    for service_name in _restart_map[path]:
+                        restarts.setdefault(service_name, []).append(path)
+            services_list = [
+                service_name for service_name, paths in restarts.items()
+                if not can_restart_now_f or
+                can_restart_now_f(service_name, paths)]
+            if restart_services_f and not stopstart:
+                if services_list:
+                    restart_services_f(services_list, restart_functions)
+                return
+            for service_name in services_list:
+                if service_name in restart_functions and \
+                        restart_functions[service_name](service_name) is False:
+                    log('New configuration of {} not applied'.format(
+                        service_name), level='WARNING')
+            services_list = [service_name for service_name in services_list
+                             if service_name not in restart_functions]
             if not stopstart:
                 for service_name in services_list:
                     service('restart', service_name)
@@ -600,16 +729,20 @@ def cmp_pkgrevno(package, revno, pkgcache=None):
     *  0 => Installed revno is the same as supplied arg
     * -1 => Installed revno is less than supplied arg
 
-    This function imports apt_cache function from charmhelpers.fetch if
-    the pkgcache argument is None. Be sure to add charmhelpers.fetch if
-    you call this function, or pass an apt_pkg.Cache() instance.
+    The installed version is read from charmhelpers.fetch's dpkg status
+    index if the pkgcache argument is None. Be sure to add
+    charmhelpers.fetch if you call this function, or pass an
+    apt_pkg.Cache() instance.
     """
     import apt_pkg
-    if not pkgcache:
-        from charmhelpers.fetch import apt_cache
-        pkgcache = apt_cache()
-    pkg = pkgcache[package]
-    return apt_pkg.version_compare(pkg.current_ver.ver_str, revno)
+    if pkgcache:
+        pkg = pkgcache[package]
+        return apt_pkg.version_compare(pkg.current_ver.ver_str, revno)
+    from charmhelpers.fetch.dpkgstatus import dpkg_status_index
+    version = dpkg_status_index().installed_version(package)
+    if version is None:
+        raise KeyError('Package {} is not installed'.format(package))
+    return apt_pkg.version_compare(version, revno)
 
 
 @contextmanager
@@ -519,3 +519,69 @@ def kv():
     if _KV is None:
         _KV = Storage()
     return _KV
+
+
+class DerivedFacts(object):
+    """Values derived from the host that survive between hook executions.
+
+    Each fact is registered with a function computing it and a function
+    returning its validity key: something cheap to evaluate that changes
+    whenever the fact's inputs do (a file's mtime, a config digest, ...).
+    The fact is recomputed only when the stored validity key no longer
+    matches::
+
+       facts = DerivedFacts()
+       facts.register('release', lambda: os_release('neutron-common'),
+                      lambda: os.stat('/var/lib/dpkg/status').st_mtime)
+       facts.get('release')
+
+    Values and validity keys must be JSON-serializable. Entries are kept
+    in :func:`kv` under `prefix` and flushed when the hook exits.
+    """
+    def __init__(self, db=None, prefix='facts.'):
+        self._db = db
+        self.prefix = prefix
+        self._registry = {}
+        self._flush_registered = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = kv()
+        return self._db
+
+    def register(self, name, compute, validity):
+        self._registry[name] = (compute, validity)
+
+    def get(self, name):
+        compute, validity = self._registry[name]
+        # Compare validity keys the way they come back out of storage.
+        key = json.loads(json.dumps(validity()))
+        entry = self.db.get(self.prefix + name)
+        if entry is not None and entry['validity'] == key:
+            self.hits += 1
+            return entry['value']
+        self.misses += 1
+        value = compute()
+        self.db.set(self.prefix + name, {'validity': key, 'value': value})
+        self._register_flush()
+        return value
+
+    def invalidate(self, name=None):
+        if name is None:
+            self.db.unsetrange(prefix=self.prefix)
+        else:
+            self.db.unset(self.prefix + name)
+        self._register_flush()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _register_flush(self):
+        if self._flush_registered:
+            return
+        from charmhelpers.core import hookenv
+        hookenv.atexit(self.db.flush)
+        self._flush_registered = True
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
 
+import glob
+import hashlib
 import importlib
 from tempfile import NamedTemporaryFile
 import time
@@ -23,10 +25,12 @@ from charmhelpers.core.host import (
 )
 import subprocess
 from charmhelpers.core.hookenv import (
+    atexit,
     config,
     log,
 )
 import os
+from charmhelpers.fetch.dpkgstatus import dpkg_status_index
 
 import six
 if six.PY3:
@@ -120,6 +124,18 @@ APT_NO_LOCK = 100  # The return code for "couldn't acquire lock" in APT.
 APT_NO_LOCK_RETRY_DELAY = 10  # Wait 10 seconds between apt lock checks.
 APT_NO_LOCK_RETRY_COUNT = 30  # Retry to acquire the lock X times.
 
+APT_SOURCES_GLOBS = (
+    '/etc/apt/sources.list',
+    '/etc/apt/sources.list.d/*.list',
+    '/etc/apt/sources.list.d/*.sources',
+    '/etc/apt/trusted.gpg',
+    '/etc/apt/trusted.gpg.d/*.gpg',
+    '/etc/apt/trusted.gpg.d/*.asc',
+)
+APT_LISTS_DIR = '/var/lib/apt/lists'
+APT_LISTS_MAX_AGE = 24 * 60 * 60  # Refresh indexes at least daily.
+APT_UPDATE_KEY = 'fetch.apt-update'
+
 
 class SourceConfigError(Exception):
     pass
@@ -159,21 +175,17 @@ class BaseFetchHandler(object):
 
 def filter_installed_packages(packages):
     """Returns a list of packages that require installation"""
-    cache = apt_cache()
-    _pkgs = []
-    for package in packages:
-        try:
-            p = cache[package]
-            p.current_ver or _pkgs.append(package)
-        except KeyError:
-            log('Package {} has no installation candidate.'.format(package),
-                level='WARNING')
-            _pkgs.append(package)
-    return _pkgs
+    index = dpkg_status_index()
+    return [package for package in packages
+            if not index.installed_version(package)]
 
 
 def apt_cache(in_memory=True):
-    """Build and return an apt cache"""
+    """Build and return an apt cache.
+
+    This parses every package list on the host; installed versions are
+    much cheaper to get from dpkg_status_index().
+    """
     from apt import apt_pkg
     apt_pkg.init()
     if in_memory:
@@ -199,6 +211,109 @@ def apt_install(packages, options=None, fatal=False):
     _run_apt_command(cmd, fatal)
 
 
+def apt_install_all(packages, options=None, fatal=False):
+    """Install packages in a single apt transaction.
+
+    If the transaction fails each package is retried on its own, so that
+    the log names the ones that cannot be installed. With fatal set, the
+    transaction's CalledProcessError is raised once they have been
+    reported, whether apt-get raised it or only returned non-zero.
+    """
+    if options is None:
+        options = ['--option=Dpkg::Options::=--force-confold']
+
+    cmd = ['apt-get', '--assume-yes']
+    cmd.extend(options)
+    cmd.append('install')
+    log("Installing {} with options: {}".format(packages,
+                                                options))
+    try:
+        result = _run_apt_command(cmd + list(packages), fatal)
+        if result == 0:
+            return []
+        error = subprocess.CalledProcessError(result, cmd + list(packages))
+    except subprocess.CalledProcessError as e:
+        error = e
+
+    failed = []
+    for package in packages:
+        if _run_apt_command(cmd + [package]) != 0:
+            log('Failed to install package {}'.format(package),
+                level='ERROR')
+            failed.append(package)
+    if failed and fatal:
+        raise error
+    return failed
+
+
+def filter_upgradable_packages(packages):
+    """Returns the installed packages that have a newer candidate version.
+
+    Builds the full apt cache, but only if any of packages is installed.
+    """
+    index = dpkg_status_index()
+    installed = [p for p in packages if index.installed_version(p)]
+    if not installed:
+        return []
+    import apt_pkg
+    cache = apt_cache()
+    depcache = apt_pkg.DepCache(cache)
+    _pkgs = []
+    for package in installed:
+        candidate = depcache.get_candidate_ver(cache[package])
+        if candidate and apt_pkg.version_compare(
+                candidate.ver_str, index.installed_version(package)) > 0:
+            _pkgs.append(package)
+    return _pkgs
+
+
+def apt_upgradable_packages(cache=None):
+    """Returns the names of all installed packages that have a newer
+    candidate version."""
+    import apt_pkg
+    cache = cache or apt_cache()
+    depcache = apt_pkg.DepCache(cache)
+    _pkgs = []
+    for pkg in cache.packages:
+        if not pkg.current_ver:
+            continue
+        candidate = depcache.get_candidate_ver(pkg)
+        if candidate and apt_pkg.version_compare(
+                candidate.ver_str, pkg.current_ver.ver_str) > 0:
+            _pkgs.append(pkg.get_fullname(True))
+    return _pkgs
+
+
+def apt_dependency_closure(packages, cache=None):
+    """Returns packages plus everything their candidate versions depend
+    on, recursively, as a set of package names."""
+    import apt_pkg
+    cache = cache or apt_cache()
+    depcache = apt_pkg.DepCache(cache)
+    closure = set()
+    pending = list(packages)
+    while pending:
+        name = pending.pop()
+        if name in closure:
+            continue
+        closure.add(name)
+        try:
+            pkg = cache[name]
+        except KeyError:
+            continue
+        candidate = depcache.get_candidate_ver(pkg)
+        if not candidate:
+            continue
+        for dep_type in ('PreDepends', 'Depends'):
+            for or_group in candidate.depends_list.get(dep_type, []):
+                # Follow the installed alternatives, or the first one.
+                targets = [dep.target_pkg for dep in or_group
+                           if dep.target_pkg.current_ver]
+                targets = targets or [or_group[0].target_pkg]
+                pending.extend(t.get_fullname(True) for t in targets)
+    return closure
+
+
 def apt_upgrade(options=None, fatal=False, dist=False):
     """Upgrade all packages"""
     if options is None:
@@ -217,7 +332,58 @@ def apt_upgrade(options=None, fatal=False, dist=False):
 def apt_update(fatal=False):
     """Update local apt cache"""
     cmd = ['apt-get', 'update']
-    _run_apt_command(cmd, fatal)
+    return _run_apt_command(cmd, fatal)
+
+
+def apt_sources_digest():
+    """Return a digest of the configured apt sources and trusted keys."""
+    paths = []
+    for pattern in APT_SOURCES_GLOBS:
+        paths.extend(glob.glob(pattern))
+    digest = hashlib.sha1()
+    for path in sorted(set(paths)):
+        if not os.path.isfile(path):
+            continue
+        digest.update(path.encode('UTF-8') + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def apt_lists_mtime():
+    """Return the mtime of the newest downloaded package index, or None if
+    there are none."""
+    indexes = glob.glob(os.path.join(APT_LISTS_DIR, '*_Packages*'))
+    mtimes = [os.path.getmtime(path) for path in indexes]
+    if not mtimes:
+        return None
+    return max(mtimes)
+
+
+def apt_update_if_needed(fatal=False, max_age=APT_LISTS_MAX_AGE):
+    """Update the local apt cache, unless the sources and keys are the same
+    as at the last successful update and the indexes were refreshed less
+    than max_age seconds ago.
+
+    Returns True if apt-get update was run.
+    """
+    from charmhelpers.core import unitdata
+    db = unitdata.kv()
+    digest = apt_sources_digest()
+    last = db.get(APT_UPDATE_KEY) or {}
+    lists_mtime = apt_lists_mtime()
+    if last.get('digest') == digest and lists_mtime is not None:
+        # apt leaves unchanged indexes alone, so also count our own updates.
+        age = time.time() - max(lists_mtime, last.get('time', 0))
+        if age < max_age:
+            log('apt sources unchanged and indexes {:.0f}s old, skipping '
+                'apt update'.format(age), level='DEBUG')
+            return False
+    if apt_update(fatal) == 0:
+        db.set(APT_UPDATE_KEY, {'digest': digest, 'time': time.time()})
+        # Persisted with the rest of the hook's changes if it succeeds.
+        atexit(db.flush)
+    return True
 
 
 def apt_purge(packages, fatal=False):
@@ -435,6 +601,7 @@ def _run_apt_command(cmd, fatal=False):
     :param: cmd: str: The apt command to run.
     :param: fatal: bool: Whether the command's output should be checked and
         retried.
+    :returns: int: The command's return code.
     """
     env = os.environ.copy()
 
@@ -459,6 +626,7 @@ def _run_apt_command(cmd, fatal=False):
                 log("Couldn't acquire DPKG lock. Will retry in {} seconds."
                     "".format(APT_NO_LOCK_RETRY_DELAY))
                 time.sleep(APT_NO_LOCK_RETRY_DELAY)
+        return result
 
     else:
-        subprocess.call(cmd, env=env)
+        return subprocess.call(cmd, env=env)
@@ -16,7 +16,10 @@
 
 import os
 import hashlib
+import json
 import re
+import shutil
+import tempfile
 
 from charmhelpers.fetch import (
     BaseFetchHandler,
@@ -26,22 +29,22 @@ from charmhelpers.payload.archive import (
     get_archive_handler,
     extract,
 )
-from charmhelpers.core.host import mkdir, check_hash
+from charmhelpers.core.host import mkdir, check_hash, ChecksumError
 
 import six
 if six.PY3:
     from urllib.request import (
         build_opener, install_opener, urlopen, urlretrieve,
-        HTTPPasswordMgrWithDefaultRealm, HTTPBasicAuthHandler,
+        HTTPPasswordMgrWithDefaultRealm, HTTPBasicAuthHandler, Request,
     )
     from urllib.parse import urlparse, urlunparse, parse_qs
-    from urllib.error import URLError
+    from urllib.error import URLError, HTTPError
 else:
     from urllib import urlretrieve
     from urllib2 import (
         build_opener, install_opener, urlopen,
         HTTPPasswordMgrWithDefaultRealm, HTTPBasicAuthHandler,
-        URLError
+        URLError, HTTPError, Request
     )
     from urlparse import urlparse, urlunparse, parse_qs
 
@@ -84,15 +87,12 @@ class ArchiveUrlFetchHandler(BaseFetchHandler):
             return True
         return False
 
-    def download(self, source, dest):
-        """
-        Download an archive file.
+    # Downloads are streamed to disk in blocks of this size.
+    CHUNK_SIZE = 64 * 1024
 
-        :param str source: URL pointing to an archive file.
-        :param str dest: Local path location to download archive file to.
-        """
-        # propogate all exceptions
-        # URLError, OSError, etc
+    def _open(self, source, headers=None):
+        """Open source, installing an opener for any credentials it
+        carries."""
         proto, netloc, path, params, query, fragment = urlparse(source)
         if proto in ('http', 'https'):
             auth, barehost = splituser(netloc)
@@ -106,15 +106,119 @@ class ArchiveUrlFetchHandler(BaseFetchHandler):
                 authhandler = HTTPBasicAuthHandler(passman)
                 opener = build_opener(authhandler)
                 install_opener(opener)
-        response = urlopen(source)
+        return urlopen(Request(source, headers=headers or {}))
+
+    def _stream(self, response, dest_file, hashers=()):
+        while True:
+            chunk = response.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            dest_file.write(chunk)
+            for hasher in hashers:
+                hasher.update(chunk)
+
+    def download(self, source, dest):
+        """
+        Download an archive file.
+
+        :param str source: URL pointing to an archive file.
+        :param str dest: Local path location to download archive file to.
+        """
+        # propogate all exceptions
+        # URLError, OSError, etc
+        response = self._open(source)
         try:
             with open(dest, 'wb') as dest_file:
-                dest_file.write(response.read())
+                self._stream(response, dest_file)
         except Exception as e:
             if os.path.isfile(dest):
                 os.unlink(dest)
             raise e
 
+    def download_cached(self, source, checksum=None, hash_type='sha256',
+                        cache_dir=None):
+        """
+        Download a file into a content-addressed cache and return its path.
+
+        Files are kept as `cache_dir/<sha256>/<file name>`. If `checksum` is
+        a sha256 that is already cached nothing is downloaded; otherwise the
+        server is asked for the file only if it changed since the last
+        download of the same URL (by ETag or Last-Modified).
+
+        :param str source: URL pointing to the file.
+        :param str checksum: If given, validate the file after download.
+        :param str hash_type: Algorithm used to generate `checksum`.
+        :param str cache_dir: Defaults to `$CHARM_DIR/fetched/cache`.
+        :raises ChecksumError: If the file fails the checksum.
+        """
+        cache_dir = cache_dir or os.path.join(
+            os.environ.get('CHARM_DIR', ''), 'fetched', 'cache')
+        if not os.path.exists(cache_dir):
+            mkdir(cache_dir, perms=0o755)
+        name = os.path.basename(self.parse_url(source).path)
+
+        def _cached(digest):
+            path = os.path.join(cache_dir, digest, name)
+            if os.path.isfile(path):
+                return path
+
+        if checksum and hash_type == 'sha256' and _cached(checksum):
+            return _cached(checksum)
+
+        index_path = os.path.join(cache_dir, 'index.json')
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            index = {}
+        entry = index.get(source, {})
+        headers = {}
+        if entry.get('sha256') and _cached(entry['sha256']):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last-modified'):
+                headers['If-Modified-Since'] = entry['last-modified']
+
+        try:
+            response = self._open(source, headers)
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            path = _cached(entry['sha256'])
+            if checksum:
+                check_hash(path, checksum, hash_type)
+            return path
+
+        sha256 = hashlib.sha256()
+        hashers = [sha256]
+        if checksum and hash_type != 'sha256':
+            hashers.append(hashlib.new(hash_type))
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix='.download-')
+        try:
+            with os.fdopen(fd, 'wb') as dest_file:
+                self._stream(response, dest_file, hashers)
+            if checksum and hashers[-1].hexdigest() != checksum:
+                raise ChecksumError("'%s' != '%s'" %
+                                    (checksum, hashers[-1].hexdigest()))
+            digest_dir = os.path.join(cache_dir, sha256.hexdigest())
+            if not os.path.isdir(digest_dir):
+                os.mkdir(digest_dir)
+            path = os.path.join(digest_dir, name)
+            shutil.move(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+        info = response.info()
+        index[source] = {
+            'sha256': sha256.hexdigest(),
+            'etag': info.get('ETag'),
+            'last-modified': info.get('Last-Modified'),
+        }
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        return path
+
     # Mandatory file validation via Sha1 or MD5 hashing.
     def download_and_validate(self, url, hashsum, validate="sha1"):
         tempfile, headers = urlretrieve(url)
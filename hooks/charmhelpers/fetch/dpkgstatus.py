@@ -0,0 +1,212 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# This file is part of charm-helpers.
+#
+# charm-helpers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charm-helpers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Installed package versions read straight from the dpkg status file.
+
+Building an apt_pkg.Cache() parses every package list on the host, which is
+far more than is needed to answer "which version of X is installed?". The
+index here parses only /var/lib/dpkg/status and keeps the result on disk,
+keyed by the status file's mtime and size, so most hooks do not parse
+anything at all. Use the full apt cache only when candidate versions are
+needed.
+"""
+
+import json
+import mmap
+import os
+import re
+import subprocess
+import tempfile
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+# Package states for which apt reports no current version.
+NOT_INSTALLED_STATES = ('not-installed', 'config-files')
+
+# Kernel machine names for the architectures dpkg does not need asking about.
+UNAME_ARCHES = {
+    'x86_64': 'amd64',
+    'i686': 'i386',
+    'aarch64': 'arm64',
+    'armv7l': 'armhf',
+    'ppc64le': 'ppc64el',
+    's390x': 's390x',
+}
+
+_FIELD = re.compile(br'^(Package|Status|Architecture|Version): *(.*?) *$',
+                    re.M)
+
+
+def native_arch():
+    """Return the dpkg architecture of this host."""
+    arch = UNAME_ARCHES.get(os.uname()[4])
+    if arch is None:
+        arch = subprocess.check_output(
+            ['dpkg', '--print-architecture']).decode('UTF-8').strip()
+    return arch
+
+
+def parse_status(data, arch):
+    """Parse dpkg status file contents into {package: version}.
+
+    Native and architecture-independent packages are keyed by name, foreign
+    ones by name:arch, matching what apt_pkg.Cache() indexes them by. The
+    version is None for packages dpkg knows of but that are not installed.
+    """
+    packages = {}
+    stanza = {}
+
+    def _add(stanza):
+        if 'Package' not in stanza:
+            return
+        name = stanza['Package']
+        pkg_arch = stanza.get('Architecture', arch)
+        if pkg_arch not in (arch, 'all'):
+            name = '{}:{}'.format(name, pkg_arch)
+        state = stanza.get('Status', '').split()
+        if not state or state[-1] in NOT_INSTALLED_STATES:
+            packages.setdefault(name, None)
+        else:
+            packages[name] = stanza.get('Version')
+
+    for match in _FIELD.finditer(data):
+        field, value = match.groups()
+        field = field.decode('ascii')
+        # Package always opens a new stanza in the status file.
+        if field == 'Package':
+            _add(stanza)
+            stanza = {}
+        stanza[field] = value.decode('UTF-8')
+    _add(stanza)
+    return packages
+
+
+def upstream_version(version):
+    """Strip the epoch and Debian revision from version, as
+    apt_pkg.upstream_version() does."""
+    version = version.split(':', 1)[-1]
+    if '-' in version:
+        version = version.rsplit('-', 1)[0]
+    return version
+
+
+class DpkgStatusIndex(object):
+    """Lookups of installed package versions.
+
+    The index is reloaded whenever the status file's mtime or size changes;
+    if `cache_path` is set the parsed result is also stored there so that
+    later processes can skip parsing.
+    """
+    def __init__(self, status_path=DPKG_STATUS, cache_path=None, arch=None):
+        self.status_path = status_path
+        self.cache_path = cache_path
+        self._arch = arch
+        self._key = None
+        self._packages = {}
+
+    @property
+    def arch(self):
+        if self._arch is None:
+            self._arch = native_arch()
+        return self._arch
+
+    def _status_key(self):
+        try:
+            st = os.stat(self.status_path)
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_size]
+
+    def _read_cache(self, key):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cached.get('key') != key or cached.get('arch') != self.arch:
+            return None
+        return cached['packages']
+
+    def _write_cache(self, key, packages):
+        if not self.cache_path:
+            return
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix='.dpkg-index')
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'arch': self.arch,
+                           'packages': packages}, f)
+            os.rename(tmp, self.cache_path)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def _parse(self):
+        with open(self.status_path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return {}
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return parse_status(data, self.arch)
+            finally:
+                data.close()
+
+    def refresh(self):
+        """Make sure the index reflects the current status file."""
+        key = self._status_key()
+        if key is not None and key == self._key:
+            return
+        if key is None:
+            packages = {}
+        else:
+            packages = self._read_cache(key)
+            if packages is None:
+                packages = self._parse()
+                self._write_cache(key, packages)
+        self._key = key
+        self._packages = packages
+
+    def known(self, package):
+        """True if dpkg has a record of package, installed or not."""
+        self.refresh()
+        return package in self._packages
+
+    def installed_version(self, package):
+        """Return the installed version of package, or None."""
+        self.refresh()
+        return self._packages.get(package)
+
+
+_index = None
+
+
+def dpkg_status_index():
+    """Return the shared index, cached on disk in the charm directory."""
+    global _index
+    if _index is None:
+        cache_path = None
+        if os.environ.get('CHARM_DIR'):
+            cache_path = os.path.join(os.environ['CHARM_DIR'],
+                                      '.dpkg-status-index.json')
+        _index = DpkgStatusIndex(cache_path=cache_path)
+    return _index
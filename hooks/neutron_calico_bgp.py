@@ -0,0 +1,267 @@
+'''
+In-cluster BGP route reflectors.
+
+Without a bgp-route-reflector relation every unit peers with every other
+unit over the cluster relation: a full mesh of N * (N - 1) / 2 sessions,
+which BIRD does not cope with past a few hundred compute nodes. With the
+route-reflectors option set, the Juju leader elects that many units as
+route reflectors and publishes them with leader-set. The elected units
+reflect routes for everyone and peer with each other; every other unit
+peers with the route reflectors only. An elected unit keeps its role until
+it leaves the cluster, and only then is a replacement elected.
+
+Reading every peer's addresses off the cluster relation costs each unit N
+relation-gets, on every one of the N units whenever a unit joins. Instead
+the leader collects them and publishes one versioned peer list, which the
+other units read with a single leader-get. On Juju without leadership every
+unit still reads the cluster relation itself.
+'''
+
+import hashlib
+import json
+
+from charmhelpers.contrib.hahelpers.cluster import peer_units
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    config,
+    is_leader,
+    leader_get,
+    leader_set,
+    local_unit,
+    log,
+    related_units,
+    relation_get,
+    relation_ids,
+)
+
+ROUTE_REFLECTORS_KEY = 'route-reflectors'
+PEER_ADDRESSES_KEY = 'peer-addresses'
+RENDERED_KEY = 'neutron-calico.bgp.rendered-leader-version'
+
+
+def unit_number(unit):
+    return int(unit.split('/')[1])
+
+
+def cluster_units():
+    '''
+    This unit and its peers on the cluster relation.
+    '''
+    return [local_unit()] + peer_units('cluster')
+
+
+def elect_route_reflectors(units, count, current=()):
+    '''
+    Choose count of units as route reflectors. Those in current that are
+    still present keep the role; free places go to the oldest units, as
+    hahelpers.cluster.oldest_peer orders them.
+    '''
+    units = sorted(set(units), key=unit_number)
+    elected = [unit for unit in current if unit in units][:count]
+    for unit in units:
+        if len(elected) >= count:
+            break
+        if unit not in elected:
+            elected.append(unit)
+    return sorted(elected, key=unit_number)
+
+
+def _published():
+    value = leader_get(ROUTE_REFLECTORS_KEY)
+    return value.split() if value else []
+
+
+def update_route_reflectors():
+    '''
+    On the leader, re-run the election and publish the result if it has
+    changed. Returns True if it was published.
+    '''
+    try:
+        if not is_leader():
+            return False
+        current = _published()
+    except NotImplementedError:
+        return False
+    elected = elect_route_reflectors(cluster_units(),
+                                     config('route-reflectors') or 0,
+                                     current)
+    if elected == current:
+        return False
+    log('Elected BGP route reflectors: %s' % ' '.join(elected))
+    leader_set({ROUTE_REFLECTORS_KEY: ' '.join(elected)})
+    return True
+
+
+def collect_peer_addresses():
+    '''
+    Read every unit's addresses, this one's included, off the cluster
+    relation, as {unit: [addr, addr6]}.
+    '''
+    addresses = {}
+    for rid in relation_ids('cluster'):
+        for unit in related_units(rid) + [local_unit()]:
+            addr = relation_get('addr', rid=rid, unit=unit)
+            addr6 = relation_get('addr6', rid=rid, unit=unit)
+            if addr or addr6:
+                addresses[unit] = [addr, addr6]
+    return addresses
+
+
+def _peer_list(addresses):
+    units = json.dumps(addresses, sort_keys=True, separators=(',', ':'))
+    return {'version': hashlib.sha1(units).hexdigest()[:16],
+            'units': addresses}
+
+
+def publish_peer_addresses():
+    '''
+    On the leader, publish the cluster's addresses if they have changed.
+    Returns True if they were published.
+    '''
+    try:
+        if not is_leader():
+            return False
+        published = published_peer_addresses()
+    except NotImplementedError:
+        return False
+    peer_list = _peer_list(collect_peer_addresses())
+    if published is not None and published['version'] == \
+            peer_list['version']:
+        return False
+    log('Publishing addresses of %d units, version %s' %
+        (len(peer_list['units']), peer_list['version']))
+    leader_set({PEER_ADDRESSES_KEY: json.dumps(peer_list,
+                                               separators=(',', ':'))})
+    return True
+
+
+def published_peer_addresses():
+    '''
+    The peer list the leader published, {'version': ..., 'units': {unit:
+    [addr, addr6]}}, or None if there is none. Raises NotImplementedError
+    on Juju without leadership.
+    '''
+    value = leader_get(PEER_ADDRESSES_KEY)
+    if not value:
+        return None
+    return json.loads(value)
+
+
+def leader_peer_addresses():
+    '''
+    The units' addresses from the leader's peer list, or None if the
+    cluster relation has to be read instead.
+    '''
+    try:
+        peer_list = published_peer_addresses()
+    except NotImplementedError:
+        return None
+    return peer_list and peer_list['units']
+
+
+def update_cluster():
+    '''
+    Handle a change to the cluster: on the leader, re-elect route
+    reflectors and republish the peer list. Returns False if this unit does
+    not need to re-render its BGP configuration now, because it follows the
+    leader's peer list and will hear of changes through
+    leader-settings-changed.
+    '''
+    update_route_reflectors()
+    publish_peer_addresses()
+    try:
+        return is_leader() or leader_peer_addresses() is None
+    except NotImplementedError:
+        return True
+
+
+def leader_settings_version():
+    '''
+    A digest of the leader settings the BGP configuration depends on.
+    '''
+    try:
+        peer_list = published_peer_addresses()
+        elected = leader_get(ROUTE_REFLECTORS_KEY)
+    except NotImplementedError:
+        return None
+    version = peer_list and peer_list['version']
+    return hashlib.sha1(json.dumps([version, elected])).hexdigest()
+
+
+def leader_settings_rendered():
+    '''
+    True if the leader settings have not changed since this unit last
+    rendered them; otherwise record that they are about to be.
+    '''
+    db = unitdata.kv()
+    version = leader_settings_version()
+    if version == db.get(RENDERED_KEY):
+        return True
+    db.set(RENDERED_KEY, version)
+    return False
+
+
+def route_reflectors():
+    '''
+    The units currently elected as route reflectors, or [] for a full mesh.
+    '''
+    count = config('route-reflectors') or 0
+    if not count:
+        return []
+    try:
+        elected = _published()
+    except NotImplementedError:
+        elected = []
+    if not elected:
+        # No leadership on this Juju, or the leader has not published yet:
+        # every unit runs the same election over the same peers.
+        elected = elect_route_reflectors(cluster_units(), count)
+    return elected
+
+
+def bgp_sessions(unit, peers, reflectors):
+    '''
+    Work out whom unit peers with, given peers ({unit: address} for the
+    other units) and the elected reflectors.
+
+    Returns (peer addresses, route reflector client addresses).
+    '''
+    if not reflectors:
+        return [peers[peer] for peer in sorted(peers, key=unit_number)], []
+    reflectors = sorted(reflectors, key=unit_number)
+    upstream = [peers[peer] for peer in reflectors if peer in peers]
+    if unit not in reflectors:
+        if not upstream:
+            # None of the route reflectors has joined yet.
+            return bgp_sessions(unit, peers, [])
+        return upstream, []
+    reflectors = set(reflectors)
+    clients = [peers[peer] for peer in sorted(peers, key=unit_number)
+               if peer not in reflectors]
+    return upstream, clients
+
+
+def rendezvous_select(key, candidates, count, preferred=()):
+    '''
+    Choose count of candidates for key by highest random weight hashing:
+    every candidate gets a pseudo-random weight from hashing it with key,
+    and the heaviest win. Candidates in preferred win over the rest.
+    '''
+    def rank(candidate):
+        weight = hashlib.sha1('%s/%s' % (key, candidate)).hexdigest()
+        return candidate in preferred, weight
+    return sorted(candidates, key=rank, reverse=True)[:count]
+
+
+def choose_route_reflectors(unit, reflectors, count, preferred=None):
+    '''
+    Choose the route reflectors unit peers with from reflectors ({unit:
+    address}, in order): all of them if count is 0, or else count of them,
+    favouring those whose address satisfies preferred.
+    '''
+    if count and count < len(reflectors):
+        favoured = set(reflector for reflector, address in reflectors.items()
+                       if preferred and preferred(address))
+        chosen = rendezvous_select(unit, reflectors, count, favoured)
+        return [reflector for reflector in reflectors if reflector in chosen]
+    return list(reflectors)
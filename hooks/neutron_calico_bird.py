@@ -0,0 +1,233 @@
+'''
+Applying BIRD configuration in place.
+
+Restarting BIRD tears down every BGP session, so a single peer joining used
+to flap routes across the whole fabric. Instead the new configuration is
+checked with `bird -p` and applied with `birdc configure`, which restarts
+only the protocols whose configuration changed. BIRD is restarted only if
+it cannot be reconfigured, for instance because it is not running. A new
+configuration that BIRD rejects is replaced on disk by the one last applied
+(kept next to it as <file>.applied), so that a later restart does not fail
+on it.
+
+The protocols of the configuration last applied are recorded as digests in
+the kv store, so each change can be logged as the protocols it added,
+removed and changed, along with how many BGP sessions are established.
+'''
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    ERROR,
+    INFO,
+    WARNING,
+    log,
+)
+from charmhelpers.core.host import service_restart
+
+BIRD_CONF_DIR = '/etc/bird'
+BIRD_CONF = '%s/bird.conf' % BIRD_CONF_DIR
+BIRD6_CONF = '%s/bird6.conf' % BIRD_CONF_DIR
+
+# service: (daemon, control client, configuration file)
+BIRD_SERVICES = {
+    'bird': ('bird', 'birdc', BIRD_CONF),
+    'bird6': ('bird6', 'birdc6', BIRD6_CONF),
+}
+
+PROTOCOLS_KEY = 'neutron-calico.bird.protocols.'
+
+# Suffix of the copy of the configuration last applied.
+APPLIED_SUFFIX = '.applied'
+
+# How many protocol names to log for each kind of change.
+LOGGED_PROTOCOLS = 10
+
+_PROTOCOL = re.compile(r'^\s*protocol\s+(\w+)(?:\s+(\w+))?')
+
+
+def protocols(text):
+    '''
+    Return {name: digest} for the protocol blocks of a BIRD configuration.
+    Unnamed protocols get the names BIRD gives them: kernel1, device1 and
+    so on. Comments and indentation do not count towards the digest.
+    '''
+    found = {}
+    counts = {}
+    name = None
+    for line in text.splitlines():
+        code = line.split('#', 1)[0].strip()
+        if name is None:
+            match = _PROTOCOL.match(code)
+            if not match:
+                continue
+            kind, name = match.groups()
+            if name is None:
+                counts[kind] = counts.get(kind, 0) + 1
+                name = '%s%d' % (kind, counts[kind])
+            block = []
+            depth = 0
+            opened = False
+        block.append(code)
+        depth += code.count('{') - code.count('}')
+        opened = opened or '{' in code
+        if opened and depth <= 0:
+            found[name] = hashlib.sha1('\n'.join(block)).hexdigest()
+            name = None
+    return found
+
+
+def protocol_changes(old, new):
+    '''
+    Compare two results of protocols(), returning the sorted names of the
+    protocols (added, removed, changed).
+    '''
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(name for name in set(old) & set(new)
+                     if old[name] != new[name])
+    return added, removed, changed
+
+
+def _summary(names):
+    if not names:
+        return 'none'
+    summary = ', '.join(names[:LOGGED_PROTOCOLS])
+    if len(names) > LOGGED_PROTOCOLS:
+        summary += ' and %d more' % (len(names) - LOGGED_PROTOCOLS)
+    return summary
+
+
+def check_config(daemon, conf):
+    '''
+    Parse conf with the daemon, without applying it. Returns True if it is
+    valid.
+    '''
+    try:
+        subprocess.check_output([daemon, '-p', '-c', conf],
+                                stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        log('%s rejected %s: %s' % (daemon, conf, e.output.strip()),
+            level=ERROR)
+        return False
+    except OSError as e:
+        log('Cannot check %s with %s: %s' % (conf, daemon, e), level=ERROR)
+        return False
+    return True
+
+
+def configure(client):
+    '''
+    Tell the running daemon to re-read its configuration. Returns True if
+    it did.
+    '''
+    try:
+        output = subprocess.check_output([client, 'configure'],
+                                         stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError, OSError) as e:
+        log('%s configure failed: %s' %
+            (client, getattr(e, 'output', None) or e), level=WARNING)
+        return False
+    # "Reconfigured", "Reconfiguration in progress" or, while one is still
+    # running, "Reconfiguration already in progress, queueing new config".
+    if 'Reconfigur' not in output:
+        log('%s configure failed: %s' % (client, output.strip()),
+            level=WARNING)
+        return False
+    return True
+
+
+def _restore_applied(conf):
+    '''
+    Put the configuration last applied back in place of conf. Returns
+    False if there is none to restore.
+    '''
+    applied = conf + APPLIED_SUFFIX
+    if not os.path.exists(applied):
+        return False
+    shutil.copyfile(applied, conf)
+    return True
+
+
+def bgp_sessions(client):
+    '''
+    Return (established, configured), the numbers of BGP sessions BIRD has
+    up and configured, or None if it does not answer.
+    '''
+    try:
+        output = subprocess.check_output([client, 'show', 'protocols'],
+                                         stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    sessions = [line for line in output.splitlines()
+                if len(line.split()) > 1 and line.split()[1] == 'BGP']
+    return (len([line for line in sessions if 'Established' in line]),
+            len(sessions))
+
+
+def report_bgp_sessions(service):
+    '''
+    Log how many of the BGP sessions of service are established. Sessions
+    with peers that are not up yet come up later, so this is not waited
+    for.
+    '''
+    sessions = bgp_sessions(BIRD_SERVICES[service][1])
+    if not sessions or not sessions[1]:
+        return
+    established, configured = sessions
+    log('%s: %d of %d BGP sessions established' %
+        (service, established, configured),
+        level=WARNING if not established else INFO)
+
+
+def reload_bird(service):
+    '''
+    Apply the configuration of service, bird or bird6, without restarting
+    it if possible. A configuration that does not parse is not applied at
+    all: BIRD keeps running with the previous one, which is restored on
+    disk. Returns True if the configuration was applied.
+    '''
+    daemon, client, conf = BIRD_SERVICES[service]
+    if not check_config(daemon, conf):
+        if _restore_applied(conf):
+            log('Not applying %s, restored the configuration %s last '
+                'applied' % (conf, service), level=ERROR)
+        else:
+            log('Not applying %s, and no configuration applied before to '
+                'restore' % conf, level=ERROR)
+        return False
+    with open(conf) as f:
+        new = protocols(f.read())
+
+    if configure(client):
+        action = 'Reconfigured'
+    elif service_restart(service):
+        action = 'Restarted'
+    else:
+        # Not the configuration to fall back to next time.
+        if _restore_applied(conf):
+            log('%s failed to start with %s, restored the configuration '
+                'last applied' % (service, conf), level=ERROR)
+            service_restart(service)
+        else:
+            log('%s failed to start with %s' % (service, conf), level=ERROR)
+        return False
+    shutil.copyfile(conf, conf + APPLIED_SUFFIX)
+
+    db = unitdata.kv()
+    old = db.get(PROTOCOLS_KEY + service)
+    if old is None:
+        log('%s %s with %d protocols' % (action, service, len(new)))
+    else:
+        added, removed, changed = protocol_changes(old, new)
+        log('%s %s: protocols added: %s; removed: %s; changed: %s' %
+            (action, service, _summary(added), _summary(removed),
+             _summary(changed)))
+    db.set(PROTOCOLS_KEY + service, new)
+    report_bgp_sessions(service)
+    return True
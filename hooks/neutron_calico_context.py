@@ -1,23 +1,153 @@
 import os
-import re
-import socket
-import subprocess
+
+from collections import OrderedDict
 
 from charmhelpers.core.hookenv import (
+    WARNING,
     relation_ids,
     related_units,
     relation_get,
     config,
+    local_unit,
     log,
     unit_get,
 )
 from charmhelpers.core.host import (
-    data_hash,
-    file_hash
+    get_bond_master,
+    is_phy_iface,
+    write_file_if_changed,
 )
 from charmhelpers.contrib.openstack import context
-from charmhelpers.contrib.openstack.utils import get_host_ip
-from charmhelpers.contrib.network.ip import get_address_in_network
+from charmhelpers.contrib.network.addresses import address_snapshot, is_tap
+from charmhelpers.contrib.network.ip import (
+    get_address_in_network,
+    is_address_in_network,
+)
+from neutron_calico_facts import (
+    address_generation,
+    facts,
+    host_fact,
+    value_key,
+)
+from neutron_calico_bgp import (
+    bgp_sessions,
+    choose_route_reflectors,
+    leader_peer_addresses,
+    route_reflectors,
+    unit_number,
+)
+from neutron_calico_etcd import (
+    EtcdClient,
+    EtcdError,
+    credentials_changed,
+    record_credentials,
+)
+from neutron_calico_resolver import (
+    resolve_address,
+    resolve_values,
+)
+
+
+def _local_ip():
+    return get_address_in_network(config('os-data-network'),
+                                  resolve_address(unit_get('private-address')))
+
+
+facts.register(
+    'local-ip',
+    lambda: _local_ip(),
+    lambda: [value_key(config('os-data-network'),
+                       unit_get('private-address')),
+             address_generation()])
+
+
+# BIRD's direct protocol falls back to these interface patterns if the
+# fabric-facing interfaces cannot be found.
+BIRD_DIRECT_INTERFACES = ['-dummy0', 'dummy1', 'eth*', 'em*', 'br*',
+                          'juju-br*', 'ens*', 'enp*']
+
+# bird-scale-profile: how often BIRD rescans the kernel routing table and
+# the interface list, and what its direct protocol logs. BIRD hears of
+# route and interface changes from the kernel as they happen; the scans
+# only catch notifications it missed.
+BIRD_SCALE_PROFILES = {
+    'small': {'kernel_scan_time': 2, 'device_scan_time': 2,
+              'bird_debug': 'all'},
+    'medium': {'kernel_scan_time': 10, 'device_scan_time': 30,
+               'bird_debug': '{ states }'},
+    'large': {'kernel_scan_time': 30, 'device_scan_time': 60,
+              'bird_debug': 'off'},
+}
+
+
+def _in_data_network(address):
+    '''
+    True if address lies in one of the os-data-network networks.
+    '''
+    version = 6 if ':' in address else 4
+    return any(is_address_in_network(network, address)
+               for network in config('os-data-network').split()
+               if (6 if ':' in network else 4) == version)
+
+
+def _on_local_network(address):
+    '''
+    True if address lies in os-data-network, or if that is not set, in a
+    network this unit has an address in.
+    '''
+    try:
+        if config('os-data-network'):
+            return _in_data_network(address)
+        return address_snapshot().network_for(address) is not None
+    except ValueError:
+        return False
+
+
+def _base(iface):
+    # BIRD knows IPv4 aliases (eth0:1) by their device's name.
+    return iface and iface.split(':')[0]
+
+
+def _owner(address):
+    if not address:
+        return None
+    try:
+        return _base(address_snapshot().owner(address))
+    except ValueError:
+        return None
+
+
+def fabric_interfaces():
+    '''
+    The interfaces BIRD's direct protocol should watch: every interface
+    with an address in os-data-network if that is set, or else the
+    physical NICs, or the bonds they are enslaved to, and the interface
+    with this unit's address. VM tap interfaces never are, however many of
+    them there are.
+    '''
+    snapshot = address_snapshot()
+    interfaces = []
+    if config('os-data-network'):
+        for entry in snapshot.addresses:
+            if not is_tap(entry.iface) and _in_data_network(entry.addr):
+                interfaces.append(_base(entry.iface))
+    else:
+        for iface in snapshot.interfaces:
+            # Taps are ruled out first: is_phy_iface lists every device.
+            if is_tap(iface) or not is_phy_iface(iface):
+                continue
+            interfaces.append(get_bond_master(iface) or iface)
+        interfaces.append(_owner(host_fact('local-ip')))
+    return [iface for iface in OrderedDict.fromkeys(interfaces) if iface]
+
+
+def bird_scale_profile():
+    name = config('bird-scale-profile') or 'small'
+    if name not in BIRD_SCALE_PROFILES:
+        log("Unknown bird-scale-profile '%s', using 'small'" % name,
+            level=WARNING)
+        name = 'small'
+    return BIRD_SCALE_PROFILES[name]
 
 
 def _neutron_security_groups():
@@ -50,8 +180,12 @@ class CalicoPluginContext(context.NeutronContext):
     def neutron_security_groups(self):
         return _neutron_security_groups()
 
-    def addrs_from_relation(self, relation, ip_version=4):
-        addrs = []
+    def unit_addrs_from_relation(self, relation, ip_version=4):
+        '''
+        Map each unit on relation that has published an address of the
+        given IP version to that address.
+        '''
+        addrs = OrderedDict()
         attribute = 'addr'
 
         if ip_version == 6:
@@ -64,67 +198,141 @@ class CalicoPluginContext(context.NeutronContext):
                 if rel is None:
                     continue
 
-                if ip_version == 4:
-                    # rel will be a domain name. Map it to an IP
-                    ip = socket.getaddrinfo(rel, None)[0][4][0]
-                    addrs.append(ip)
-                else:
-                    # We don't use domain names for IPv6.
-                    addrs.append(rel)
+                addrs[unit] = rel
+
+        if ip_version == 4:
+            # These will be domain names. Map them to IPs, all at once.
+            addrs = resolve_values(addrs)
 
+        # We don't use domain names for IPv6.
         return addrs
 
+    def addrs_from_relation(self, relation, ip_version=4):
+        return list(self.unit_addrs_from_relation(relation,
+                                                  ip_version).values())
+
+    def route_reflector_addrs(self, ip_version=4):
+        '''
+        The addresses of the external route reflectors to peer with: all of
+        them, or with route-reflector-peers set, that many chosen by
+        rendezvous hashing, favouring those on this unit's own networks.
+        '''
+        addrs = self.unit_addrs_from_relation('bgp-route-reflector',
+                                              ip_version)
+        return [addrs[unit] for unit in choose_route_reflectors(
+            local_unit(), addrs, config('route-reflector-peers'),
+            _on_local_network)]
+
+    def cluster_unit_addrs(self, ip_version=4):
+        '''
+        Map each peer unit in the cluster to its address, from the leader's
+        peer list if there is one, or else from the cluster relation.
+        '''
+        published = leader_peer_addresses()
+        if published is None:
+            return self.unit_addrs_from_relation('cluster', ip_version)
+
+        index = 0 if ip_version == 4 else 1
+        addrs = OrderedDict()
+        for unit in sorted(published, key=unit_number):
+            if unit != local_unit() and published[unit][index]:
+                addrs[unit] = published[unit][index]
+
+        if ip_version == 4:
+            addrs = resolve_values(addrs)
+        return addrs
+
+    def cluster_sessions(self, ip_version=4):
+        '''
+        The BGP sessions to set up over the cluster relation: a full mesh,
+        or, with route-reflectors set, sessions to and from the elected
+        route reflectors only. Returns (peer addresses, route reflector
+        client addresses).
+        '''
+        return bgp_sessions(local_unit(),
+                            self.cluster_unit_addrs(ip_version),
+                            route_reflectors())
+
     def calico_ctxt(self):
         calico_ctxt = super(CalicoPluginContext, self).calico_ctxt()
         if not calico_ctxt:
             return {}
 
         conf = config()
-        calico_ctxt['local_ip'] = \
-            get_address_in_network(config('os-data-network'),
-                                   get_host_ip(unit_get('private-address')))
+        calico_ctxt['local_ip'] = host_fact('local-ip')
         calico_ctxt['neutron_security_groups'] = self.neutron_security_groups
         calico_ctxt['use_syslog'] = conf['use-syslog']
         calico_ctxt['verbose'] = conf['verbose']
         calico_ctxt['debug'] = conf['debug']
         calico_ctxt['peer_ips'] = []
         calico_ctxt['peer_ips6'] = []
+        calico_ctxt['rr_client_ips'] = []
+        calico_ctxt['rr_client_ips6'] = []
 
         # Our BGP peers are either route reflectors or our cluster peers.
         # Prefer route reflectors.
-        calico_ctxt['peer_ips'] = self.addrs_from_relation(
-            'bgp-route-reflector'
-        )
-        calico_ctxt['peer_ips6'] = self.addrs_from_relation(
-            'bgp-route-reflector',
-            ip_version=6
-        )
+        calico_ctxt['peer_ips'] = self.route_reflector_addrs()
+        calico_ctxt['peer_ips6'] = self.route_reflector_addrs(ip_version=6)
 
         if not calico_ctxt['peer_ips']:
-            calico_ctxt['peer_ips'] = self.addrs_from_relation('cluster')
+            (calico_ctxt['peer_ips'],
+             calico_ctxt['rr_client_ips']) = self.cluster_sessions()
 
         if not calico_ctxt['peer_ips6']:
-            calico_ctxt['peer_ips6'] = self.addrs_from_relation(
-                'cluster',
-                ip_version=6
-            )
+            (calico_ctxt['peer_ips6'],
+             calico_ctxt['rr_client_ips6']) = self.cluster_sessions(
+                ip_version=6)
+
+        # Between route reflectors, reflected routes must keep their next
+        # hop.
+        calico_ctxt['route_reflector'] = bool(calico_ctxt['rr_client_ips'] or
+                                              calico_ctxt['rr_client_ips6'])
+
+        interfaces = fabric_interfaces()
+        if interfaces:
+            calico_ctxt['bird_interfaces'] = ['dummy1'] + interfaces
+        else:
+            log('No fabric-facing interfaces found, BIRD watches %s' %
+                ' '.join(BIRD_DIRECT_INTERFACES), level=WARNING)
+            calico_ctxt['bird_interfaces'] = BIRD_DIRECT_INTERFACES
+        calico_ctxt.update(bird_scale_profile())
 
         return calico_ctxt
 
 
+ETCD_CERT = '/etc/neutron-calico/etcd_cert'
+ETCD_KEY = '/etc/neutron-calico/etcd_key'
+ETCD_CA = '/etc/neutron-calico/etcd_ca'
+
+
 class EtcdContext(context.OSContextGenerator):
     interfaces = ['etcd-proxy']
 
+    def __init__(self, client=None):
+        self.client = client or EtcdClient()
+        # Set when the new cluster shares no member with the one the proxy
+        # knows, so that the proxy's state has to be wiped.
+        self.wipe = False
+
     def _save_data(self, data, path):
         '''Save the specified data to a file indicated by path, creating the
         parent directory if needed.'''
         parent = os.path.dirname(path)
         if not os.path.isdir(parent):
             os.makedirs(parent)
-        with open(path, 'w') as stream:
-            stream.write(data)
+        write_file_if_changed(path, data)
         return path
 
+    def _existing_peers(self):
+        '''The peers that the running etcd proxy is aware of.'''
+        try:
+            return self.client.peers()
+        except EtcdError as e:
+            # Probably this means that the proxy was not already running.
+            # We treat this the same as there being no existing peers.
+            log('Unable to list etcd members: %s' % e)
+            return set()
+
     def __call__(self):
         for rid in relation_ids('etcd-proxy'):
             for unit in related_units(rid):
@@ -147,27 +355,11 @@ class EtcdContext(context.OSContextGenerator):
                     # proxy needs to be restarted.  If it doesn't, we return a
                     # null context.  If it does, we generate and return a
                     # complete context with the information needed to do that.
+                    credentials = {ETCD_CERT: client_cert,
+                                   ETCD_KEY: client_key,
+                                   ETCD_CA: client_ca}
 
-                    # First determine the peers that the existing etcd proxy is
-                    # aware of.
-                    existing_peers = set([])
-                    try:
-                        peer_info = subprocess.check_output(['etcdctl',
-                                                             '--no-sync',
-                                                             'member',
-                                                             'list'])
-                        for line in peer_info.split('\n'):
-                            m = re.search('name=([^ ]+) peerURLs=([^ ]+)',
-                                          line)
-                            if m:
-                                existing_peers.add('%s=%s' % (m.group(1),
-                                                              m.group(2)))
-                    except:
-                        # Probably this means that the proxy was not already
-                        # running.  We treat this the same as there being no
-                        # existing peers.
-                        log('"etcdctl --no-sync member list" call failed')
-
+                    existing_peers = self._existing_peers()
                     log('Existing etcd peers: %r' % existing_peers)
 
                     # Now get the peers indicated by the new cluster_string.
@@ -180,37 +372,20 @@ class EtcdContext(context.OSContextGenerator):
                         # the TLS credentials have changed.
                         log('New and existing etcd peers overlap')
 
-                        existing_cred_hash = (
-                            (file_hash('/etc/neutron-calico/etcd_cert') or '?')
-                            +
-                            (file_hash('/etc/neutron-calico/etcd_key') or '?')
-                            +
-                            (file_hash('/etc/neutron-calico/etcd_ca') or '?')
-                        )
-                        log('Existing credentials: %s' % existing_cred_hash)
-
-                        new_cred_hash = (
-                            data_hash(client_cert) +
-                            data_hash(client_key) +
-                            data_hash(client_ca)
-                        )
-                        log('New credentials: %s' % new_cred_hash)
-
-                        if new_cred_hash == existing_cred_hash:
+                        if not credentials_changed(credentials):
                             log('TLS credentials unchanged')
                             return {}
 
+                    self.wipe = not (new_peers & existing_peers)
+
                     # We need to start or restart the etcd proxy, so generate a
                     # context with the new cluster string and TLS credentials.
+                    for path, data in credentials.items():
+                        self._save_data(data, path)
+                    record_credentials(credentials)
                     return {'cluster': cluster_string,
-                            'server_certificate':
-                            self._save_data(client_cert,
-                                            '/etc/neutron-calico/etcd_cert'),
-                            'server_key':
-                            self._save_data(client_key,
-                                            '/etc/neutron-calico/etcd_key'),
-                            'ca_certificate':
-                            self._save_data(client_ca,
-                                            '/etc/neutron-calico/etcd_ca')}
+                            'server_certificate': ETCD_CERT,
+                            'server_key': ETCD_KEY,
+                            'ca_certificate': ETCD_CA}
 
         return {}
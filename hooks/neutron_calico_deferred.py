@@ -0,0 +1,160 @@
+'''
+Deferred, coalesced service restarts.
+
+When many units join at once every existing unit runs a relation hook for
+each of them, and each of those hooks used to restart BIRD. With
+restart-interval set, the relation hooks in DEFERRABLE_HOOKS queue the
+restarts they call for in the kv store instead, one entry per service
+however many hooks ask for it, and the queue is drained at most once every
+restart-interval seconds: when the first hook after that exits, or in
+update-status once the storm is over.
+
+Other hooks (configuration an operator changed, new AMQP credentials, an
+upgrade) restart at once and drain anything still queued, as does any
+restart of a service that is not running.
+
+With rolling restarts (see neutron_calico_rolling) the services they cover
+are queued in every hook, and only drained while this unit holds a restart
+token.
+'''
+
+import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    config,
+    hook_name,
+    log,
+)
+from charmhelpers.core.host import service_running
+
+from neutron_calico_restart import restart_services
+from neutron_calico_rolling import (
+    coordinate_restarts,
+    holds_restart_token,
+    is_rolling,
+    release_restart_token,
+    request_restart_token,
+)
+
+DEFERRED_KEY = 'neutron-calico.deferred-restarts'
+LAST_DRAIN_KEY = 'neutron-calico.deferred-restarts.last-drain'
+
+# Hooks that run in storms and only queue their restarts. update-status
+# restarts nothing itself, and drains the queue once it is due.
+DEFERRABLE_HOOKS = frozenset([
+    'cluster-relation-changed',
+    'cluster-relation-departed',
+    'leader-settings-changed',
+    'bgp-route-reflector-relation-changed',
+    'bgp-route-reflector-relation-departed',
+    'neutron-plugin-relation-changed',
+    'neutron-plugin-api-relation-changed',
+    'update-status',
+])
+
+
+# The services that take part in rolling restarts and were restarted by the
+# hook itself, while this unit held a restart token.
+_restarted_in_hook = []
+
+
+def restart_interval():
+    return config('restart-interval') or 0
+
+
+def pending_restarts():
+    '''
+    The queued restarts, as {service: {'files': [path, ...], 'requests': n,
+    'since': time}}.
+    '''
+    return unitdata.kv().get(DEFERRED_KEY) or {}
+
+
+def defer_restart(service, files):
+    '''
+    Queue a restart of service because files changed, merging it with any
+    restart of service already queued.
+    '''
+    db = unitdata.kv()
+    queue = pending_restarts()
+    entry = queue.setdefault(service, {'files': [], 'requests': 0,
+                                       'since': time.time()})
+    entry['files'] = sorted(set(entry['files']) | set(files))
+    entry['requests'] += 1
+    db.set(DEFERRED_KEY, queue)
+    log('Deferring restart of %s for %s (%d requests queued)' %
+        (service, ', '.join(files), entry['requests']))
+
+
+def _collapsed(service, entry, requests):
+    log('Restarting %s for %s: %d restart requests collapsed into one' %
+        (service, ', '.join(entry['files']), requests))
+
+
+def can_restart_now(service, files):
+    '''
+    The can_restart_now_f for restart_on_change: False, after queueing the
+    restart, if it can wait.
+    '''
+    if is_rolling(service):
+        if not holds_restart_token():
+            defer_restart(service, files)
+            request_restart_token()
+            return False
+        _restarted_in_hook.append(service)
+    if restart_interval() and hook_name() in DEFERRABLE_HOOKS and \
+            service_running(service):
+        defer_restart(service, files)
+        return False
+    queue = pending_restarts()
+    if service in queue:
+        # The queued restart is done now, together with this one.
+        entry = queue.pop(service)
+        _collapsed(service, entry, entry['requests'] + 1)
+        db = unitdata.kv()
+        db.set(DEFERRED_KEY, queue)
+    return True
+
+
+def drain_restarts(restart_functions=None):
+    '''
+    Restart the queued services if restart-interval has passed since the
+    last drain, or at once outside DEFERRABLE_HOOKS, and those that take
+    part in rolling restarts while this unit holds a restart token. Services
+    in restart_functions are handed to their function rather than
+    restarted.
+    '''
+    coordinate_restarts()
+    queue = pending_restarts()
+    token = holds_restart_token()
+    rolling = [service for service in queue if is_rolling(service)]
+    if token and not rolling:
+        # Restarted already, in the hook itself, and ready if
+        # restart_services found them so.
+        release_restart_token(list(_restarted_in_hook))
+    elif rolling and not token:
+        # Asks again if the leader skipped this unit for timing out.
+        request_restart_token()
+    if not queue:
+        return
+    db = unitdata.kv()
+    now = time.time()
+    last = db.get(LAST_DRAIN_KEY)
+    due = not (hook_name() in DEFERRABLE_HOOKS and last is not None and
+               0 <= now - last < restart_interval())
+    drain = [service for service in queue
+             if (token if service in rolling else due)]
+    if not drain:
+        log('%d restarts deferred' % len(queue))
+        return
+    drain.sort(key=lambda service: queue[service]['since'])
+    for service in drain:
+        entry = queue.pop(service)
+        _collapsed(service, entry, entry['requests'])
+    restart_services(drain, restart_functions)
+    db.set(DEFERRED_KEY, queue)
+    if due:
+        db.set(LAST_DRAIN_KEY, now)
+    if token and rolling:
+        release_restart_token(rolling)
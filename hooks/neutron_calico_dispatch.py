@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+'''
+Hook entry point.
+
+Every hook file links here rather than to neutron_calico_hooks, so that hooks
+the charm does not handle are answered without importing the template
+renderer, apt or netaddr. The relation-joined hooks in JOINED_HOOKS, which
+only publish settings, are run from neutron_calico_joined without them too.
+'''
+
+import os
+import sys
+
+from charmhelpers.core.hookenv import log
+
+# Must match the names registered with @hooks.hook() in neutron_calico_joined.
+JOINED_HOOKS = frozenset([
+    'neutron-plugin-relation-joined',
+    'cluster-relation-joined',
+    'bgp-route-reflector-relation-joined',
+    'amqp-relation-joined',
+])
+
+# Must match the names registered with @hooks.hook() in neutron_calico_hooks,
+# and JOINED_HOOKS.
+HANDLED_HOOKS = JOINED_HOOKS | frozenset([
+    'install',
+    'config-changed',
+    'neutron-plugin-relation-changed',
+    'neutron-plugin-api-relation-changed',
+    'cluster-relation-changed',
+    'cluster-relation-departed',
+    'bgp-route-reflector-relation-changed',
+    'bgp-route-reflector-relation-departed',
+    'amqp-relation-changed',
+    'amqp-relation-departed',
+    'etcd-proxy-relation-joined',
+    'etcd-proxy-relation-changed',
+    'leader-elected',
+    'leader-settings-changed',
+    'update-status',
+])
+
+
+def main(args):
+    hook_name = os.path.basename(args[0])
+    if hook_name not in HANDLED_HOOKS:
+        log('Unknown hook {} - skipping.'.format(hook_name))
+        return
+    if hook_name in JOINED_HOOKS:
+        import neutron_calico_joined
+        neutron_calico_joined.main()
+        return
+    # update-status only has work to do if restarts are queued, or on the
+    # leader, if restart tokens are out that it may have to reclaim.
+    if hook_name == 'update-status':
+        from neutron_calico_deferred import pending_restarts
+        from neutron_calico_rolling import tokens_outstanding
+        if not pending_restarts() and not tokens_outstanding():
+            return
+    import neutron_calico_hooks
+    neutron_calico_hooks.main()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
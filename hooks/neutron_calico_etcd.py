@@ -0,0 +1,129 @@
+'''
+A minimal client for the local etcd proxy's HTTP API, and the record of
+the TLS credentials the proxy was last configured with.
+'''
+
+import json
+import socket
+import urllib2
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import log
+from charmhelpers.core.host import data_hash, file_hash
+
+ETCD_CLIENT_URL = 'http://127.0.0.1:4001'
+ETCD_TIMEOUT = 2
+
+CREDENTIALS_KEY = 'neutron-calico.etcd.credentials'
+
+
+class EtcdError(Exception):
+    pass
+
+
+class EtcdKeyNotFound(EtcdError):
+    pass
+
+
+class EtcdClient(object):
+    '''
+    Queries etcd's v2 API. Every request gives up after `timeout` seconds,
+    so a proxy that is down costs a hook at most that long.
+    '''
+    def __init__(self, url=ETCD_CLIENT_URL, timeout=ETCD_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path):
+        try:
+            response = urllib2.urlopen(self.url + path, timeout=self.timeout)
+            try:
+                return json.load(response)
+            finally:
+                response.close()
+        except urllib2.HTTPError as e:
+            if e.code == 404:
+                raise EtcdKeyNotFound('GET %s%s: not found' % (self.url, path))
+            raise EtcdError('GET %s%s failed: %s' % (self.url, path, e))
+        except (urllib2.URLError, socket.error, ValueError) as e:
+            raise EtcdError('GET %s%s failed: %s' % (self.url, path, e))
+
+    def members(self):
+        '''
+        Return the cluster members as a list of dicts with 'name',
+        'peerURLs' and 'clientURLs'.
+        '''
+        return self._get('/v2/members').get('members', [])
+
+    def healthy(self):
+        '''
+        True if etcd answers. A proxy does not always serve /health itself,
+        so a members query that succeeds counts too.
+        '''
+        try:
+            return self._get('/health').get('health') == 'true'
+        except EtcdError:
+            pass
+        try:
+            self.members()
+        except EtcdError:
+            return False
+        return True
+
+    def get_value(self, key):
+        '''
+        Return the JSON value stored at key, or None if there is none.
+        '''
+        try:
+            node = self._get('/v2/keys' + key).get('node', {})
+        except EtcdKeyNotFound:
+            return None
+        try:
+            return json.loads(node.get('value'))
+        except (TypeError, ValueError):
+            raise EtcdError('%s does not hold JSON' % key)
+
+    def peers(self):
+        '''
+        Return the members as a set of 'name=peerURL' strings, the form used
+        in an initial cluster string.
+        '''
+        peers = set()
+        for member in self.members():
+            for url in member.get('peerURLs', []):
+                peers.add('%s=%s' % (member.get('name', ''), url))
+        return peers
+
+
+def stored_credentials():
+    '''
+    Return {path: digest} for the TLS files last written for the proxy.
+    '''
+    return unitdata.kv().get(CREDENTIALS_KEY) or {}
+
+
+def credentials_changed(credentials):
+    '''
+    True if any of credentials ({path: data}) differs from what was last
+    written. Files written before digests were recorded are hashed once.
+    '''
+    stored = stored_credentials()
+    for path, data in credentials.items():
+        digest = stored.get(path)
+        if digest is None:
+            digest = file_hash(path)
+            log('No recorded digest for %s, hashed it: %s' % (path, digest))
+        if digest != data_hash(data):
+            return True
+    return False
+
+
+def record_credentials(credentials):
+    '''
+    Record the digests of credentials ({path: data}) just written.
+    '''
+    db = unitdata.kv()
+    stored = stored_credentials()
+    for path, data in credentials.items():
+        stored[path] = data_hash(data)
+    db.set(CREDENTIALS_KEY, stored)
@@ -0,0 +1,66 @@
+'''
+Host facts that are expensive to derive but rarely change (the installed
+OpenStack release, local addresses, ...), cached in the unit's kv store
+across hook executions.
+
+Modules register the facts they own with `facts.register()`, passing a
+validity function built from the helpers below; charm code reads them with
+`host_fact()`.
+'''
+
+import hashlib
+import json
+import os
+
+from charmhelpers.contrib.network.addresses import address_snapshot
+from charmhelpers.core.unitdata import DerivedFacts
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+facts = DerivedFacts(prefix='neutron-calico.facts.')
+
+
+def host_fact(name):
+    '''
+    Return the current value of the named fact, recomputing it only if its
+    inputs have changed since it was last stored.
+    '''
+    return facts.get(name)
+
+
+def file_key(path):
+    '''
+    Validity key for a file: its mtime and size, or None if it is missing.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def dpkg_key():
+    '''
+    Validity key that changes whenever a package is installed or removed.
+    '''
+    return file_key(DPKG_STATUS)
+
+
+def value_key(*values):
+    '''
+    Validity key covering the given values, typically the charm config
+    options a fact depends on.
+    '''
+    values = json.dumps(values, sort_keys=True, default=repr)
+    return hashlib.sha1(values).hexdigest()
+
+
+def address_generation():
+    '''
+    Validity key that changes whenever an address is added to or removed
+    from any local interface. It is taken from the hook's address snapshot,
+    so the host's addresses are only enumerated once per hook.
+    '''
+    addresses = sorted((entry.iface, entry.addr, entry.prefixlen)
+                       for entry in address_snapshot().addresses)
+    return value_key(addresses)
@@ -1,15 +1,17 @@
 #!/usr/bin/python
 
-import subprocess
 import sys
 
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import (
+    DEBUG,
+    INFO,
     Hooks,
     UnregisteredHookError,
+    atexit,
     config,
     log,
-    relation_set,
-    unit_private_ip
+    log_buffer,
 )
 
 from charmhelpers.core.host import (
@@ -17,16 +19,17 @@ from charmhelpers.core.host import (
 )
 
 from charmhelpers.fetch import (
-    apt_install, apt_update
+    apt_update_if_needed
 )
 
 from neutron_calico_utils import (
-    determine_packages,
+    install_packages,
+    install_etcd_package,
     register_configs,
     restart_map,
+    RESTART_FUNCTIONS,
     additional_install_locations,
-    local_ipv6_address,
-    force_etcd_restart,
+    restart_etcd_proxy,
     configure_dhcp_agents,
     maybe_create_felix_cfg,
 )
@@ -35,88 +38,90 @@ from neutron_calico_context import (
     EtcdContext,
 )
 
+from neutron_calico_bgp import (
+    leader_settings_rendered,
+    update_cluster,
+    update_route_reflectors,
+)
+from neutron_calico_deferred import can_restart_now, drain_restarts
+from neutron_calico_restart import restart_services
+
 hooks = Hooks()
-CONFIGS = register_configs()
+# The config renderer is only built by the hooks that need it.
+CONFIGS = None
+
+
+def configs():
+    global CONFIGS
+    if CONFIGS is None:
+        CONFIGS = register_configs()
+    return CONFIGS
+
+
+# Apply changed configuration, letting relation hooks defer the restarts.
+restart_on_config_change = restart_on_change(
+    restart_map,
+    restart_functions=RESTART_FUNCTIONS,
+    can_restart_now_f=can_restart_now,
+    restart_services_f=restart_services)
 
 
 @hooks.hook()
 def install():
     additional_install_locations()
     maybe_create_felix_cfg()
-    apt_update()
-    pkgs = determine_packages()
-    for pkg in pkgs:
-        apt_install(pkg, fatal=True)
-    etcd_package_url = config('etcd-package-url')
-    if etcd_package_url and etcd_package_url.startswith('http'):
-        subprocess.check_call([
-            "wget",
-            etcd_package_url
-        ])
-        subprocess.check_call([
-            "dpkg",
-            "-i",
-            etcd_package_url.split('/')[-1]
-        ])
+    apt_update_if_needed()
+    install_packages()
+    install_etcd_package()
     configure_dhcp_agents()
 
 
 @hooks.hook('neutron-plugin-relation-changed')
 @hooks.hook('neutron-plugin-api-relation-changed')
-@hooks.hook('cluster-relation-changed')
-@hooks.hook('cluster-relation-departed')
 @hooks.hook('bgp-route-reflector-relation-changed')
 @hooks.hook('bgp-route-reflector-relation-departed')
-@restart_on_change(restart_map())
+@restart_on_config_change
 def generic_relation_changed():
-    CONFIGS.write_all()
+    configs().write_all()
+
+
+@hooks.hook('cluster-relation-changed')
+@hooks.hook('cluster-relation-departed')
+@hooks.hook('leader-elected')
+@restart_on_config_change
+def cluster_changed():
+    if not update_cluster():
+        log('Cluster change will arrive through the leader peer list')
+        return
+    configs().write_all()
+
+
+@hooks.hook('leader-settings-changed')
+@restart_on_config_change
+def leader_settings_changed():
+    if leader_settings_rendered():
+        log('Leader peer list and route reflectors unchanged')
+        return
+    configs().write_all()
 
 
 @hooks.hook('config-changed')
-@restart_on_change(restart_map())
+@restart_on_config_change
 def config_changed():
     global CONFIGS
+    update_route_reflectors()
     CONFIGS = register_configs()
     CONFIGS.write_all()
 
 
-@hooks.hook('neutron-plugin-relation-joined')
-def neutron_plugin_joined(relation_id=None):
-    rel_data = {
-        'enable-metadata': 'True',
-    }
-    relation_set(relation_id=relation_id, **rel_data)
-
-
-@hooks.hook('amqp-relation-joined')
-def amqp_joined(relation_id=None):
-    relation_set(relation_id=relation_id,
-                 username=config('rabbit-user'),
-                 vhost=config('rabbit-vhost'))
-
-
 @hooks.hook('amqp-relation-changed')
 @hooks.hook('amqp-relation-departed')
-@restart_on_change(restart_map())
+@restart_on_config_change
 def amqp_changed():
-    if 'amqp' not in CONFIGS.complete_contexts():
+    if 'amqp' not in configs().complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
         return
-    CONFIGS.write_all()
-
-
-@hooks.hook('cluster-relation-joined')
-def cluster_joined(relation_id=None):
-    relation_set(relation_id=relation_id,
-                 addr=unit_private_ip(),
-                 addr6=local_ipv6_address())
-
-
-@hooks.hook('bgp-route-reflector-relation-joined')
-def bgp_route_reflector_joined(relation_id=None):
-    relation_set(relation_id=relation_id,
-                 addr=unit_private_ip(),
-                 addr6=local_ipv6_address())
+    configs().write_all()
 
 
 @hooks.hook('etcd-proxy-relation-joined')
@@ -127,18 +132,30 @@ def etcd_proxy_force_restart(relation_id=None):
     # play well with the standard neutron-api config management, so we
     # treat etcd like the special snowflake it insists on being.
     etcd_context = EtcdContext()
-    CONFIGS.register('/etc/init/etcd.conf', [etcd_context])
-    CONFIGS.register('/etc/default/etcd', [etcd_context])
-    ready_contexts = CONFIGS.complete_contexts()
+    configs().register('/etc/init/etcd.conf', [etcd_context])
+    configs().register('/etc/default/etcd', [etcd_context])
+    ready_contexts = configs().complete_contexts()
 
     if ('etcd-proxy' in ready_contexts):
-        log('Force etcd restart')
-        CONFIGS.write('/etc/init/etcd.conf')
-        CONFIGS.write('/etc/default/etcd')
-        force_etcd_restart()
+        log('Reconfigure etcd proxy')
+        configs().write('/etc/init/etcd.conf')
+        configs().write('/etc/default/etcd')
+        restart_etcd_proxy(wipe=etcd_context.wipe)
+
+
+@hooks.hook('update-status')
+def update_status():
+    # Restarts queued by earlier hooks are drained as this hook exits.
+    pass
 
 
 def main():
+    # Batch this hook's log messages into a few juju-log calls.
+    log_buffer.enable(min_level=DEBUG if config('debug') else INFO)
+    # Registered first, so they run after every other atexit callback: the
+    # kv store is written once, after the queued restarts are drained.
+    atexit(unitdata.kv().flush)
+    atexit(drain_restarts, RESTART_FUNCTIONS)
     try:
         hooks.execute(sys.argv)
     except UnregisteredHookError as e:
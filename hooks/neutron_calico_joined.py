@@ -0,0 +1,94 @@
+'''
+Relation-joined hooks.
+
+These only publish this unit's settings to the new relation, so the
+dispatcher runs them from here rather than from neutron_calico_hooks,
+without importing the template renderer, apt, netaddr or netifaces.
+Nothing they do changes a configuration file, so they restart nothing;
+restarts queued by earlier hooks are left to the next hook that does.
+'''
+
+import socket
+import sys
+
+from charmhelpers.contrib.network.addresses import address_snapshot, is_tap
+from charmhelpers.core.hookenv import (
+    DEBUG,
+    INFO,
+    Hooks,
+    UnregisteredHookError,
+    config,
+    log,
+    log_buffer,
+    relation_set,
+    unit_private_ip,
+)
+
+from neutron_calico_facts import address_generation, facts, host_fact
+
+hooks = Hooks()
+
+_LOOPBACK6 = socket.inet_pton(socket.AF_INET6, '::1')
+
+
+def local_ipv6_address():
+    '''
+    Determines the IPv6 address to use to contact this machine. Excludes
+    link-local addresses.
+
+    Currently only returns the first valid IPv6 address found.
+    '''
+    for entry in address_snapshot().addresses:
+        if entry.version != 6 or is_tap(entry.iface):
+            continue
+
+        packed = socket.inet_pton(socket.AF_INET6, entry.addr.split('%')[0])
+        # fe80::/10, or ::1.
+        if (packed[0] == b'\xfe' and ord(packed[1]) & 0xc0 == 0x80) or \
+                packed == _LOOPBACK6:
+            continue
+        return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+facts.register(
+    'local-ipv6-address',
+    lambda: local_ipv6_address(),
+    address_generation)
+
+
+@hooks.hook('neutron-plugin-relation-joined')
+def neutron_plugin_joined(relation_id=None):
+    rel_data = {
+        'enable-metadata': 'True',
+    }
+    relation_set(relation_id=relation_id, **rel_data)
+
+
+@hooks.hook('amqp-relation-joined')
+def amqp_joined(relation_id=None):
+    relation_set(relation_id=relation_id,
+                 username=config('rabbit-user'),
+                 vhost=config('rabbit-vhost'))
+
+
+@hooks.hook('cluster-relation-joined')
+def cluster_joined(relation_id=None):
+    relation_set(relation_id=relation_id,
+                 addr=unit_private_ip(),
+                 addr6=host_fact('local-ipv6-address'))
+
+
+@hooks.hook('bgp-route-reflector-relation-joined')
+def bgp_route_reflector_joined(relation_id=None):
+    relation_set(relation_id=relation_id,
+                 addr=unit_private_ip(),
+                 addr6=host_fact('local-ipv6-address'))
+
+
+def main():
+    # Batch this hook's log messages into a few juju-log calls.
+    log_buffer.enable(min_level=DEBUG if config('debug') else INFO)
+    try:
+        hooks.execute(sys.argv)
+    except UnregisteredHookError as e:
+        log('Unknown hook {} - skipping.'.format(e))
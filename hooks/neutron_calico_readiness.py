@@ -0,0 +1,159 @@
+'''
+Readiness probes for restarted services.
+
+A service that has been restarted is not necessarily doing its job again:
+BIRD has to answer on its control socket, the etcd proxy has to reach the
+cluster, and Felix has to resync from etcd before the dataplane is
+programmed. Whether BIRD's BGP sessions are up depends on its peers too,
+so it is reported (see neutron_calico_bird) rather than waited for.
+
+Each probe in PROBES checks one service once; wait_until_ready polls it
+with exponential backoff, for at most the service's timeout. How long every
+service waited for took to become ready is recorded in the kv store.
+'''
+
+import calendar
+import socket
+import subprocess
+import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import DEBUG, log
+from charmhelpers.core.host import service_running
+
+from neutron_calico_bird import BIRD_SERVICES
+from neutron_calico_etcd import EtcdClient, EtcdError
+
+TIME_TO_READY_KEY = 'neutron-calico.time-to-ready'
+
+# Polling starts at POLL_INITIAL seconds and doubles up to POLL_MAX.
+POLL_INITIAL = 0.25
+POLL_MAX = 4
+
+DEFAULT_TIMEOUT = 30
+TIMEOUTS = {
+    'calico-felix': 60,
+}
+
+FELIX_STATUS_KEY = '/calico/felix/v1/host/%s/status'
+
+
+def poll(check, timeout, initial=POLL_INITIAL, maximum=POLL_MAX):
+    '''
+    Call check until it returns True or timeout seconds have passed,
+    sleeping initial seconds at first and twice as long each time after,
+    up to maximum. Returns whether check passed.
+    '''
+    deadline = time.time() + timeout
+    interval = initial
+    while not check():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, maximum)
+    return True
+
+
+def bird_ready(service, since):
+    '''
+    BIRD answers on its control socket and reports itself up.
+    '''
+    client = BIRD_SERVICES[service][1]
+    try:
+        status = subprocess.check_output([client, 'show', 'status'],
+                                         stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError, OSError):
+        return False
+    return 'Daemon is up and running' in status
+
+
+def etcd_ready(service, since):
+    '''
+    The etcd proxy answers on its health endpoint, and knows the cluster's
+    members.
+    '''
+    client = EtcdClient()
+    try:
+        return client.healthy() and bool(client.members())
+    except EtcdError:
+        return False
+
+
+def _utc_timestamp(value):
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def felix_ready(service, since):
+    '''
+    Felix is running and, once started, has reported its status to etcd,
+    which it does after its first resync. If it does not report status at
+    all, running is all that can be checked.
+    '''
+    if not service_running(service):
+        return False
+    try:
+        status = EtcdClient().get_value(
+            FELIX_STATUS_KEY % socket.gethostname())
+    except EtcdError:
+        return False
+    if status is None:
+        log('Felix does not report its status, only checking it runs',
+            level=DEBUG)
+        return True
+    try:
+        return _utc_timestamp(status['time']) >= int(since)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+PROBES = {
+    'bird': bird_ready,
+    'bird6': bird_ready,
+    'etcd': etcd_ready,
+    'calico-felix': felix_ready,
+}
+
+
+def wait_until_ready(service, since):
+    '''
+    Wait for service, restarted at since, to be ready. Services without a
+    probe are ready once they run. Returns (ready, seconds since since).
+    '''
+    probe = PROBES.get(service)
+    if probe is None:
+        def check():
+            return service_running(service)
+    else:
+        def check():
+            return probe(service, since)
+    ready = poll(check, TIMEOUTS.get(service, DEFAULT_TIMEOUT))
+    return ready, time.time() - since
+
+
+def record_time_to_ready(results):
+    '''
+    Record results, {service: (ready, seconds)}, in the kv store.
+    '''
+    db = unitdata.kv()
+    recorded = time_to_ready()
+    now = time.time()
+    for service, (ready, seconds) in results.items():
+        recorded[service] = {'ready': ready, 'seconds': round(seconds, 3),
+                             'time': now}
+    db.set(TIME_TO_READY_KEY, recorded)
+
+
+def time_to_ready():
+    '''
+    The recorded readiness of services, as {service: {'ready': bool,
+    'seconds': time to ready, 'time': when it was recorded}}.
+    '''
+    return unitdata.kv().get(TIME_TO_READY_KEY) or {}
+
+
+def is_ready(service):
+    '''
+    Whether service was ready the last time it was restarted.
+    '''
+    return time_to_ready().get(service, {}).get('ready', False)
@@ -0,0 +1,174 @@
+'''
+Resolution of peer host names to IPv4 addresses.
+
+Peers publish host names on the cluster and route reflector relations, and
+a deployment can have hundreds of them. Names are resolved concurrently on
+a bounded thread pool using the system resolver only (nothing is installed
+mid-hook), and answers are cached in the unit's kv store for RESOLVER_TTL
+seconds. If a lookup fails the last good answer is used instead, so a
+resolver outage does not drop peers from the BGP configuration.
+'''
+
+import socket
+import time
+
+from collections import OrderedDict
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    DEBUG,
+    WARNING,
+    atexit,
+    log,
+)
+
+RESOLVER_TTL = 300
+RESOLVER_THREADS = 16
+
+
+def is_ipv4(name):
+    '''
+    True if name is already a dotted-quad IPv4 address.
+    '''
+    try:
+        socket.inet_pton(socket.AF_INET, name)
+    except (socket.error, TypeError, ValueError):
+        return False
+    return True
+
+
+def _lookup(name):
+    '''
+    Resolve name, returning (address or None, seconds taken).
+    '''
+    start = time.time()
+    try:
+        addr = socket.getaddrinfo(name, None, socket.AF_INET)[0][4][0]
+    except (socket.error, IndexError, UnicodeError):
+        addr = None
+    return addr, time.time() - start
+
+
+class Resolver(object):
+    '''
+    Concurrent, TTL-cached name resolution.
+
+    Entries are stored in the kv store under `prefix` as
+    {'addr': ..., 'time': ...}, and flushed along with the rest of the
+    unit's state when the hook exits.
+    '''
+    def __init__(self, db=None, prefix='neutron-calico.resolver.',
+                 ttl=RESOLVER_TTL, threads=RESOLVER_THREADS):
+        self._db = db
+        self.prefix = prefix
+        self.ttl = ttl
+        self.threads = threads
+        self.latencies = []
+        self.cached = 0
+        self.stale = 0
+        self.failed = 0
+        self._atexit_registered = False
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = unitdata.kv()
+        return self._db
+
+    def _lookup_all(self, names):
+        if len(names) == 1:
+            return [_lookup(names[0])]
+        # Most peers are addresses already, so this pool is only started,
+        # and multiprocessing loaded, for the occasional batch of names.
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(len(names), self.threads))
+        try:
+            return pool.map(_lookup, names)
+        finally:
+            pool.close()
+            pool.join()
+
+    def resolve(self, names):
+        '''
+        Resolve names, returning {name: address}. The address is None for
+        names that could not be resolved and were never resolved before.
+        '''
+        now = time.time()
+        results = {}
+        pending = []
+        for name in set(names):
+            if is_ipv4(name):
+                results[name] = name
+                continue
+            entry = self.db.get(self.prefix + name)
+            if entry is not None and 0 <= now - entry['time'] < self.ttl:
+                self.cached += 1
+                results[name] = entry['addr']
+            else:
+                pending.append(name)
+        if not pending:
+            return results
+
+        self._register_atexit()
+        for name, (addr, elapsed) in zip(pending,
+                                         self._lookup_all(pending)):
+            self.latencies.append(elapsed)
+            if addr is not None:
+                self.db.set(self.prefix + name, {'addr': addr, 'time': now})
+                results[name] = addr
+                continue
+            entry = self.db.get(self.prefix + name)
+            if entry is not None:
+                log("Failed to resolve '%s', using last known address %s" %
+                    (name, entry['addr']), level=WARNING)
+                self.stale += 1
+                results[name] = entry['addr']
+            else:
+                log("Failed to resolve '%s'" % name, level=WARNING)
+                self.failed += 1
+                results[name] = None
+        return results
+
+    def stats(self):
+        return {'lookups': len(self.latencies),
+                'cached': self.cached,
+                'stale': self.stale,
+                'failed': self.failed,
+                'max_latency': max(self.latencies or [0])}
+
+    def _report(self):
+        stats = self.stats()
+        log('Resolved %d names (max %.3fs), %d cached, %d stale, %d failed' %
+            (stats['lookups'], stats['max_latency'], stats['cached'],
+             stats['stale'], stats['failed']), level=DEBUG)
+
+    def _register_atexit(self):
+        if self._atexit_registered:
+            return
+        atexit(self.db.flush)
+        atexit(self._report)
+        self._atexit_registered = True
+
+
+resolver = Resolver()
+
+
+def resolve_values(names):
+    '''
+    Resolve the values of names, a mapping of keys (units, say) to host
+    names, all at once. Keys whose name cannot be resolved are left out;
+    the order of the others is kept.
+    '''
+    results = resolver.resolve(names.values())
+    return OrderedDict((key, results[name]) for key, name in names.items()
+                       if results[name] is not None)
+
+
+def resolve_address(name, fallback=None):
+    '''
+    Resolve a single name, returning fallback if that is not possible.
+    '''
+    if not name:
+        return fallback
+    addr = resolver.resolve([name])[name]
+    return addr if addr is not None else fallback
@@ -0,0 +1,151 @@
+'''
+Restarting services in dependency order.
+
+restart_services() restarts services in stages. A service waits for the
+services it depends on (SERVICE_DEPENDENCIES) that are restarted along with
+it to be ready (see neutron_calico_readiness); Felix does not reconnect
+into an etcd proxy that is still starting. Nothing else is waited for,
+except services restarted in a rolling restart, whose readiness the leader
+waits on before the next batch. Services in the same stage do
+not depend on each other and are restarted together: with a single
+systemctl call on systemd hosts, otherwise concurrently. The latency of
+every restart, and the time every service took to be ready, are logged and
+returned.
+'''
+
+import subprocess
+import time
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import WARNING, log
+from charmhelpers.core.host import init_is_systemd, service_restart
+
+from neutron_calico_readiness import record_time_to_ready, wait_until_ready
+from neutron_calico_rolling import is_rolling
+
+# service: the services that have to be ready before it restarts. bird,
+# bird6 and nova-api-metadata depend on nothing.
+SERVICE_DEPENDENCIES = {
+    'calico-felix': ['etcd'],
+    'calico-dhcp-agent': ['etcd'],
+}
+
+
+def restart_stages(services):
+    '''
+    Split services into stages to restart in turn: each stage holds the
+    services whose dependencies among services are in earlier stages.
+    '''
+    remaining = list(OrderedDict.fromkeys(services))
+    stages = []
+    while remaining:
+        stage = [service for service in remaining
+                 if not set(SERVICE_DEPENDENCIES.get(service, ())) &
+                 set(remaining)]
+        if not stage:
+            # A dependency cycle: restart what is left together.
+            stage = remaining
+        stages.append(stage)
+        remaining = [service for service in remaining if service not in stage]
+    return stages
+
+
+def _concurrently(f, items):
+    if len(items) == 1:
+        return [f(items[0])]
+    # multiprocessing is loaded only once two services restart together.
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(len(items))
+    try:
+        return pool.map(f, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _restart(services):
+    '''
+    Restart services, a tuple of services restarted by one systemctl call
+    or a single service name. Returns (seconds taken, success).
+    '''
+    start = time.time()
+    if isinstance(services, tuple):
+        ok = subprocess.call(['systemctl', 'restart'] + list(services)) == 0
+    else:
+        ok = service_restart(services)
+    return time.time() - start, ok
+
+
+def _restart_stage(stage, restart_functions, timings):
+    # Restart functions use the kv store, which is tied to this thread, so
+    # they run here, one after the other.
+    plain = []
+    for service in stage:
+        if service in restart_functions:
+            start = time.time()
+            if restart_functions[service](service) is False:
+                log('New configuration of %s not applied' % service,
+                    level=WARNING)
+            timings[service] = time.time() - start
+        else:
+            plain.append(service)
+    if not plain:
+        return
+    if init_is_systemd():
+        tasks = [tuple(plain)]
+    else:
+        tasks = plain
+    for task, (elapsed, ok) in zip(tasks, _concurrently(_restart, tasks)):
+        names = task if isinstance(task, tuple) else (task,)
+        if not ok:
+            log('Failed to restart %s' % ' '.join(names), level=WARNING)
+        for service in names:
+            timings[service] = elapsed
+
+
+def _wait_until_ready(services, since):
+    if not services:
+        return OrderedDict()
+
+    def wait(service):
+        return wait_until_ready(service, since)
+    return OrderedDict(zip(services, _concurrently(wait, services)))
+
+
+def restart_services(services, restart_functions=None):
+    '''
+    Restart services in dependency order, handing those in
+    restart_functions to their function instead. Returns {service:
+    seconds}, with a '<service> ready' entry for the time each service
+    waited for took to be ready.
+    '''
+    restart_functions = restart_functions or {}
+    timings = OrderedDict()
+    stages = restart_stages(services)
+    for i, stage in enumerate(stages):
+        start = time.time()
+        _restart_stage(stage, restart_functions, timings)
+        later = set(service for next_stage in stages[i + 1:]
+                    for service in next_stage)
+        needed = [service for service in stage
+                  if any(service in SERVICE_DEPENDENCIES.get(dependent, ())
+                         for dependent in later)]
+        results = _wait_until_ready(
+            [service for service in stage
+             if service in needed or is_rolling(service)], start)
+        if results:
+            record_time_to_ready(results)
+        for service, (ready, seconds) in results.items():
+            timings['%s ready' % service] = seconds
+            if ready:
+                continue
+            if service in needed:
+                log('%s not ready after restart, restarting its dependents '
+                    'anyway' % service, level=WARNING)
+            else:
+                log('%s not ready after restart' % service, level=WARNING)
+    if timings:
+        log('Restarted services: %s' %
+            ', '.join('%s %.1fs' % timing for timing in timings.items()))
+    return timings
@@ -0,0 +1,222 @@
+'''
+Rolling restarts coordinated by the Juju leader.
+
+A configuration change that reaches every unit, such as debug or new AMQP
+settings, used to restart Felix, the DHCP agent and the metadata agent on
+all of them at once: hundreds of Felix processes resyncing from etcd and
+reconnecting to RabbitMQ at the same moment. With rolling-restart-batch
+set, a unit that has to restart one of ROLLING_SERVICES queues the restart
+(see neutron_calico_deferred) and asks for a restart token by setting
+restart-request on the cluster relation. The leader hands out tokens with
+leader-set, rolling-restart-batch units at a time. A unit that holds one
+restarts, waits for its services to be ready, and reports restart-done;
+once the whole batch has, the leader hands out the next batch. A unit that
+has not reported within ROLLING_TIMEOUT seconds loses its turn and is
+skipped (rolling-restart-skipped) until it reports its restart done or asks
+again, so one broken unit cannot hold up the rest.
+'''
+
+import json
+import time
+
+from charmhelpers.core.hookenv import (
+    WARNING,
+    config,
+    is_leader,
+    leader_get,
+    leader_set,
+    local_unit,
+    log,
+    related_units,
+    relation_get,
+    relation_ids,
+    relation_set,
+    status_set,
+)
+
+from neutron_calico_bgp import unit_number
+from neutron_calico_readiness import is_ready
+
+ROLLING_SERVICES = frozenset([
+    'calico-felix',
+    'calico-dhcp-agent',
+    'neutron-dhcp-agent',
+    'nova-api-metadata',
+])
+
+RESTART_TOKENS_KEY = 'restart-tokens'
+SKIPPED_KEY = 'rolling-restart-skipped'
+REQUEST_KEY = 'restart-request'
+DONE_KEY = 'restart-done'
+
+# How long the leader waits for a batch before moving on without it.
+ROLLING_TIMEOUT = 600
+
+
+def rolling_batch():
+    '''
+    The number of units to restart at a time, or 0 if restarts are not
+    rolled because rolling-restart-batch is not set or this unit has no
+    peers or no leader to coordinate with.
+    '''
+    batch = config('rolling-restart-batch') or 0
+    if not batch or not relation_ids('cluster'):
+        return 0
+    try:
+        leader_get(RESTART_TOKENS_KEY)
+    except NotImplementedError:
+        return 0
+    return batch
+
+
+def is_rolling(service):
+    return service in ROLLING_SERVICES and bool(rolling_batch())
+
+
+def restart_tokens():
+    '''
+    The current batch, {'units': [unit, ...], 'granted': time}.
+    '''
+    value = leader_get(RESTART_TOKENS_KEY)
+    if not value:
+        return {'units': [], 'granted': 0}
+    return json.loads(value)
+
+
+def skipped_units():
+    '''
+    The units that timed out, as {unit: the request they timed out on}.
+    '''
+    value = leader_get(SKIPPED_KEY)
+    if not value:
+        return {}
+    return json.loads(value)
+
+
+def tokens_outstanding():
+    '''
+    True on the leader while restart tokens are handed out, so that it
+    reclaims them from units that never report back.
+    '''
+    if not rolling_batch() or not is_leader():
+        return False
+    return bool(restart_tokens()['units'])
+
+
+def holds_restart_token():
+    if not rolling_batch():
+        return False
+    return local_unit() in restart_tokens()['units']
+
+
+def _own_settings():
+    rid = relation_ids('cluster')[0]
+    return rid, relation_get(rid=rid, unit=local_unit()) or {}
+
+
+def request_restart_token():
+    '''
+    Ask the leader for a restart token, unless this unit already has and
+    has not been skipped for timing out.
+    '''
+    rid, settings = _own_settings()
+    request = settings.get(REQUEST_KEY)
+    if request and request != settings.get(DONE_KEY) and \
+            skipped_units().get(local_unit()) != request:
+        return
+    relation_set(relation_id=rid,
+                 relation_settings={REQUEST_KEY: '%.6f' % time.time()})
+    status_set('waiting', 'Waiting for a rolling restart token')
+
+
+def release_restart_token(services):
+    '''
+    Report the restart requested as done, if services became ready after
+    their restart. Returns False, without reporting, if they did not.
+    '''
+    rid, settings = _own_settings()
+    request = settings.get(REQUEST_KEY)
+    if not request or request == settings.get(DONE_KEY):
+        return True
+    down = [service for service in services if not is_ready(service)]
+    if down:
+        log('Not reporting rolling restart done, not ready: %s' %
+            ', '.join(down), level=WARNING)
+        status_set('blocked', 'Rolling restart: %s not ready' %
+                   ', '.join(down))
+        return False
+    relation_set(relation_id=rid, relation_settings={DONE_KEY: request})
+    status_set('active', 'Unit is ready')
+    return True
+
+
+def waiting_requests():
+    '''
+    {unit: request} for the units, this one included, that asked for a
+    restart token and have not reported the restart done.
+    '''
+    waiting = {}
+    for rid in relation_ids('cluster'):
+        for unit in related_units(rid) + [local_unit()]:
+            settings = relation_get(rid=rid, unit=unit) or {}
+            request = settings.get(REQUEST_KEY)
+            if request and request != settings.get(DONE_KEY):
+                waiting[unit] = request
+    return waiting
+
+
+def waiting_units():
+    '''
+    The units that asked for a restart token and have not reported the
+    restart done, by unit number.
+    '''
+    return sorted(waiting_requests(), key=unit_number)
+
+
+def coordinate_restarts():
+    '''
+    On the leader, hand out the next batch of restart tokens once the
+    current batch has restarted or timed out. Returns True if it did.
+    '''
+    batch = rolling_batch()
+    if not batch or not is_leader():
+        return False
+    tokens = restart_tokens()
+    requests = waiting_requests()
+    # A skipped unit is forgotten once it reports done or asks again.
+    skipped = dict((unit, request)
+                   for unit, request in skipped_units().items()
+                   if requests.get(unit) == request)
+    waiting = [unit for unit in sorted(requests, key=unit_number)
+               if unit not in skipped]
+    busy = [unit for unit in tokens['units'] if unit in waiting]
+    if busy:
+        if time.time() - tokens['granted'] < ROLLING_TIMEOUT:
+            status_set('active', 'Rolling restart: %d restarting, %d '
+                       'waiting' % (len(busy), len(waiting) - len(busy)))
+            return False
+        log('Rolling restart of %s timed out, skipping it until it reports '
+            'back' % ', '.join(busy), level=WARNING)
+        for unit in busy:
+            skipped[unit] = requests[unit]
+        waiting = [unit for unit in waiting if unit not in busy]
+    units = waiting[:batch]
+    settings = {}
+    if skipped != skipped_units():
+        settings[SKIPPED_KEY] = json.dumps(skipped, sort_keys=True,
+                                           separators=(',', ':'))
+    if units == tokens['units'] == []:
+        if settings:
+            leader_set(settings)
+        return False
+    log('Rolling restart: granting tokens to %s, %d more waiting' %
+        (' '.join(units) or 'no units', len(waiting) - len(units)))
+    settings[RESTART_TOKENS_KEY] = json.dumps(
+        {'units': units, 'granted': time.time()}, separators=(',', ':'))
+    leader_set(settings)
+    if units:
+        status_set('active', 'Rolling restart: %d restarting, %d waiting' %
+                   (len(units), len(waiting) - len(units)))
+    else:
+        status_set('active', 'Unit is ready')
+    return True
@@ -1,10 +1,9 @@
 import os
 import shutil
 import glob
-import netaddr
-import netifaces
+import subprocess
+import time
 from charmhelpers.contrib.openstack.neutron import neutron_plugin_attribute
-from copy import deepcopy
 
 from charmhelpers.core.hookenv import config, log
 from charmhelpers.core.host import (
@@ -19,13 +18,29 @@ from charmhelpers.contrib.openstack.utils import (
     os_release,
     get_os_codename_install_source,
 )
+from charmhelpers.fetch.archiveurl import ArchiveUrlFetchHandler
+from charmhelpers.fetch.dpkgstatus import dpkg_status_index
 from charmhelpers.fetch import (
     add_source,
-    apt_update,
+    apt_cache,
+    apt_dependency_closure,
+    apt_upgradable_packages,
+    apt_update_if_needed,
     apt_upgrade,
-    apt_install
+    apt_install_all,
+    filter_installed_packages,
+    filter_upgradable_packages,
 )
 import neutron_calico_context
+from neutron_calico_bird import BIRD_CONF, BIRD6_CONF, reload_bird
+from neutron_calico_restart import restart_services
+from neutron_calico_facts import (
+    dpkg_key,
+    facts,
+    file_key,
+    host_fact,
+    value_key,
+)
 
 NOVA_CONF_DIR = "/etc/nova"
 NEUTRON_CONF_DIR = "/etc/neutron"
@@ -35,49 +50,45 @@ ML2_CONF = '%s/plugins/ml2/ml2_conf.ini' % NEUTRON_CONF_DIR
 FELIX_CONF_DIR = '/etc/calico'
 FELIX_CONF = FELIX_CONF_DIR + '/felix.cfg'
 DHCP_CONF = "%s/dhcp_agent.ini" % NEUTRON_CONF_DIR
-BIRD_CONF_DIR = "/etc/bird"
-BIRD_CONF = "%s/bird.conf" % BIRD_CONF_DIR
-BIRD6_CONF = "%s/bird6.conf" % BIRD_CONF_DIR
-
-DHCP_AGENT = 'neutron-dhcp-agent'
-if get_os_codename_install_source(config('openstack-origin')) >= 'liberty':
-    DHCP_AGENT = 'calico-dhcp-agent'
-
-BASE_RESOURCE_MAP = OrderedDict([
-    (NEUTRON_CONF, {
-        'services': ['calico-felix',
-                     DHCP_AGENT,
-                     'nova-api-metadata'],
-        'contexts': [neutron_calico_context.CalicoPluginContext(),
-                     context.AMQPContext()],
-    }),
-    (DHCP_CONF, {
-        'services': [DHCP_AGENT],
-        'contexts': [neutron_calico_context.CalicoPluginContext()],
-    })
-])
-BIRD_RESOURCE_MAP = {
-    'services': ['bird'],
-    'contexts': [neutron_calico_context.CalicoPluginContext()],
-}
-BIRD6_RESOURCE_MAP = {
-    'services': ['bird6'],
-    'contexts': [neutron_calico_context.CalicoPluginContext()],
-}
+
 TEMPLATES = 'templates/'
 
+# The new version of dnsmasq brings in new dependencies, which apt-get
+# upgrade holds back, so we need to explicitly install it.
+UPGRADE_PACKAGES = ['dnsmasq-base']
+
+# What upgrade-scope=calico upgrades, on top of the Calico plugin packages.
+SCOPED_UPGRADE_PACKAGES = UPGRADE_PACKAGES + ['bird', 'etcd']
+SCOPED_UPGRADE_OPTIONS = ['--option=Dpkg::Options::=--force-confold',
+                          '--only-upgrade']
+
+facts.register(
+    'openstack-release',
+    lambda: os_release('neutron-common', base='icehouse'),
+    dpkg_key)
+facts.register(
+    'install-source-codename',
+    lambda: get_os_codename_install_source(config('openstack-origin')),
+    lambda: [value_key(config('openstack-origin')),
+             file_key('/etc/lsb-release')])
+facts.register(
+    'calico-packages',
+    lambda: neutron_plugin_attribute('Calico', 'packages', 'neutron'),
+    lambda: [dpkg_key(), os.uname()[2]])
+
 
 def additional_install_locations():
     '''
     Add any required additional install locations of the charm. This
-    will also force an immediate upgrade.
+    will also force an immediate upgrade, of the whole host or, with
+    upgrade-scope=calico, of just the Calico stack.
     '''
     calico_source = 'ppa:project-calico/icehouse'
 
     if config('calico-origin') != 'default':
         calico_source = config('calico-origin')
     else:
-        release = get_os_codename_install_source(config('openstack-origin'))
+        release = host_fact('install-source-codename')
         if release in ('icehouse', 'juno', 'kilo'):
             # Prior to the Liberty release, Calico's Nova and Neutron changes
             # were not fully upstreamed, so we need to point to a
@@ -95,16 +106,40 @@ def additional_install_locations():
     add_source(calico_source)
     add_source('ppa:cz.nic-labs/bird')
 
-    apt_update()
-    apt_upgrade()
-
-    # The new version of dnsmasq brings in new dependencies, so we need
-    # to explicitly install it.
-    apt_install(['dnsmasq-base'])
+    apt_update_if_needed()
+    if config('upgrade-scope') == 'calico':
+        scoped_upgrade()
+    else:
+        apt_upgrade()
 
     return
 
 
+def scoped_upgrade():
+    '''
+    Upgrade only the Calico stack and the packages it depends on, instead of
+    the whole host.
+    '''
+    start = time.time()
+    cache = apt_cache()
+    upgradable = set(apt_upgradable_packages(cache))
+    scope = apt_dependency_closure(
+        flatten_packages(determine_packages()) + SCOPED_UPGRADE_PACKAGES,
+        cache)
+    pkgs = sorted(upgradable & scope)
+    if pkgs:
+        apt_install_all(pkgs, options=SCOPED_UPGRADE_OPTIONS, fatal=True)
+    elapsed = time.time() - start
+    skipped = len(upgradable) - len(pkgs)
+    if pkgs:
+        saved = '~%.0fs' % (elapsed / len(pkgs) * skipped)
+    else:
+        saved = 'unknown time'
+    log('Scoped upgrade: upgraded %d of %d upgradable packages in %.1fs, '
+        'skipping %d packages and saving %s over a full upgrade' %
+        (len(pkgs), len(upgradable), elapsed, skipped, saved))
+
+
 def maybe_create_felix_cfg():
     # Write a Felix config file to set the etcd address and perhaps to disable
     # Calico usage reporting.
@@ -119,11 +154,71 @@ EtcdAddr = 127.0.0.1:4001
 
 
 def determine_packages():
-    return neutron_plugin_attribute('Calico', 'packages', 'neutron')
+    return host_fact('calico-packages')
+
+
+def flatten_packages(groups):
+    '''
+    Flatten a list of packages and package lists, dropping duplicates.
+    '''
+    pkgs = []
+    for group in groups:
+        if isinstance(group, basestring):
+            group = [group]
+        pkgs.extend(p for p in group if p not in pkgs)
+    return pkgs
+
+
+def install_packages():
+    '''
+    Install the packages the charm needs, and UPGRADE_PACKAGES, which are
+    also upgraded if apt-get upgrade would hold them back, in a single apt
+    transaction. Nothing is run if they are all installed and up to date
+    already.
+    '''
+    pkgs = filter_installed_packages(
+        flatten_packages(determine_packages() + [UPGRADE_PACKAGES]))
+    pkgs.extend(p for p in filter_upgradable_packages(UPGRADE_PACKAGES)
+                if p not in pkgs)
+    if not pkgs:
+        log('All packages already installed')
+        return
+    apt_install_all(pkgs, fatal=True)
+
+
+def deb_fields(path, *fields):
+    '''
+    Read control fields from a .deb file.
+    '''
+    output = subprocess.check_output(['dpkg-deb', '-f', path] + list(fields))
+    values = {}
+    for line in output.splitlines():
+        if ':' in line:
+            field, value = line.split(':', 1)
+            values[field.strip()] = value.strip()
+    return values
+
+
+def install_etcd_package():
+    '''
+    Install the etcd package from etcd-package-url, if set. The download is
+    cached, and dpkg is skipped if the same version is already installed.
+    '''
+    url = config('etcd-package-url')
+    if not url or not url.startswith('http'):
+        return
+    deb = ArchiveUrlFetchHandler().download_cached(
+        url, checksum=config('etcd-package-checksum') or None)
+    fields = deb_fields(deb, 'Package', 'Version')
+    installed = dpkg_status_index().installed_version(fields['Package'])
+    if installed == fields['Version']:
+        log('%s %s is already installed' % (fields['Package'], installed))
+        return
+    subprocess.check_call(['dpkg', '-i', deb])
 
 
 def register_configs(release=None):
-    release = release or os_release('neutron-common', base='icehouse')
+    release = release or host_fact('openstack-release')
     configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
                                           openstack_release=release)
     for cfg, rscs in resource_map().iteritems():
@@ -131,18 +226,47 @@ def register_configs(release=None):
     return configs
 
 
+def dhcp_agent():
+    '''
+    The DHCP agent for this unit: the Calico DHCP agent from Liberty
+    onwards, the Neutron DHCP agent before that.
+    '''
+    if host_fact('install-source-codename') >= 'liberty':
+        return 'calico-dhcp-agent'
+    return 'neutron-dhcp-agent'
+
+
 def resource_map():
     '''
     Dynamically generate a map of resources that will be managed for a single
     hook execution.
     '''
-    resource_map = deepcopy(BASE_RESOURCE_MAP)
+    # One instance for every file, so the renderer evaluates it only once.
+    calico_context = neutron_calico_context.CalicoPluginContext()
+    resource_map = OrderedDict([
+        (NEUTRON_CONF, {
+            'services': ['calico-felix',
+                         dhcp_agent(),
+                         'nova-api-metadata'],
+            'contexts': [calico_context, context.AMQPContext()],
+        }),
+        (DHCP_CONF, {
+            'services': [dhcp_agent()],
+            'contexts': [calico_context],
+        })
+    ])
 
     if not config('keep-bird-config'):
         # Service config allows us to change the BIRD config.
-        resource_map[BIRD_CONF] = BIRD_RESOURCE_MAP
+        resource_map[BIRD_CONF] = {
+            'services': ['bird'],
+            'contexts': [calico_context],
+        }
         if config('enable-ipv6'):
-            resource_map[BIRD6_CONF] = BIRD6_RESOURCE_MAP
+            resource_map[BIRD6_CONF] = {
+                'services': ['bird6'],
+                'contexts': [calico_context],
+            }
     else:
         log('keep-bird-config tells us not to touch existing BIRD config')
 
@@ -157,22 +281,12 @@ def restart_map():
     return {k: v['services'] for k, v in resource_map().iteritems()}
 
 
-def local_ipv6_address():
-    '''
-    Determines the IPv6 address to use to contact this machine. Excludes
-    link-local addresses.
-
-    Currently only returns the first valid IPv6 address found.
-    '''
-    for iface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(iface)
-
-        for addr in addresses.get(netifaces.AF_INET6, []):
-            # Make sure we strip any interface specifier from the address.
-            addr = netaddr.IPAddress(addr['addr'].split('%')[0])
-
-            if not (addr.is_link_local() or addr.is_loopback()):
-                return str(addr)
+# Services that apply a new configuration without restarting, for
+# restart_on_change.
+RESTART_FUNCTIONS = {
+    'bird': reload_bird,
+    'bird6': reload_bird,
+}
 
 
 def force_etcd_restart():
@@ -187,11 +301,30 @@ def force_etcd_restart():
     service_start('etcd')
 
 
+def restart_etcd_proxy(wipe=False):
+    '''
+    Restart the etcd proxy after its configuration has changed, then its
+    clients. The proxy's state is wiped only if wipe is set, that is when
+    the new cluster has no member in common with the old one; otherwise
+    the proxy keeps its view of the cluster and picks up the new members
+    from it. Felix and the Calico DHCP agent are restarted only once the
+    proxy answers, so that they do not reconnect into a proxy that is
+    still starting.
+    '''
+    services = ['etcd', 'calico-felix']
+    if dhcp_agent() == 'calico-dhcp-agent':
+        services.append('calico-dhcp-agent')
+    restart_functions = {}
+    if wipe:
+        restart_functions['etcd'] = lambda service: force_etcd_restart()
+    restart_services(services, restart_functions)
+
+
 def configure_dhcp_agents():
     '''
     If we're using the Calico DHCP agent, ensure that the Neutron DHCP agent is
     stopped and disabled.
     '''
-    if DHCP_AGENT == 'calico-dhcp-agent':
+    if dhcp_agent() == 'calico-dhcp-agent':
         # Stop and disable the Neutron DHCP agent.
         service_pause('neutron-dhcp-agent')
@@ -1,2 +1,5 @@
+import os
 import sys
 sys.path.append('hooks/')
+# Keep unitdata.kv() off the real charm directory.
+os.environ['UNIT_STATE_DB'] = ':memory:'
@@ -0,0 +1,168 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+from charmhelpers.fetch import dpkgstatus
+from charmhelpers.fetch.dpkgstatus import (
+    DpkgStatusIndex,
+    upstream_version,
+)
+import charmhelpers.fetch as fetch
+import charmhelpers.contrib.openstack.utils as openstack_utils
+
+STATUS = '''Package: neutron-common
+Status: install ok installed
+Priority: optional
+Architecture: all
+Version: 1:2015.1.2-0ubuntu2~cloud0
+Description: Neutron is a virtual network service for Openstack - common
+ Neutron is a virtual network service for Openstack.
+ .
+ Package: this continuation line is not a field
+
+Package: nova-common
+Status: deinstall ok config-files
+Architecture: all
+Version: 1:2015.1.2-0ubuntu2~cloud0
+
+Package: bird
+Status: install ok half-configured
+Architecture: amd64
+Version: 1.5.0-4
+
+Package: libc6
+Status: install ok installed
+Architecture: amd64
+Multi-Arch: same
+Version: 2.19-0ubuntu6.9
+
+Package: libc6
+Status: install ok installed
+Architecture: i386
+Multi-Arch: same
+Version: 2.19-0ubuntu6.9
+
+Package: dnsmasq-base
+Status: purge ok not-installed
+Architecture: amd64
+
+Package: swift
+Status: install ok installed
+Architecture: all
+Version: 2.2.2-0ubuntu1
+'''
+
+
+class DpkgStatusIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.status = os.path.join(self.tmpdir, 'status')
+        self.cache = os.path.join(self.tmpdir, 'index.json')
+        with open(self.status, 'w') as f:
+            f.write(STATUS)
+        self.index = DpkgStatusIndex(status_path=self.status,
+                                     cache_path=self.cache, arch='amd64')
+
+    def test_installed_versions(self):
+        expect = {
+            'neutron-common': '1:2015.1.2-0ubuntu2~cloud0',
+            'nova-common': None,
+            'bird': '1.5.0-4',
+            'libc6': '2.19-0ubuntu6.9',
+            'libc6:i386': '2.19-0ubuntu6.9',
+            'dnsmasq-base': None,
+            'swift': '2.2.2-0ubuntu1',
+            'calico-felix': None,
+        }
+        for package, version in expect.items():
+            self.assertEqual(self.index.installed_version(package), version,
+                             package)
+        self.assertTrue(self.index.known('nova-common'))
+        self.assertFalse(self.index.known('calico-felix'))
+        self.assertFalse(self.index.known('this'))
+
+    def test_disk_cache(self):
+        self.index.refresh()
+        self.assertTrue(os.path.exists(self.cache))
+        other = DpkgStatusIndex(status_path=self.status,
+                                cache_path=self.cache, arch='amd64')
+        with patch.object(dpkgstatus, 'parse_status') as parse:
+            self.assertEqual(other.installed_version('bird'), '1.5.0-4')
+            self.assertFalse(parse.called)
+
+    def test_failed_cache_write_leaves_no_temp_file(self):
+        with patch.object(dpkgstatus.json, 'dump', side_effect=IOError):
+            self.assertEqual(self.index.installed_version('bird'), '1.5.0-4')
+        self.assertEqual(
+            [n for n in os.listdir(os.path.dirname(self.cache))
+             if n.startswith('.dpkg-index')], [])
+        self.assertFalse(os.path.exists(self.cache))
+
+    def test_reloads_when_status_changes(self):
+        self.assertEqual(self.index.installed_version('calico-felix'), None)
+        with open(self.status, 'a') as f:
+            f.write('\nPackage: calico-felix\nStatus: install ok installed\n'
+                    'Architecture: amd64\nVersion: 1.4.0-1\n')
+        self.assertEqual(self.index.installed_version('calico-felix'),
+                         '1.4.0-1')
+
+    def test_missing_status_file(self):
+        index = DpkgStatusIndex(status_path=self.status + '.missing',
+                                arch='amd64')
+        self.assertEqual(index.installed_version('bird'), None)
+
+    def test_upstream_version(self):
+        self.assertEqual(upstream_version('1:2015.1.2-0ubuntu2~cloud0'),
+                         '2015.1.2')
+        self.assertEqual(upstream_version('2.2.2'), '2.2.2')
+        self.assertEqual(upstream_version('1.0-a-1'), '1.0-a')
+
+    def test_filter_installed_packages(self):
+        with patch.object(fetch, 'dpkg_status_index') as dpkg_status_index:
+            dpkg_status_index.return_value = self.index
+            self.assertEqual(
+                fetch.filter_installed_packages(
+                    ['neutron-common', 'nova-common', 'bird', 'dnsmasq-base',
+                     'calico-felix']),
+                ['nova-common', 'dnsmasq-base', 'calico-felix'])
+
+    def test_get_os_codename_package(self):
+        with patch.object(openstack_utils,
+                          'dpkg_status_index') as dpkg_status_index:
+            dpkg_status_index.return_value = self.index
+            self.assertEqual(
+                openstack_utils.get_os_codename_package('neutron-common'),
+                'kilo')
+            self.assertEqual(
+                openstack_utils.get_os_codename_package('swift'), 'kilo')
+            self.assertEqual(
+                openstack_utils.get_os_codename_package('nova-common',
+                                                        fatal=False),
+                None)
+            self.assertEqual(
+                openstack_utils.get_os_codename_package('calico-felix',
+                                                        fatal=False),
+                None)
+
+    @unittest.skipUnless(os.path.exists(dpkgstatus.DPKG_STATUS),
+                         'no dpkg status file on this host')
+    def test_matches_dpkg_query(self):
+        out = subprocess.check_output([
+            'dpkg-query', '-W', '-f',
+            '${Package} ${Architecture} ${db:Status-Status} ${Version}\n'])
+        index = DpkgStatusIndex()
+        for line in out.decode('UTF-8').splitlines():
+            fields = line.split()
+            name, arch, status = fields[:3]
+            if arch not in (index.arch, 'all'):
+                name = '{}:{}'.format(name, arch)
+            if status in dpkgstatus.NOT_INSTALLED_STATES:
+                self.assertTrue(index.known(name), name)
+            else:
+                self.assertEqual(index.installed_version(name), fields[3])
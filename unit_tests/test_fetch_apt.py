@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+import charmhelpers.fetch as fetch
+from charmhelpers.core import unitdata
+
+APT_CMD = ['apt-get', '--assume-yes',
+           '--option=Dpkg::Options::=--force-confold', 'install']
+
+
+class AptInstallAllTest(unittest.TestCase):
+
+    def setUp(self):
+        for name in ('_run_apt_command', 'log'):
+            patcher = patch.object(fetch, name)
+            setattr(self, name.lstrip('_'), patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_single_transaction(self):
+        self.run_apt_command.return_value = 0
+        self.assertEqual(fetch.apt_install_all(['a', 'b'], fatal=True), [])
+        self.run_apt_command.assert_called_once_with(APT_CMD + ['a', 'b'],
+                                                     True)
+
+    def test_reports_failed_packages(self):
+        results = {'a': 0, 'b': 100}
+
+        def _run(cmd, fatal=False):
+            if len(cmd) > len(APT_CMD) + 1:
+                return 100
+            return results[cmd[-1]]
+        self.run_apt_command.side_effect = _run
+        self.assertEqual(fetch.apt_install_all(['a', 'b']), ['b'])
+        self.log.assert_any_call('Failed to install package b',
+                                 level='ERROR')
+
+    def test_fatal_raises_after_reporting(self):
+        error = subprocess.CalledProcessError(100, APT_CMD)
+
+        def _run(cmd, fatal=False):
+            if fatal:
+                raise error
+            return 0 if cmd[-1] == 'a' else 100
+        self.run_apt_command.side_effect = _run
+        self.assertRaises(subprocess.CalledProcessError,
+                          fetch.apt_install_all, ['a', 'b'], fatal=True)
+        self.log.assert_any_call('Failed to install package b',
+                                 level='ERROR')
+
+    def test_fatal_raises_on_failed_return_code(self):
+        # Only a missing apt lock makes the fatal call raise itself.
+        self.run_apt_command.side_effect = \
+            lambda cmd, fatal=False: 0 if cmd[-1] == 'a' else 100
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            fetch.apt_install_all(['a', 'b'], fatal=True)
+        self.assertEqual(ctx.exception.returncode, 100)
+        self.assertEqual(ctx.exception.cmd, APT_CMD + ['a', 'b'])
+
+
+class FilterUpgradablePackagesTest(unittest.TestCase):
+
+    @patch.object(fetch, 'apt_cache')
+    @patch.object(fetch, 'dpkg_status_index')
+    def test_nothing_installed_skips_apt_cache(self, _index, _apt_cache):
+        _index.return_value.installed_version.return_value = None
+        self.assertEqual(fetch.filter_upgradable_packages(['dnsmasq-base']),
+                         [])
+        self.assertFalse(_apt_cache.called)
+
+
+class AptUpdateIfNeededTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sources = os.path.join(self.tmpdir, 'sources.list')
+        self.lists = os.path.join(self.tmpdir, 'lists')
+        os.mkdir(self.lists)
+        with open(self.sources, 'w') as f:
+            f.write('deb http://archive.ubuntu.com/ubuntu trusty main\n')
+        for name, value in (('APT_SOURCES_GLOBS', (self.sources,)),
+                            ('APT_LISTS_DIR', self.lists)):
+            patcher = patch.object(fetch, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(fetch, 'apt_update')
+        self.apt_update = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.apt_update.side_effect = self._update
+        patcher = patch.object(fetch, 'atexit')
+        self.atexit = patcher.start()
+        self.addCleanup(patcher.stop)
+        unitdata.kv().unset(fetch.APT_UPDATE_KEY)
+
+    def _update(self, fatal=False):
+        open(os.path.join(self.lists, 'archive_trusty_Packages'), 'w').close()
+        return 0
+
+    def test_skips_second_update(self):
+        self.assertTrue(fetch.apt_update_if_needed())
+        self.assertFalse(fetch.apt_update_if_needed())
+        self.apt_update.assert_called_once_with(False)
+
+    def test_timestamp_flushed_at_hook_exit(self):
+        with patch.object(unitdata.kv(), 'flush') as flush:
+            fetch.apt_update_if_needed()
+            self.assertFalse(flush.called)
+            self.atexit.assert_called_once_with(flush)
+
+    def test_updates_after_source_change(self):
+        fetch.apt_update_if_needed()
+        with open(self.sources, 'a') as f:
+            f.write('deb http://ppa.launchpad.net/project-calico/calico-1.4 '
+                    'trusty main\n')
+        self.assertTrue(fetch.apt_update_if_needed())
+        self.assertFalse(fetch.apt_update_if_needed())
+        self.assertEqual(self.apt_update.call_count, 2)
+
+    def test_updates_stale_lists(self):
+        fetch.apt_update_if_needed()
+        self.assertTrue(fetch.apt_update_if_needed(max_age=0))
+
+    def test_failed_update_is_retried(self):
+        self.apt_update.side_effect = None
+        self.apt_update.return_value = 100
+        fetch.apt_update_if_needed()
+        self.assertTrue(fetch.apt_update_if_needed())
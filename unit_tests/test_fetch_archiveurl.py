@@ -0,0 +1,94 @@
+import BaseHTTPServer
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from charmhelpers.core.host import ChecksumError
+from charmhelpers.fetch.archiveurl import ArchiveUrlFetchHandler
+
+PAYLOAD = b'!<arch>\n' + b'x' * (200 * 1024)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+ETAG = '"etcd-2.3.7"'
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves PAYLOAD at any path, honouring If-None-Match."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.payload)))
+        self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadCachedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.payload = PAYLOAD
+        self.server.etag = ETAG
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/pool/etcd_2.3.7_amd64.deb' % (
+            self.server.server_address[1])
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.handler = ArchiveUrlFetchHandler()
+
+    def _download(self, **kwargs):
+        return self.handler.download_cached(self.url,
+                                            cache_dir=self.cache_dir,
+                                            **kwargs)
+
+    def test_content_addressed(self):
+        path = self._download()
+        self.assertEqual(path, os.path.join(self.cache_dir, PAYLOAD_SHA256,
+                                            'etcd_2.3.7_amd64.deb'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+    def test_unchanged_file_is_not_downloaded_again(self):
+        first = self._download()
+        self.assertEqual(self._download(), first)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         [PAYLOAD_SHA256, 'index.json'])
+
+    def test_changed_file_is_downloaded(self):
+        self._download()
+        self.server.payload = b'!<arch>\nnew'
+        self.server.etag = '"etcd-2.3.8"'
+        path = self._download()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'!<arch>\nnew')
+
+    def test_known_checksum_skips_request(self):
+        self._download()
+        self._download(checksum=PAYLOAD_SHA256)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_bad_checksum(self):
+        self.assertRaises(ChecksumError, self._download, checksum='0' * 64)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_other_hash_type(self):
+        path = self._download(checksum=hashlib.md5(PAYLOAD).hexdigest(),
+                              hash_type='md5')
+        self.assertTrue(os.path.isfile(path))
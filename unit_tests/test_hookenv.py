@@ -0,0 +1,239 @@
+import json
+import unittest
+
+from mock import patch
+
+from charmhelpers.core import hookenv
+
+
+class RelationSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.bags = {
+            'cluster:1': {'neutron-calico/1': {'addr': '10.0.0.11',
+                                               'addr6': 'aa::11'},
+                          'neutron-calico/0': {'addr': '10.0.0.10'}},
+        }
+        for target, value in [
+                ('relation_snapshot', hookenv.RelationSnapshot()),
+                ('atexit', lambda *args: None)]:
+            patcher = patch.object(hookenv, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(hookenv.subprocess, 'check_output',
+                               side_effect=self._check_output)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict('os.environ',
+                             {'JUJU_UNIT_NAME': 'neutron-calico/0'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _check_output(self, args, **kwargs):
+        self.calls.append(args[0])
+        if args[0] == 'relation-ids':
+            return b'["cluster:1"]'
+        if args[0] == 'relation-list':
+            return b'["neutron-calico/1"]'
+        if args[0] == 'relation-get':
+            return json.dumps(self.bags[args[3]][args[5]]).encode('UTF-8')
+        if args[0] == 'relation-set':
+            return '--file'
+        raise AssertionError('unexpected %r' % (args,))
+
+    def test_repeated_reads_fork_once(self):
+        for _ in range(3):
+            self.assertEqual(hookenv.relation_ids('cluster'), ['cluster:1'])
+            self.assertEqual(hookenv.related_units('cluster:1'),
+                             ['neutron-calico/1'])
+            self.assertEqual(hookenv.relation_get(
+                'addr', unit='neutron-calico/1', rid='cluster:1'),
+                '10.0.0.11')
+            self.assertEqual(hookenv.relation_get(
+                'addr6', unit='neutron-calico/1', rid='cluster:1'), 'aa::11')
+        self.assertEqual(self.calls,
+                         ['relation-ids', 'relation-list', 'relation-get'])
+        self.assertEqual(hookenv.relation_snapshot.stats(),
+                         {'forks': 3, 'forks_saved': 9})
+
+    def test_relation_get_returns_a_copy(self):
+        settings = hookenv.relation_get(unit='neutron-calico/1',
+                                        rid='cluster:1')
+        settings['addr'] = '10.9.9.9'
+        self.assertEqual(hookenv.relation_get(
+            'addr', unit='neutron-calico/1', rid='cluster:1'), '10.0.0.11')
+
+    @patch.object(hookenv.subprocess, 'check_call')
+    def test_relation_set_invalidates_local_unit(self, check_call):
+        hookenv.relation_get('addr', unit='neutron-calico/0',
+                             rid='cluster:1')
+        hookenv.relation_get('addr', unit='neutron-calico/1',
+                             rid='cluster:1')
+        self.bags['cluster:1']['neutron-calico/0'] = {'addr': '10.0.0.20'}
+        hookenv.relation_set(relation_id='cluster:1',
+                             relation_settings={'addr': '10.0.0.20'})
+        del self.calls[:]
+        self.assertEqual(hookenv.relation_get(
+            'addr', unit='neutron-calico/0', rid='cluster:1'), '10.0.0.20')
+        self.assertEqual(hookenv.relation_get(
+            'addr', unit='neutron-calico/1', rid='cluster:1'), '10.0.0.11')
+        # Only the local unit's settings are fetched again.
+        self.assertEqual(self.calls, ['relation-get'])
+
+
+class HookCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = hookenv.HookCache(maxsize=3)
+        self.reports = []
+        for target, value in [
+                ('cache', self.cache),
+                ('atexit', lambda *args: self.reports.append(args))]:
+            patcher = patch.object(hookenv, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.calls = []
+
+        @hookenv.cached
+        def lookup(*args, **kwargs):
+            self.calls.append(args)
+            return len(self.calls)
+        self.lookup = lookup
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.lookup('a'), 1)
+        self.assertEqual(self.lookup('a'), 1)
+        self.assertEqual(self.lookup('b'), 2)
+        self.assertEqual(self.cache.stats(), {'entries': 2, 'hits': 1,
+                                              'misses': 2, 'evictions': 0})
+
+    def test_tag_invalidation(self):
+        self.lookup('cluster:1', 'neutron-calico/1')
+        self.lookup('cluster:1', 'neutron-calico/2')
+        self.lookup(rid='cluster:2', unit='neutron-calico/1')
+        hookenv.flush('neutron-calico/1')
+        self.assertEqual(len(self.cache), 1)
+        self.lookup('cluster:1', 'neutron-calico/1')
+        self.lookup('cluster:1', 'neutron-calico/2')
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(self.cache.invalidate(self.lookup, 'cluster:2'), 0)
+        self.assertEqual(self.cache.invalidate(self.lookup, 'cluster:1'), 2)
+
+    def test_unhashable_arguments(self):
+        self.assertEqual(self.lookup('cluster:1', ['addr', 'addr6']), 1)
+        self.assertEqual(self.lookup('cluster:1', ['addr', 'addr6']), 1)
+        self.assertEqual(self.lookup('cluster:1', ['addr']), 2)
+        hookenv.flush('cluster:1')
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.lookup('cluster:1', ['addr', 'addr6']), 3)
+
+    def test_lru_eviction(self):
+        for arg in 'abc':
+            self.lookup(arg)
+        # 'a' is used again, so 'b' is the least recently used.
+        self.lookup('a')
+        self.lookup('d')
+        self.assertEqual(self.cache.evictions, 1)
+        self.lookup('a')
+        self.lookup('b')
+        self.assertEqual(self.calls, [('a',), ('b',), ('c',), ('d',),
+                                      ('b',)])
+        self.assertEqual(len(self.cache), 3)
+
+    @patch.object(hookenv.subprocess, 'check_call')
+    @patch.object(hookenv.subprocess, 'check_output')
+    def test_leader_set_invalidates_leader_get(self, check_output,
+                                               check_call):
+        check_output.return_value = b'"1"'
+        self.assertEqual(hookenv.leader_get('restart-tokens'), '1')
+        self.assertEqual(hookenv.leader_get('restart-tokens'), '1')
+        self.assertEqual(check_output.call_count, 1)
+        hookenv.leader_set({'restart-tokens': '2'})
+        check_output.return_value = b'"2"'
+        self.assertEqual(hookenv.leader_get('restart-tokens'), '2')
+        self.assertEqual(check_output.call_count, 2)
+
+    @patch.object(hookenv, 'log')
+    def test_stats_reported_at_exit(self, log):
+        self.lookup('a')
+        self.lookup('a')
+        self.assertEqual(self.reports, [(self.cache.report,)])
+        self.cache.report()
+        log.assert_called_once_with(
+            'Hook cache: 1 entries, 1 hits, 1 misses, 0 evictions',
+            level=hookenv.DEBUG)
+
+
+class LogBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = hookenv.LogBuffer()
+        for target, value in [('log_buffer', self.buffer), ('_atexit', [])]:
+            patcher = patch.object(hookenv, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(hookenv._interpreter_atexit, 'register')
+        self.register = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(hookenv.subprocess, 'call')
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _juju_log(self):
+        return [c[0][0] for c in self.call.call_args_list]
+
+    def test_unbuffered(self):
+        hookenv.log('one')
+        hookenv.log('two', level=hookenv.WARNING)
+        self.assertEqual(self._juju_log(),
+                         [['juju-log', 'one'],
+                          ['juju-log', '-l', 'WARNING', 'two']])
+
+    def test_same_level_messages_batched(self):
+        self.buffer.enable()
+        hookenv.log('one', level=hookenv.INFO)
+        hookenv.log('two', level=hookenv.INFO)
+        hookenv.log('three', level=hookenv.WARNING)
+        hookenv.log('four', level=hookenv.INFO)
+        self.assertFalse(self.call.called)
+        self.buffer.flush()
+        self.assertEqual(self._juju_log(),
+                         [['juju-log', '-l', 'INFO', 'one\ntwo'],
+                          ['juju-log', '-l', 'WARNING', 'three'],
+                          ['juju-log', '-l', 'INFO', 'four']])
+
+    def test_large_batches_split(self):
+        self.buffer.enable()
+        message = 'x' * (hookenv.LogBuffer.MAX_BATCH_SIZE // 2 - 1)
+        for _ in range(3):
+            hookenv.log(message)
+        self.buffer.flush()
+        self.assertEqual(self._juju_log(),
+                         [['juju-log', message + '\n' + message],
+                          ['juju-log', message]])
+
+    def test_error_flushes_immediately(self):
+        self.buffer.enable()
+        hookenv.log('starting')
+        hookenv.log('broken', level=hookenv.ERROR)
+        self.assertEqual(self._juju_log(),
+                         [['juju-log', 'starting'],
+                          ['juju-log', '-l', 'ERROR', 'broken']])
+        hookenv.log('after')
+        self.assertEqual(self.call.call_count, 2)
+
+    def test_flushed_at_exit(self):
+        self.buffer.enable()
+        self.register.assert_called_once_with(self.buffer.flush)
+        hookenv.log('done')
+        self.assertFalse(self.call.called)
+        hookenv._run_atexit()
+        self.assertEqual(self._juju_log(), [['juju-log', 'done']])
+
+    def test_debug_dropped_below_min_level(self):
+        self.buffer.enable(min_level=hookenv.INFO)
+        hookenv.log('noise', level=hookenv.DEBUG)
+        hookenv.log('news')
+        self.buffer.flush()
+        self.assertEqual(self._juju_log(), [['juju-log', 'news']])
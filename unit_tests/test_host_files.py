@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from charmhelpers.core import host
+
+
+class WriteFileIfChangedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'neutron.conf')
+
+    def test_new_file(self):
+        self.assertTrue(host.write_file_if_changed(self.path, b'a = 1\n'))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'a = 1\n')
+        self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o644)
+
+    def test_unchanged_file_is_not_written(self):
+        host.write_file_if_changed(self.path, b'a = 1\n')
+        inode = os.stat(self.path).st_ino
+        self.assertFalse(host.write_file_if_changed(self.path, b'a = 1\n'))
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+    def test_changed_file_is_replaced(self):
+        host.write_file_if_changed(self.path, b'a = 1\n', perms=0o600)
+        self.assertTrue(host.write_file_if_changed(self.path, b'a = 2\n'))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'a = 2\n')
+        # Permissions of the replaced file are kept.
+        self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o600)
+        self.assertEqual(os.listdir(self.tmpdir), ['neutron.conf'])
+
+    def test_permission_change_is_a_change(self):
+        host.write_file_if_changed(self.path, b'a = 1\n')
+        self.assertTrue(host.write_file_if_changed(self.path, b'a = 1\n',
+                                                   perms=0o600))
+
+    def test_writes_are_recorded(self):
+        mark = host.file_writes.mark()
+        host.write_file_if_changed(self.path, b'a = 1\n')
+        host.write_file_if_changed(self.path, b'a = 1\n')
+        self.assertEqual(host.file_writes.since(mark), {self.path: True})
+        mark = host.file_writes.mark()
+        host.write_file_if_changed(self.path, b'a = 1\n')
+        self.assertEqual(host.file_writes.since(mark), {self.path: False})
+
+
+class RestartOnChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.conf = os.path.join(self.tmpdir, 'bird.conf')
+        self.other = os.path.join(self.tmpdir, 'felix.cfg')
+        host.write_file_if_changed(self.conf, b'router id 10.0.0.1;\n')
+        with open(self.other, 'w') as f:
+            f.write('[global]\n')
+        self.restart_map = {self.conf: ['bird'], self.other: ['calico-felix']}
+        patcher = patch.object(host, 'service')
+        self.service = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run(self, f):
+        host.restart_on_change(lambda: self.restart_map)(f)()
+        return [c[0][1] for c in self.service.call_args_list]
+
+    def test_unchanged_write_does_not_hash_or_restart(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.1;\n')
+        with patch.object(host, 'path_hash') as path_hash:
+            self.assertEqual(self._run(f), [])
+            self.assertFalse(path_hash.called)
+
+    def test_changed_write_restarts(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.2;\n')
+        self.assertEqual(self._run(f), ['bird'])
+
+    def test_untracked_file_change_restarts(self):
+        def f():
+            with open(self.other, 'a') as f:
+                f.write('EtcdAddr = 127.0.0.1:4001\n')
+        self.assertEqual(self._run(f), ['calico-felix'])
+
+    def test_restart_functions_replace_restart(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.2;\n')
+            with open(self.other, 'a') as f:
+                f.write('EtcdAddr = 127.0.0.1:4001\n')
+        reload_bird = []
+        host.restart_on_change(
+            lambda: self.restart_map,
+            restart_functions={'bird': reload_bird.append})(f)()
+        self.assertEqual(reload_bird, ['bird'])
+        self.assertEqual([c[0][1] for c in self.service.call_args_list],
+                         ['calico-felix'])
+
+    def test_restart_function_failure_logged(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.2;\n')
+        with patch.object(host, 'log') as log:
+            host.restart_on_change(
+                lambda: self.restart_map,
+                restart_functions={'bird': lambda service: False})(f)()
+        log.assert_called_once_with('New configuration of bird not applied',
+                                    level='WARNING')
+
+    def test_can_restart_now_defers(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.2;\n')
+            with open(self.other, 'a') as f:
+                f.write('EtcdAddr = 127.0.0.1:4001\n')
+        asked = []
+
+        def can_restart_now(service_name, paths):
+            asked.append((service_name, paths))
+            return service_name != 'bird'
+        host.restart_on_change(lambda: self.restart_map,
+                               can_restart_now_f=can_restart_now)(f)()
+        self.assertEqual(sorted(asked), [('bird', [self.conf]),
+                                         ('calico-felix', [self.other])])
+        self.assertEqual([c[0][1] for c in self.service.call_args_list],
+                         ['calico-felix'])
+
+    def test_restart_services_f_restarts_together(self):
+        def f():
+            host.write_file_if_changed(self.conf, b'router id 10.0.0.2;\n')
+            with open(self.other, 'a') as f:
+                f.write('EtcdAddr = 127.0.0.1:4001\n')
+        restarted = []
+        reload_bird = []
+
+        def restart_services(services, restart_functions):
+            restarted.append((sorted(services), restart_functions))
+        host.restart_on_change(lambda: self.restart_map,
+                               restart_functions={'bird': reload_bird.append},
+                               restart_services_f=restart_services)(f)()
+        self.assertEqual(restarted, [(['bird', 'calico-felix'],
+                                      {'bird': reload_bird.append})])
+        # Restart functions are left to restart_services_f.
+        self.assertEqual(reload_bird, [])
+        self.assertFalse(self.service.called)
@@ -0,0 +1,136 @@
+import socket
+import unittest
+
+from mock import patch
+
+from charmhelpers.contrib.network import addresses
+from charmhelpers.contrib.network.addresses import (
+    Address,
+    AddressSnapshot,
+    RT_SCOPE_LINK,
+)
+import charmhelpers.contrib.network.ip as ip
+
+ADDRESSES = [
+    Address('lo', 4, '127.0.0.1', 8, None, 254),
+    Address('eth0', 4, '10.5.0.20', 16, '10.5.255.255', 0),
+    Address('eth0:1', 4, '192.168.1.5', 24, '192.168.1.255', 0),
+    Address('br-data', 4, '172.16.0.1', 24, '172.16.0.255', 0),
+    Address('br-data', 4, '172.16.0.129', 25, '172.16.0.255', 0),
+    Address('lo', 6, '::1', 128, None, 254),
+    Address('eth0', 6, '2001:db8::20', 64, None, 0),
+    Address('eth0', 6, 'fe80::f816:3eff:fe00:20', 64, None, RT_SCOPE_LINK),
+] + [
+    Address('tap%08x' % i, 4, '10.65.%d.%d' % (i // 250, i % 250 + 1), 32,
+            None, 0)
+    for i in range(500)
+]
+
+
+class AddressSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        interfaces = sorted(set(entry.iface for entry in ADDRESSES))
+        self.snapshot = AddressSnapshot(interfaces, ADDRESSES)
+
+    def test_address_in_network(self):
+        self.assertEqual(self.snapshot.address_in_network('10.5.0.0/16'),
+                         '10.5.0.20')
+        self.assertEqual(self.snapshot.address_in_network('192.168.0.0/16'),
+                         '192.168.1.5')
+        self.assertEqual(self.snapshot.address_in_network('2001:db8::/32'),
+                         '2001:db8::20')
+        self.assertEqual(self.snapshot.address_in_network('10.6.0.0/16'),
+                         None)
+
+    def test_first_address_in_network_wins(self):
+        self.assertEqual(self.snapshot.address_in_network('172.16.0.0/24'),
+                         '172.16.0.1')
+
+    def test_link_local_never_in_network(self):
+        self.assertEqual(self.snapshot.address_in_network('fe80::/10'), None)
+
+    def test_taps_skipped_unless_asked_for(self):
+        self.assertEqual(self.snapshot.address_in_network('10.65.0.0/16'),
+                         None)
+        self.assertEqual(
+            self.snapshot.address_in_network('10.65.1.0/24',
+                                             include_taps=True),
+            '10.65.1.1')
+        self.assertEqual(self.snapshot.owner('10.65.1.1'), None)
+        self.assertEqual(self.snapshot.owner('10.65.1.1', include_taps=True),
+                         'tap000000fa')
+
+    def test_owner(self):
+        self.assertEqual(self.snapshot.owner('192.168.1.5'), 'eth0:1')
+        self.assertEqual(self.snapshot.owner('fe80::f816:3eff:fe00:20'),
+                         'eth0')
+        self.assertEqual(self.snapshot.owner('10.5.0.21'), None)
+
+    def test_network_for_longest_prefix(self):
+        self.assertEqual(self.snapshot.network_for('172.16.0.200').addr,
+                         '172.16.0.129')
+        self.assertEqual(self.snapshot.network_for('172.16.0.7').addr,
+                         '172.16.0.1')
+        self.assertEqual(self.snapshot.network_for('8.8.8.8'), None)
+
+    def test_netmask(self):
+        self.assertEqual(addresses.netmask(ADDRESSES[1]), '255.255.0.0')
+        self.assertEqual(addresses.netmask(ADDRESSES[6]),
+                         'ffff:ffff:ffff:ffff::')
+
+    def test_bad_network(self):
+        self.assertRaises(ValueError, self.snapshot.address_in_network,
+                          '10.0.0.0/33')
+        self.assertRaises(ValueError, self.snapshot.owner, 'eth0')
+
+    @unittest.skipUnless(hasattr(socket, 'AF_NETLINK'), 'no netlink')
+    def test_netlink_matches_netifaces(self):
+        try:
+            netlink = addresses.netlink_addresses()
+        except (socket.error, OSError):
+            self.skipTest('netlink is not available')
+        netifaces = addresses.netifaces_addresses()
+        self.assertEqual(set(netlink[0]), set(netifaces[0]))
+        key = (lambda entry: (entry.iface, entry.addr, entry.prefixlen))
+        self.assertEqual(set(map(key, netlink[1])),
+                         set(map(key, netifaces[1])))
+
+
+class IpHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        interfaces = sorted(set(entry.iface for entry in ADDRESSES))
+        patcher = patch.object(ip, 'address_snapshot',
+                               return_value=AddressSnapshot(interfaces,
+                                                            ADDRESSES))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_address_in_network(self):
+        self.assertEqual(
+            ip.get_address_in_network('10.9.0.0/16 2001:db8::/64'),
+            '2001:db8::20')
+        self.assertEqual(ip.get_address_in_network('10.9.0.0/16', '1.2.3.4'),
+                         '1.2.3.4')
+        self.assertRaises(ValueError, ip.get_address_in_network,
+                          '10.9.0.0/16', fatal=True)
+
+    def test_get_for_address(self):
+        self.assertEqual(ip.get_iface_for_address('10.5.3.3'), 'eth0')
+        self.assertEqual(ip.get_netmask_for_address('10.5.3.3'),
+                         '255.255.0.0')
+        self.assertEqual(ip.get_netmask_for_address('2001:db8::99'), '64')
+        self.assertEqual(ip.get_iface_for_address('10.65.0.1'), None)
+
+    def test_get_iface_addr(self):
+        self.assertEqual(ip.get_iface_addr('eth0', inc_aliases=True),
+                         ['10.5.0.20', '192.168.1.5'])
+        self.assertEqual(ip.get_iface_addr('eth0', 'AF_INET6'),
+                         ['2001:db8::20', 'fe80::f816:3eff:fe00:20%eth0'])
+        self.assertEqual(ip.get_iface_addr('eth9', fatal=False), [])
+
+    def test_get_iface_from_addr(self):
+        with patch.object(ip, 'log'):
+            self.assertEqual(ip.get_iface_from_addr('192.168.1.5'), 'eth0:1')
+            self.assertRaises(Exception, ip.get_iface_from_addr, '1.1.1.1')
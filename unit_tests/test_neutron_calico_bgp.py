@@ -0,0 +1,277 @@
+from test_utils import CharmTestCase
+
+from charmhelpers.core import unitdata
+
+import neutron_calico_bgp as bgp
+
+TO_PATCH = [
+    'config',
+    'is_leader',
+    'leader_get',
+    'leader_set',
+    'local_unit',
+    'log',
+    'peer_units',
+    'related_units',
+    'relation_get',
+    'relation_ids',
+]
+
+
+def _units(n):
+    return ['neutron-calico/%d' % i for i in range(n)]
+
+
+class RouteReflectorElectionTest(CharmTestCase):
+
+    def setUp(self):
+        super(RouteReflectorElectionTest, self).setUp(bgp, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.test_config.set('route-reflectors', 2)
+        self.local_unit.return_value = 'neutron-calico/3'
+        self.peer_units.return_value = ['neutron-calico/%d' % i
+                                        for i in (12, 1, 2, 5)]
+        self.leader = {}
+        self.leader_get.side_effect = self.leader.get
+        self.leader_set.side_effect = self.leader.update
+        self.is_leader.return_value = True
+
+    def test_oldest_units_elected(self):
+        self.assertEqual(
+            bgp.elect_route_reflectors(_units(10)[::-1], 3),
+            ['neutron-calico/0', 'neutron-calico/1', 'neutron-calico/2'])
+
+    def test_elected_units_keep_their_role(self):
+        current = ['neutron-calico/4', 'neutron-calico/7']
+        self.assertEqual(bgp.elect_route_reflectors(_units(10), 2, current),
+                         current)
+        # neutron-calico/4 left: the oldest unit takes its place.
+        units = [u for u in _units(10) if u != 'neutron-calico/4']
+        self.assertEqual(bgp.elect_route_reflectors(units, 2, current),
+                         ['neutron-calico/0', 'neutron-calico/7'])
+
+    def test_leader_publishes(self):
+        self.assertTrue(bgp.update_route_reflectors())
+        self.assertEqual(self.leader,
+                         {'route-reflectors':
+                          'neutron-calico/1 neutron-calico/2'})
+        self.assertFalse(bgp.update_route_reflectors())
+        self.assertEqual(self.leader_set.call_count, 1)
+        self.assertEqual(bgp.route_reflectors(),
+                         ['neutron-calico/1', 'neutron-calico/2'])
+
+    def test_non_leader_does_not_publish(self):
+        self.is_leader.return_value = False
+        self.assertFalse(bgp.update_route_reflectors())
+        self.assertFalse(self.leader_set.called)
+
+    def test_full_mesh_by_default(self):
+        self.test_config.set('route-reflectors', 0)
+        self.leader['route-reflectors'] = 'neutron-calico/1'
+        self.assertEqual(bgp.route_reflectors(), [])
+        bgp.update_route_reflectors()
+        self.assertEqual(self.leader, {'route-reflectors': ''})
+
+    def test_without_leadership(self):
+        self.is_leader.side_effect = NotImplementedError
+        self.leader_get.side_effect = NotImplementedError
+        self.assertFalse(bgp.update_route_reflectors())
+        self.assertEqual(bgp.route_reflectors(),
+                         ['neutron-calico/1', 'neutron-calico/2'])
+
+
+class PeerListTest(CharmTestCase):
+
+    def setUp(self):
+        super(PeerListTest, self).setUp(bgp, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.local_unit.return_value = 'neutron-calico/0'
+        self.relation_ids.return_value = ['cluster:1']
+        self.related_units.return_value = ['neutron-calico/1',
+                                           'neutron-calico/2']
+        self.settings = {
+            'neutron-calico/0': {'addr': '10.0.0.10', 'addr6': 'aa::10'},
+            'neutron-calico/1': {'addr': '10.0.0.11'},
+            'neutron-calico/2': {},
+        }
+        self.relation_get.side_effect = (
+            lambda attr, rid, unit: self.settings[unit].get(attr))
+        self.leader = {}
+        self.leader_get.side_effect = self.leader.get
+        self.leader_set.side_effect = self.leader.update
+        self.is_leader.return_value = True
+        self.addCleanup(unitdata.kv().unset, bgp.RENDERED_KEY)
+
+    def test_collect(self):
+        self.assertEqual(bgp.collect_peer_addresses(), {
+            'neutron-calico/0': ['10.0.0.10', 'aa::10'],
+            'neutron-calico/1': ['10.0.0.11', None],
+        })
+
+    def test_publish_only_changes(self):
+        self.assertTrue(bgp.publish_peer_addresses())
+        version = bgp.published_peer_addresses()['version']
+        self.assertFalse(bgp.publish_peer_addresses())
+        self.settings['neutron-calico/2']['addr'] = '10.0.0.12'
+        self.assertTrue(bgp.publish_peer_addresses())
+        self.assertNotEqual(bgp.published_peer_addresses()['version'],
+                            version)
+        self.assertEqual(bgp.leader_peer_addresses()['neutron-calico/2'],
+                         ['10.0.0.12', None])
+        self.assertEqual(self.leader_set.call_count, 2)
+
+    def test_follower_does_not_read_relation(self):
+        bgp.publish_peer_addresses()
+        self.is_leader.return_value = False
+        self.relation_get.reset_mock()
+        self.assertFalse(bgp.update_cluster())
+        self.assertFalse(self.relation_get.called)
+        self.assertEqual(len(bgp.leader_peer_addresses()), 2)
+
+    def test_follower_before_first_publication(self):
+        self.is_leader.return_value = False
+        self.assertTrue(bgp.update_cluster())
+
+    def test_without_leadership(self):
+        self.is_leader.side_effect = NotImplementedError
+        self.leader_get.side_effect = NotImplementedError
+        self.assertFalse(bgp.publish_peer_addresses())
+        self.assertEqual(bgp.leader_peer_addresses(), None)
+        self.assertTrue(bgp.update_cluster())
+
+    def test_leader_settings_rendered(self):
+        bgp.publish_peer_addresses()
+        self.assertFalse(bgp.leader_settings_rendered())
+        self.assertTrue(bgp.leader_settings_rendered())
+        self.leader['route-reflectors'] = 'neutron-calico/0'
+        self.assertFalse(bgp.leader_settings_rendered())
+        self.settings['neutron-calico/2']['addr'] = '10.0.0.12'
+        bgp.publish_peer_addresses()
+        self.assertFalse(bgp.leader_settings_rendered())
+
+
+class BGPSessionsTest(CharmTestCase):
+
+    def setUp(self):
+        super(BGPSessionsTest, self).setUp(bgp, [])
+
+    def _addr(self, unit):
+        n = bgp.unit_number(unit)
+        return '10.%d.%d.%d' % (n >> 16, (n >> 8) & 0xff, n & 0xff)
+
+    def _sessions(self, units, reflectors):
+        '''Configured sessions per unit, as {unit: set of addresses}.'''
+        sessions = {}
+        peers = dict((unit, self._addr(unit)) for unit in units)
+        for unit in units:
+            addr = peers.pop(unit)
+            upstream, clients = bgp.bgp_sessions(unit, peers, reflectors)
+            peers[unit] = addr
+            sessions[unit] = set(upstream) | set(clients)
+        return sessions
+
+    def test_full_mesh(self):
+        units = _units(5)
+        upstream, clients = bgp.bgp_sessions(
+            units[0], dict((u, self._addr(u)) for u in units[1:]), [])
+        self.assertEqual(upstream, [self._addr(u) for u in units[1:]])
+        self.assertEqual(clients, [])
+
+    def test_reflector_sessions(self):
+        units = _units(5)
+        peers = dict((u, self._addr(u)) for u in units[1:])
+        upstream, clients = bgp.bgp_sessions(units[0], peers, units[:2])
+        self.assertEqual(upstream, ['10.0.0.1'])
+        self.assertEqual(clients, ['10.0.0.2', '10.0.0.3', '10.0.0.4'])
+        peers = dict((u, self._addr(u)) for u in units[:4])
+        self.assertEqual(bgp.bgp_sessions(units[4], peers, units[:2]),
+                         (['10.0.0.0', '10.0.0.1'], []))
+
+    def test_reflectors_not_joined_yet(self):
+        units = _units(4)
+        peers = dict((u, self._addr(u)) for u in units[1:])
+        self.assertEqual(
+            bgp.bgp_sessions(units[0], peers, ['neutron-calico/9'])[0],
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+    def test_sessions_bounded_at_scale(self):
+        count = 3
+        units = _units(3000)
+        reflectors = bgp.elect_route_reflectors(units, count)
+        sessions = self._sessions(units, reflectors)
+        for unit, peers in sessions.items():
+            if unit in reflectors:
+                self.assertEqual(len(peers), len(units) - 1)
+            else:
+                self.assertEqual(len(peers), count)
+        # Every session is configured at both ends.
+        by_addr = dict((self._addr(u), u) for u in units)
+        for unit, peers in sessions.items():
+            for addr in peers:
+                self.assertIn(self._addr(unit), sessions[by_addr[addr]])
+        # Roughly count * N sessions rather than N * (N - 1) / 2.
+        total = sum(len(peers) for peers in sessions.values()) // 2
+        self.assertEqual(total, count * (len(units) - count) +
+                         count * (count - 1) // 2)
+
+
+class RendezvousTest(CharmTestCase):
+
+    def setUp(self):
+        super(RendezvousTest, self).setUp(bgp, [])
+        self.hosts = ['nova-compute/%d' % i for i in range(2000)]
+
+    def _choose(self, reflectors, count=2):
+        return dict((host, bgp.choose_route_reflectors(host, reflectors,
+                                                       count))
+                    for host in self.hosts)
+
+    def _reflectors(self, numbers):
+        return dict(('bird/%d' % i, '10.1.0.%d' % i) for i in numbers)
+
+    def test_all_when_unlimited(self):
+        reflectors = self._reflectors(range(3))
+        self.assertEqual(bgp.choose_route_reflectors('n/1', reflectors, 0),
+                         reflectors.keys())
+        self.assertEqual(bgp.choose_route_reflectors('n/1', reflectors, 5),
+                         reflectors.keys())
+
+    def test_deterministic(self):
+        reflectors = self._reflectors(range(8))
+        self.assertEqual(bgp.choose_route_reflectors('n/1', reflectors, 2),
+                         bgp.choose_route_reflectors('n/1', reflectors, 2))
+
+    def test_even_spread(self):
+        chosen = self._choose(self._reflectors(range(10)))
+        load = {}
+        for reflectors in chosen.values():
+            self.assertEqual(len(reflectors), 2)
+            for reflector in reflectors:
+                load[reflector] = load.get(reflector, 0) + 1
+        # 4000 sessions over 10 route reflectors.
+        self.assertTrue(min(load.values()) > 300, load)
+        self.assertTrue(max(load.values()) < 500, load)
+
+    def test_minimal_disruption(self):
+        before = self._choose(self._reflectors(range(10)))
+        # Removing bird/3 only moves the sessions it had.
+        after = self._choose(self._reflectors(range(10)[:3] + range(4, 10)))
+        for host in self.hosts:
+            if 'bird/3' not in before[host]:
+                self.assertEqual(before[host], after[host])
+        # Adding bird/10 moves about 2 / 11 of the hosts' sessions.
+        after = self._choose(self._reflectors(range(11)))
+        moved = sum(len(set(before[host]) - set(after[host]))
+                    for host in self.hosts)
+        self.assertTrue(moved < 0.25 * 2 * len(self.hosts), moved)
+        for host in self.hosts:
+            self.assertTrue(set(after[host]) - set(before[host]) <=
+                            set(['bird/10']))
+
+    def test_prefers_same_network(self):
+        reflectors = self._reflectors(range(6))
+        reflectors['bird/4'] = '192.168.5.4'
+        for host in self.hosts[:50]:
+            chosen = bgp.choose_route_reflectors(
+                host, reflectors, 2, lambda addr: addr.startswith('192.'))
+            self.assertIn('bird/4', chosen)
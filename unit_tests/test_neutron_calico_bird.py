@@ -0,0 +1,202 @@
+import subprocess
+import unittest
+
+from mock import call, mock_open, patch
+
+from charmhelpers.core import unitdata
+
+import neutron_calico_bird as bird
+
+CONF = '''router id 10.0.0.1;
+
+filter export_bgp {
+  accept;
+}
+
+protocol kernel {
+  persist;        # Don't remove routes on bird shutdown
+  export all;
+}
+
+protocol device {
+  scan time 2;
+}
+
+protocol bgp N10_0_0_2 {
+  neighbor 10.0.0.2 as 64511;
+  next hop self;
+}
+
+protocol bgp N10_0_0_3 {
+  neighbor 10.0.0.3 as 64511;
+  next hop self;
+}
+'''
+
+
+class ProtocolsTest(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(sorted(bird.protocols(CONF)),
+                         ['N10_0_0_2', 'N10_0_0_3', 'device1', 'kernel1'])
+
+    def test_comments_do_not_count(self):
+        edited = CONF.replace("# Don't remove routes on bird shutdown",
+                              '# Keep routes')
+        self.assertEqual(bird.protocols(CONF), bird.protocols(edited))
+
+    def test_changes(self):
+        new = CONF.replace('N10_0_0_3 {\n  neighbor 10.0.0.3',
+                           'N10_0_0_4 {\n  neighbor 10.0.0.4')
+        new = new.replace('scan time 2', 'scan time 10')
+        self.assertEqual(
+            bird.protocol_changes(bird.protocols(CONF), bird.protocols(new)),
+            (['N10_0_0_4'], ['N10_0_0_3'], ['device1']))
+
+    def test_summary(self):
+        self.assertEqual(bird._summary([]), 'none')
+        names = ['N%d' % i for i in range(12)]
+        self.assertEqual(bird._summary(names),
+                         'N0, N1, N2, N3, N4, N5, N6, N7, N8, N9 and 2 more')
+
+
+SESSIONS = '''name     proto    table    state  since       info
+kernel1  Kernel   master   up     12:00:00
+device1  Device   master   up     12:00:00
+N10_0_0_2 BGP      master   up     12:00:03    Established
+N10_0_0_3 BGP      master   start  12:00:00    Connect
+'''
+
+
+class BgpSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(subprocess, 'check_output')
+        self.check_output = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(bird, 'log')
+        self.log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counts(self):
+        self.check_output.return_value = SESSIONS
+        self.assertEqual(bird.bgp_sessions('birdc'), (1, 2))
+        self.check_output.side_effect = OSError
+        self.assertEqual(bird.bgp_sessions('birdc'), None)
+
+    def test_report(self):
+        self.check_output.return_value = SESSIONS
+        bird.report_bgp_sessions('bird')
+        self.log.assert_called_once_with(
+            'bird: 1 of 2 BGP sessions established', level=bird.INFO)
+
+    def test_report_none_established(self):
+        self.check_output.return_value = SESSIONS.replace('Established',
+                                                          'Active')
+        bird.report_bgp_sessions('bird6')
+        self.check_output.assert_called_once_with(
+            ['birdc6', 'show', 'protocols'], stderr=subprocess.STDOUT)
+        self.log.assert_called_once_with(
+            'bird6: 0 of 2 BGP sessions established', level=bird.WARNING)
+
+    def test_no_sessions_not_reported(self):
+        self.check_output.return_value = SESSIONS.split('N10')[0]
+        bird.report_bgp_sessions('bird')
+        self.assertFalse(self.log.called)
+
+
+class ReloadBirdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = unitdata.Storage(':memory:')
+        self.outputs = {}
+        patchers = [
+            patch.object(unitdata, 'kv', return_value=self.db),
+            patch.object(subprocess, 'check_output',
+                         side_effect=self._check_output),
+            patch.object(bird, 'service_restart'),
+            patch.object(bird, 'log'),
+            patch.object(bird, 'open', mock_open(read_data=CONF),
+                         create=True),
+            patch.object(bird, 'shutil'),
+            patch.object(bird.os.path, 'exists'),
+        ]
+        (_, self.check_output, self.service_restart, self.log, _,
+         self.shutil, self.exists) = [patcher.start()
+                                      for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def _check_output(self, cmd, stderr=None):
+        output = self.outputs.get(cmd[0], '')
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+    def test_configure(self):
+        self.outputs['birdc'] = ('Reading configuration from '
+                                 '/etc/bird/bird.conf\nReconfigured\n')
+        self.assertTrue(bird.reload_bird('bird'))
+        self.assertEqual(self.check_output.call_args_list, [
+            call(['bird', '-p', '-c', '/etc/bird/bird.conf'],
+                 stderr=subprocess.STDOUT),
+            call(['birdc', 'configure'], stderr=subprocess.STDOUT),
+            call(['birdc', 'show', 'protocols'], stderr=subprocess.STDOUT)])
+        self.assertFalse(self.service_restart.called)
+        self.assertEqual(self.db.get(bird.PROTOCOLS_KEY + 'bird'),
+                         bird.protocols(CONF))
+        self.shutil.copyfile.assert_called_once_with(
+            '/etc/bird/bird.conf', '/etc/bird/bird.conf.applied')
+
+    def test_changes_logged(self):
+        old = bird.protocols(CONF.replace('10.0.0.3', '10.0.0.4')
+                             .replace('10_0_0_3', '10_0_0_4'))
+        self.db.set(bird.PROTOCOLS_KEY + 'bird6', old)
+        self.outputs['birdc6'] = 'Reconfiguration in progress\n'
+        bird.reload_bird('bird6')
+        self.check_output.assert_any_call(['birdc6', 'configure'],
+                                          stderr=subprocess.STDOUT)
+        self.log.assert_called_with(
+            'Reconfigured bird6: protocols added: N10_0_0_3; '
+            'removed: N10_0_0_4; changed: none')
+
+    def test_invalid_config_not_applied(self):
+        self.outputs['bird'] = subprocess.CalledProcessError(
+            1, 'bird', 'bird.conf, line 3: syntax error')
+        self.assertFalse(bird.reload_bird('bird'))
+        self.assertEqual(self.check_output.call_count, 1)
+        self.assertFalse(self.service_restart.called)
+        self.assertEqual(self.db.get(bird.PROTOCOLS_KEY + 'bird'), None)
+        # The configuration last applied is put back.
+        self.exists.assert_called_once_with('/etc/bird/bird.conf.applied')
+        self.shutil.copyfile.assert_called_once_with(
+            '/etc/bird/bird.conf.applied', '/etc/bird/bird.conf')
+
+    def test_invalid_first_config(self):
+        self.outputs['bird'] = subprocess.CalledProcessError(
+            1, 'bird', 'bird.conf, line 3: syntax error')
+        self.exists.return_value = False
+        self.assertFalse(bird.reload_bird('bird'))
+        self.assertFalse(self.shutil.copyfile.called)
+
+    def test_restart_when_configure_fails(self):
+        self.outputs['birdc'] = subprocess.CalledProcessError(
+            1, 'birdc', 'Unable to connect to server control socket')
+        self.assertTrue(bird.reload_bird('bird'))
+        self.service_restart.assert_called_once_with('bird')
+
+    def test_failed_restart_not_recorded(self):
+        self.outputs['birdc'] = subprocess.CalledProcessError(
+            1, 'birdc', 'Unable to connect to server control socket')
+        self.service_restart.return_value = False
+        self.assertFalse(bird.reload_bird('bird'))
+        # The last applied configuration is restored, not replaced.
+        self.shutil.copyfile.assert_called_once_with(
+            '/etc/bird/bird.conf.applied', '/etc/bird/bird.conf')
+        self.assertEqual(self.service_restart.call_count, 2)
+        self.assertEqual(self.db.get(bird.PROTOCOLS_KEY + 'bird'), None)
+
+    def test_restart_when_configure_does_not_reconfigure(self):
+        self.outputs['birdc'] = 'bird.conf, line 3: syntax error\n'
+        bird.reload_bird('bird')
+        self.service_restart.assert_called_once_with('bird')
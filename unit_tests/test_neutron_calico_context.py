@@ -1,15 +1,21 @@
 
 from test_utils import CharmTestCase
-from mock import patch
+from mock import MagicMock, patch
 import neutron_calico_context as context
 import charmhelpers
+from charmhelpers.contrib.network.addresses import Address, AddressSnapshot
+from charmhelpers.core import unitdata
+from charmhelpers.core.host import data_hash
+import neutron_calico_etcd
+import neutron_calico_facts
 TO_PATCH = [
     'relation_get',
     'relation_ids',
     'related_units',
     'config',
     'unit_get',
-    'get_host_ip',
+    'local_unit',
+    'resolve_address',
 ]
 
 
@@ -22,9 +28,11 @@ class CalicoPluginContextTest(CharmTestCase):
         self.test_config.set('debug', True)
         self.test_config.set('verbose', True)
         self.test_config.set('use-syslog', True)
+        self.local_unit.return_value = 'neutron-calico/0'
 
     def tearDown(self):
         super(CalicoPluginContextTest, self).tearDown()
+        neutron_calico_facts.facts.invalidate()
 
     @patch.object(charmhelpers.contrib.openstack.context, 'config')
     @patch.object(charmhelpers.contrib.openstack.context, 'unit_get')
@@ -35,6 +43,7 @@ class CalicoPluginContextTest(CharmTestCase):
     @patch.object(charmhelpers.contrib.openstack.context,
                   'neutron_plugin_attribute')
     @patch.object(charmhelpers.contrib.openstack.context, 'unit_private_ip')
+    @patch.object(context, 'fabric_interfaces', lambda: ['eth0'])
     def test_neutroncc_context_api_rel(self, _unit_priv_ip, _npa, _ens_pkgs,
                                        _save_ff, _https, _is_clus, _unit_get,
                                        _config):
@@ -55,7 +64,7 @@ class CalicoPluginContextTest(CharmTestCase):
             'addr': '127.0.0.16',
             'addr6': 'aa::1',
         })
-        self.get_host_ip.return_value = '127.0.0.15'
+        self.resolve_address.return_value = '127.0.0.15'
         napi_ctxt = context.CalicoPluginContext()
         expect = {
             'neutron_alchemy_flags': {},
@@ -71,36 +80,222 @@ class CalicoPluginContextTest(CharmTestCase):
             'neutron_url': 'https://127.0.0.13:9696',
             'peer_ips': ['127.0.0.16'],
             'peer_ips6': ['aa::1'],
+            'rr_client_ips': [],
+            'rr_client_ips6': [],
+            'route_reflector': False,
+            'bird_interfaces': ['dummy1', 'eth0'],
+            'kernel_scan_time': 2,
+            'device_scan_time': 2,
+            'bird_debug': 'all',
         }
         self.assertEquals(expect, napi_ctxt())
 
 
+class FabricInterfacesTest(CharmTestCase):
+
+    def setUp(self):
+        super(FabricInterfacesTest, self).setUp(
+            context, ['config', 'host_fact', 'is_phy_iface',
+                      'get_bond_master'])
+        self.config.side_effect = self.test_config.get
+        self.host_fact.return_value = '10.0.0.5'
+        self.is_phy_iface.side_effect = lambda iface: iface.startswith('eth')
+        self.get_bond_master.return_value = None
+        self.snapshot = AddressSnapshot(
+            ['lo', 'eth0', 'eth1', 'br0', 'tap1234', 'tap5678'],
+            [Address('eth0', 4, '10.0.0.5', 24, None, 0),
+             Address('br0:1', 4, '192.168.9.1', 24, None, 0),
+             Address('tap1234', 4, '169.254.1.1', 32, None, 0)])
+        patcher = patch.object(context, 'address_snapshot',
+                               return_value=self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_physical_and_local_ip(self):
+        self.host_fact.return_value = '192.168.9.1'
+        self.assertEqual(context.fabric_interfaces(), ['eth0', 'eth1', 'br0'])
+        self.assertNotIn('tap1234',
+                         [c[0][0] for c in self.is_phy_iface.call_args_list])
+
+    def test_bond_master(self):
+        self.get_bond_master.side_effect = \
+            lambda iface: 'bond0' if iface in ('eth0', 'eth1') else None
+        self.assertEqual(context.fabric_interfaces(), ['bond0', 'eth0'])
+
+    def test_data_network(self):
+        self.test_config.set('os-data-network', '192.168.9.0/24 10.9.0.0/16')
+        self.assertEqual(context.fabric_interfaces(), ['br0'])
+        self.assertFalse(self.is_phy_iface.called)
+
+    def test_data_network_several_nics(self):
+        self.snapshot = AddressSnapshot(
+            ['eth0', 'eth1', 'eth2', 'tap1234'],
+            [Address('eth0', 4, '10.1.0.5', 24, None, 0),
+             Address('eth0', 6, 'fd00::5', 64, None, 0),
+             Address('eth1', 4, '10.1.1.5', 24, None, 0),
+             Address('eth1:1', 4, '10.1.1.6', 24, None, 0),
+             Address('eth2', 4, '192.168.0.5', 24, None, 0),
+             Address('tap1234', 4, '10.1.2.1', 32, None, 0)])
+        context.address_snapshot.return_value = self.snapshot
+        self.test_config.set('os-data-network', '10.1.0.0/16 fd00::/64')
+        self.assertEqual(context.fabric_interfaces(), ['eth0', 'eth1'])
+
+    def test_scale_profile(self):
+        self.test_config.set('bird-scale-profile', 'large')
+        self.assertEqual(context.bird_scale_profile(),
+                         {'kernel_scan_time': 30, 'device_scan_time': 60,
+                          'bird_debug': 'off'})
+        self.test_config.set('bird-scale-profile', 'huge')
+        self.assertEqual(context.bird_scale_profile(),
+                         context.BIRD_SCALE_PROFILES['small'])
+
+
+class ClusterAddressesTest(CharmTestCase):
+
+    def setUp(self):
+        super(ClusterAddressesTest, self).setUp(
+            context, TO_PATCH + ['leader_peer_addresses'])
+        self.local_unit.return_value = 'neutron-calico/1'
+        self.relation_get.side_effect = self.test_relation.get
+        self.related_units.return_value = ['neutron-calico/0']
+        self.relation_ids.return_value = ['cluster:1']
+        self.test_relation.set({'addr': '10.0.0.9', 'addr6': 'aa::9'})
+
+    def test_from_leader_peer_list(self):
+        self.leader_peer_addresses.return_value = {
+            'neutron-calico/10': ['10.0.0.20', None],
+            'neutron-calico/1': ['10.0.0.11', 'aa::11'],
+            'neutron-calico/2': ['10.0.0.12', 'aa::12'],
+        }
+        ctxt = context.CalicoPluginContext()
+        self.assertEqual(ctxt.cluster_unit_addrs().items(),
+                         [('neutron-calico/2', '10.0.0.12'),
+                          ('neutron-calico/10', '10.0.0.20')])
+        self.assertEqual(ctxt.cluster_unit_addrs(ip_version=6).items(),
+                         [('neutron-calico/2', 'aa::12')])
+        self.assertFalse(self.relation_get.called)
+
+    def test_from_relation(self):
+        self.leader_peer_addresses.return_value = None
+        ctxt = context.CalicoPluginContext()
+        self.assertEqual(ctxt.cluster_unit_addrs().items(),
+                         [('neutron-calico/0', '10.0.0.9')])
+
+
+class RouteReflectorAddressesTest(CharmTestCase):
+
+    def setUp(self):
+        super(RouteReflectorAddressesTest, self).setUp(context, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.local_unit.return_value = 'neutron-calico/7'
+        self.relation_ids.return_value = ['bgp-route-reflector:2']
+        self.related_units.return_value = ['bird/%d' % i for i in range(4)]
+        self.relation_get.side_effect = (
+            lambda attribute, rid, unit: '10.%s.0.1' % unit.split('/')[1])
+
+    def test_all_route_reflectors(self):
+        ctxt = context.CalicoPluginContext()
+        self.assertEqual(ctxt.route_reflector_addrs(),
+                         ['10.0.0.1', '10.1.0.1', '10.2.0.1', '10.3.0.1'])
+
+    def test_subset(self):
+        self.test_config.set('route-reflector-peers', 2)
+        snapshot = AddressSnapshot(
+            ['eth0'], [Address('eth0', 4, '10.2.0.5', 16, None, 0)])
+        with patch.object(context, 'address_snapshot',
+                          return_value=snapshot):
+            addrs = context.CalicoPluginContext().route_reflector_addrs()
+        self.assertEqual(len(addrs), 2)
+        self.assertIn('10.2.0.1', addrs)
+
+
+CLUSTER = 'etcd0=https://10.0.0.10:2380,etcd1=https://10.0.0.11:2380'
+CREDENTIALS = {
+    'client_cert': 'CERT',
+    'client_key': 'KEY',
+    'client_ca': 'CA',
+}
+
+
 class EtcdContextTest(CharmTestCase):
 
     def setUp(self):
         super(EtcdContextTest, self).setUp(context, TO_PATCH)
         self.relation_get.side_effect = self.test_relation.get
+        self.relation_ids.return_value = ['etcd-proxy:1']
+        self.related_units.return_value = ['etcd/0']
+        self.client = MagicMock()
+        self.client.peers.return_value = set(
+            ['etcd0=https://10.0.0.10:2380'])
+        patcher = patch.object(context.EtcdContext, '_save_data')
+        self._save_data = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(unitdata.kv().unset,
+                        neutron_calico_etcd.CREDENTIALS_KEY)
 
-    def tearDown(self):
-        super(EtcdContextTest, self).tearDown()
+    def _relation(self, **kwargs):
+        rdata = dict(CREDENTIALS, cluster=CLUSTER)
+        rdata.update(kwargs)
+        self.test_relation.set(rdata)
+
+    def _expect(self):
+        return {'cluster': CLUSTER,
+                'server_certificate': context.ETCD_CERT,
+                'server_key': context.ETCD_KEY,
+                'ca_certificate': context.ETCD_CA}
 
     def test_etcd_no_related_units(self):
         self.related_units.return_value = []
-        ctxt = context.EtcdContext()
-        expect = {'cluster': ''}
+        ctxt = context.EtcdContext(client=self.client)
+        self.assertEquals({}, ctxt())
 
-        self.assertEquals(expect, ctxt())
+    def test_incomplete_relation(self):
+        self.test_relation.set({'cluster': CLUSTER})
+        ctxt = context.EtcdContext(client=self.client)
+        self.assertEquals({}, ctxt())
+        self.assertFalse(self.client.peers.called)
 
-    def test_some_related_units(self):
-        self.related_units.return_value = ['unit1']
-        self.relation_ids.return_value = ['rid1', 'rid2']
-        result = (
-            'testname=http://172.18.18.18:8888,'
-            'testname=http://172.18.18.18:8888'
-        )
-        self.test_relation.set({'cluster': result})
+    def test_new_proxy(self):
+        self._relation()
+        self.client.peers.side_effect = neutron_calico_etcd.EtcdError('down')
+        ctxt = context.EtcdContext(client=self.client)
+        self.assertEquals(self._expect(), ctxt())
+        self.assertEqual(self._save_data.call_count, 3)
+        self.assertTrue(ctxt.wipe)
+        self.assertEqual(
+            sorted(neutron_calico_etcd.stored_credentials()),
+            sorted([context.ETCD_CERT, context.ETCD_KEY, context.ETCD_CA]))
+
+    def test_overlapping_peers_and_same_credentials(self):
+        self._relation()
+        context.EtcdContext(client=self.client)()
+        self._save_data.reset_mock()
+        with patch.object(neutron_calico_etcd, 'file_hash') as file_hash:
+            self.assertEquals({}, context.EtcdContext(client=self.client)())
+            self.assertFalse(file_hash.called)
+        self.assertFalse(self._save_data.called)
+
+    def test_changed_credentials(self):
+        self._relation()
+        context.EtcdContext(client=self.client)()
+        self._relation(client_key='NEWKEY')
+        ctxt = context.EtcdContext(client=self.client)
+        self.assertEquals(self._expect(), ctxt())
+        self.assertFalse(ctxt.wipe)
 
-        ctxt = context.EtcdContext()
-        expect = {'cluster': result}
+    def test_disjoint_peers(self):
+        self._relation()
+        context.EtcdContext(client=self.client)()
+        self.client.peers.return_value = set(['old=https://10.9.9.9:2380'])
+        ctxt = context.EtcdContext(client=self.client)
+        self.assertEquals(self._expect(), ctxt())
+        self.assertTrue(ctxt.wipe)
 
-        self.assertEquals(expect, ctxt())
+    def test_unrecorded_credentials_hashed_from_disk(self):
+        self._relation()
+        with patch.object(neutron_calico_etcd, 'file_hash') as file_hash:
+            file_hash.side_effect = lambda path: data_hash(
+                {context.ETCD_CERT: 'CERT', context.ETCD_KEY: 'KEY',
+                 context.ETCD_CA: 'CA'}[path])
+            self.assertEquals({}, context.EtcdContext(client=self.client)())
+            self.assertEqual(file_hash.call_count, 3)
@@ -0,0 +1,126 @@
+from mock import call, patch
+
+from charmhelpers.core import unitdata
+
+import neutron_calico_deferred as deferred
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'config',
+    'coordinate_restarts',
+    'holds_restart_token',
+    'hook_name',
+    'is_rolling',
+    'log',
+    'release_restart_token',
+    'request_restart_token',
+    'restart_services',
+    'service_running',
+    'time',
+]
+
+
+class DeferredRestartsTest(CharmTestCase):
+
+    def setUp(self):
+        super(DeferredRestartsTest, self).setUp(deferred, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.test_config.set('restart-interval', 60)
+        self.hook_name.return_value = 'cluster-relation-changed'
+        self.service_running.return_value = True
+        self.is_rolling.side_effect = lambda service: self.rolling
+        self.holds_restart_token.return_value = False
+        self.rolling = False
+        self.time.time.return_value = 1000.0
+        self.db = unitdata.Storage(':memory:')
+        patcher = patch.object(unitdata, 'kv', return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(deferred, '_restarted_in_hook', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_relation_hooks_coalesce(self):
+        for _ in range(200):
+            self.assertFalse(deferred.can_restart_now(
+                'bird', ['/etc/bird/bird.conf']))
+        self.assertFalse(deferred.can_restart_now(
+            'bird6', ['/etc/bird/bird6.conf']))
+        self.assertEqual(deferred.pending_restarts(), {
+            'bird': {'files': ['/etc/bird/bird.conf'], 'requests': 200,
+                     'since': 1000.0},
+            'bird6': {'files': ['/etc/bird/bird6.conf'], 'requests': 1,
+                      'since': 1000.0}})
+
+    def test_no_interval_restarts_at_once(self):
+        self.test_config.set('restart-interval', 0)
+        self.assertTrue(deferred.can_restart_now('bird', ['bird.conf']))
+        self.assertEqual(deferred.pending_restarts(), {})
+
+    def test_stopped_service_restarts_at_once(self):
+        self.service_running.return_value = False
+        self.assertTrue(deferred.can_restart_now('bird', ['bird.conf']))
+
+    def test_urgent_hook_takes_queued_restart(self):
+        deferred.can_restart_now('bird', ['bird.conf'])
+        deferred.can_restart_now('bird', ['bird.conf'])
+        self.hook_name.return_value = 'config-changed'
+        self.assertTrue(deferred.can_restart_now('bird', ['bird.conf']))
+        self.assertEqual(deferred.pending_restarts(), {})
+        self.log.assert_called_with(
+            'Restarting bird for bird.conf: 3 restart requests collapsed '
+            'into one')
+
+    def test_drain_waits_for_interval(self):
+        functions = {'bird': object()}
+        deferred.can_restart_now('bird', ['bird.conf'])
+        deferred.can_restart_now('calico-felix', ['neutron.conf'])
+        # The first drain happens at once.
+        deferred.drain_restarts(functions)
+        self.restart_services.assert_called_once_with(
+            ['bird', 'calico-felix'], functions)
+        self.assertEqual(deferred.pending_restarts(), {})
+
+        deferred.can_restart_now('bird', ['bird.conf'])
+        self.time.time.return_value = 1030.0
+        deferred.drain_restarts(functions)
+        self.assertEqual(self.restart_services.call_count, 1)
+
+        self.hook_name.return_value = 'update-status'
+        self.time.time.return_value = 1060.0
+        deferred.drain_restarts(functions)
+        self.restart_services.assert_called_with(['bird'], functions)
+
+    def test_drain_at_once_outside_relation_hooks(self):
+        deferred.drain_restarts()
+        deferred.can_restart_now('calico-felix', ['neutron.conf'])
+        self.hook_name.return_value = 'amqp-relation-changed'
+        deferred.drain_restarts()
+        self.assertEqual(self.restart_services.call_args_list,
+                         [call(['calico-felix'], None)])
+
+    def test_rolling_restart_waits_for_token(self):
+        self.rolling = True
+        self.hook_name.return_value = 'config-changed'
+        self.assertFalse(deferred.can_restart_now('calico-felix',
+                                                  ['neutron.conf']))
+        self.request_restart_token.assert_called_once_with()
+        deferred.drain_restarts()
+        self.assertFalse(self.restart_services.called)
+        # Asked again, in case the leader skipped this unit.
+        self.assertEqual(self.request_restart_token.call_count, 2)
+
+        self.holds_restart_token.return_value = True
+        deferred.drain_restarts()
+        self.restart_services.assert_called_once_with(['calico-felix'], None)
+        self.release_restart_token.assert_called_once_with(['calico-felix'])
+        self.assertEqual(deferred.pending_restarts(), {})
+
+    def test_token_released_after_restart_in_hook(self):
+        self.rolling = True
+        self.holds_restart_token.return_value = True
+        self.hook_name.return_value = 'config-changed'
+        self.assertTrue(deferred.can_restart_now('calico-felix',
+                                                 ['neutron.conf']))
+        deferred.drain_restarts()
+        self.release_restart_token.assert_called_once_with(['calico-felix'])
@@ -0,0 +1,132 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from mock import patch
+
+HOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'hooks')
+
+# Refuse to fork, then import the hooks module: anything that shells out
+# (config-get, lsb_release, dpkg, ...) at import time fails the test.
+NO_FORK_IMPORT = '''
+import subprocess
+import sys
+
+
+def _no_fork(*args, **kwargs):
+    raise AssertionError('forked at import time: %r' % (args,))
+
+subprocess.Popen = _no_fork
+sys.path.insert(0, sys.argv[1])
+import neutron_calico_hooks
+'''
+
+# Dispatch a hook the charm does not handle and report which heavy modules
+# got loaded on the way.
+FAST_PATH = '''
+import subprocess
+import sys
+sys.path.insert(0, sys.argv[1])
+import charmhelpers.core.hookenv as hookenv
+hookenv.log = lambda *args, **kwargs: None
+import neutron_calico_dispatch
+neutron_calico_dispatch.main(['hooks/start'])
+heavy = ['jinja2', 'apt', 'apt_pkg', 'netaddr', 'neutron_calico_hooks']
+print(','.join(m for m in heavy if m in sys.modules))
+'''
+
+# Dispatch the relation-joined hooks, with the hook tools stubbed out, and
+# report which heavy modules got loaded on the way.
+JOINED_PATH = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import charmhelpers.core.hookenv as hookenv
+import neutron_calico_facts
+set_calls = []
+hookenv.log = lambda *args, **kwargs: None
+hookenv.config = lambda *args: None
+hookenv.unit_private_ip = lambda: '10.0.0.5'
+hookenv.relation_set = lambda **kwargs: set_calls.append(kwargs)
+neutron_calico_facts.host_fact = lambda name: 'aa::5'
+import neutron_calico_dispatch
+for hook in sorted(neutron_calico_dispatch.JOINED_HOOKS):
+    sys.argv = ['hooks/' + hook]
+    neutron_calico_dispatch.main(sys.argv)
+assert len(set_calls) == len(neutron_calico_dispatch.JOINED_HOOKS)
+heavy = ['jinja2', 'apt', 'apt_pkg', 'netaddr', 'netifaces',
+         'neutron_calico_hooks', 'neutron_calico_context',
+         'neutron_calico_utils']
+print(','.join(m for m in heavy if m in sys.modules))
+'''
+
+
+def _run(script):
+    proc = subprocess.Popen([sys.executable, '-c', script, HOOKS_DIR],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.strip(), err
+
+
+class NeutronCalicoDispatchTests(unittest.TestCase):
+
+    def test_import_hooks_does_not_fork(self):
+        rc, out, err = _run(NO_FORK_IMPORT)
+        self.assertEqual(rc, 0, err)
+
+    def test_unhandled_hook_stays_light(self):
+        rc, out, err = _run(FAST_PATH)
+        self.assertEqual(rc, 0, err)
+        self.assertEqual(out, '')
+
+    def test_joined_hooks_stay_light(self):
+        rc, out, err = _run(JOINED_PATH)
+        self.assertEqual(rc, 0, err)
+        self.assertEqual(out, '')
+
+    def test_handled_hooks_match_registered_hooks(self):
+        sys.path.insert(0, HOOKS_DIR)
+        import neutron_calico_dispatch as dispatch
+        registered = {}
+        for module in ('neutron_calico_hooks', 'neutron_calico_joined'):
+            registered[module] = set()
+            with open(os.path.join(HOOKS_DIR, module + '.py')) as f:
+                lines = [ln.strip() for ln in f]
+            for i, line in enumerate(lines):
+                if not line.startswith('@hooks.hook('):
+                    continue
+                name = line[len('@hooks.hook('):-1].strip('\'"')
+                if not name:
+                    # @hooks.hook() registers the function name.
+                    func = [ln for ln in lines[i:]
+                            if ln.startswith('def ')][0]
+                    name = func[4:func.index('(')].replace('_', '-')
+                registered[module].add(name)
+        self.assertEqual(registered['neutron_calico_joined'],
+                         set(dispatch.JOINED_HOOKS))
+        self.assertEqual(registered['neutron_calico_hooks'] |
+                         registered['neutron_calico_joined'],
+                         set(dispatch.HANDLED_HOOKS))
+        self.assertFalse(registered['neutron_calico_hooks'] &
+                         registered['neutron_calico_joined'])
+        for name in dispatch.HANDLED_HOOKS:
+            self.assertTrue(os.path.lexists(os.path.join(HOOKS_DIR, name)),
+                            name)
+
+    def test_update_status_runs_for_outstanding_tokens(self):
+        sys.path.insert(0, HOOKS_DIR)
+        import neutron_calico_dispatch as dispatch
+        import neutron_calico_deferred
+        import neutron_calico_hooks
+        import neutron_calico_rolling
+        with patch.object(neutron_calico_deferred, 'pending_restarts',
+                          return_value={}), \
+                patch.object(neutron_calico_rolling, 'tokens_outstanding',
+                             return_value=False), \
+                patch.object(neutron_calico_hooks, 'main') as main:
+            dispatch.main(['hooks/update-status'])
+            self.assertFalse(main.called)
+            neutron_calico_rolling.tokens_outstanding.return_value = True
+            dispatch.main(['hooks/update-status'])
+            main.assert_called_once_with()
@@ -0,0 +1,96 @@
+import BaseHTTPServer
+import json
+import threading
+import time
+import unittest
+
+from neutron_calico_etcd import EtcdClient, EtcdError
+
+MEMBERS = {'members': [
+    {'id': 'a1', 'name': 'etcd0',
+     'peerURLs': ['https://10.0.0.10:2380'],
+     'clientURLs': ['https://10.0.0.10:2379']},
+    {'id': 'b2', 'name': 'etcd1',
+     'peerURLs': ['https://10.0.0.11:2380', 'https://[fd00::11]:2380'],
+     'clientURLs': ['https://10.0.0.11:2379']},
+]}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stands in for the etcd proxy's client API."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        if self.path not in self.server.paths:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.paths[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EtcdClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.delay = 0
+        self.server.paths = {'/v2/members': json.dumps(MEMBERS)}
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = EtcdClient('http://127.0.0.1:%d/' %
+                                 self.server.server_address[1], timeout=0.5)
+
+    def test_members(self):
+        self.assertEqual(self.client.members(), MEMBERS['members'])
+        self.assertEqual(self.server.requests, ['/v2/members'])
+
+    def test_peers(self):
+        self.assertEqual(self.client.peers(), set([
+            'etcd0=https://10.0.0.10:2380',
+            'etcd1=https://10.0.0.11:2380',
+            'etcd1=https://[fd00::11]:2380',
+        ]))
+
+    def test_bad_response(self):
+        self.server.paths['/v2/members'] = 'not json'
+        self.assertRaises(EtcdError, self.client.peers)
+
+    def test_timeout(self):
+        self.server.delay = 1
+        start = time.time()
+        self.assertRaises(EtcdError, self.client.peers)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_not_running(self):
+        client = EtcdClient('http://127.0.0.1:1', timeout=0.5)
+        self.assertRaises(EtcdError, client.members)
+
+    def test_healthy(self):
+        self.server.paths['/health'] = '{"health": "true"}'
+        self.assertTrue(self.client.healthy())
+        self.assertEqual(self.server.requests, ['/health'])
+
+    def test_healthy_proxy_without_health_endpoint(self):
+        self.assertTrue(self.client.healthy())
+        self.assertEqual(self.server.requests, ['/health', '/v2/members'])
+
+    def test_get_value(self):
+        key = '/calico/felix/v1/host/compute-1/status'
+        self.server.paths['/v2/keys' + key] = json.dumps(
+            {'action': 'get', 'node': {'key': key,
+                                       'value': '{"uptime": 12}'}})
+        self.assertEqual(self.client.get_value(key), {'uptime': 12})
+        self.assertEqual(self.client.get_value('/calico/none'), None)
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from charmhelpers.contrib.network.addresses import Address, AddressSnapshot
+from charmhelpers.core.unitdata import DerivedFacts, Storage
+import neutron_calico_facts as facts
+
+
+class DerivedFactsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Storage(':memory:')
+        self.facts = DerivedFacts(db=self.db)
+        self.compute = MagicMock(return_value=['a', 'b'])
+        self.validity = MagicMock(return_value=('v', 1))
+        self.facts.register('thing', self.compute, self.validity)
+        patcher = patch('charmhelpers.core.hookenv.atexit')
+        self.atexit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_computed_once_while_valid(self):
+        self.assertEqual(self.facts.get('thing'), ['a', 'b'])
+        self.assertEqual(self.facts.get('thing'), ['a', 'b'])
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(self.facts.stats(), {'hits': 1, 'misses': 1})
+        self.atexit.assert_called_once_with(self.db.flush)
+
+    def test_recomputed_when_validity_changes(self):
+        self.facts.get('thing')
+        self.validity.return_value = ('v', 2)
+        self.compute.return_value = ['c']
+        self.assertEqual(self.facts.get('thing'), ['c'])
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_survives_new_instance(self):
+        self.facts.get('thing')
+        other = DerivedFacts(db=self.db)
+        other.register('thing', self.compute, self.validity)
+        self.assertEqual(other.get('thing'), ['a', 'b'])
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_invalidate(self):
+        self.facts.get('thing')
+        self.facts.invalidate('thing')
+        self.facts.get('thing')
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_unknown_fact(self):
+        self.assertRaises(KeyError, self.facts.get, 'other')
+
+
+class NeutronCalicoFactsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_file_key(self):
+        path = os.path.join(self.tmpdir, 'status')
+        self.assertEqual(facts.file_key(path), None)
+        with open(path, 'w') as f:
+            f.write('Package: foo\n')
+        st = os.stat(path)
+        self.assertEqual(facts.file_key(path), [st.st_mtime, 13])
+
+    def test_value_key(self):
+        key = facts.value_key('1')
+        self.assertEqual(key, facts.value_key('1'))
+        self.assertNotEqual(key, facts.value_key('1', '2'))
+        self.assertNotEqual(key, facts.value_key('3'))
+
+    def test_address_generation(self):
+        eth0 = Address('eth0', 4, '10.0.0.5', 24, None, 0)
+        eth0_v6 = Address('eth0', 6, 'fe80::1', 64, None, 253)
+        with patch.object(facts, 'address_snapshot') as snapshot:
+            snapshot.return_value = AddressSnapshot(['eth0'], [eth0])
+            gen = facts.address_generation()
+            self.assertEqual(gen, facts.address_generation())
+            snapshot.return_value = AddressSnapshot(['eth0'],
+                                                    [eth0_v6, eth0])
+            self.assertNotEqual(gen, facts.address_generation())
+            # The order addresses are listed in does not matter.
+            gen = facts.address_generation()
+            snapshot.return_value = AddressSnapshot(['eth0'],
+                                                    [eth0, eth0_v6])
+            self.assertEqual(gen, facts.address_generation())
+
+    def test_host_fact(self):
+        compute = MagicMock(return_value='liberty')
+        facts.facts.register('test-fact', compute, lambda: 1)
+        self.addCleanup(facts.facts.invalidate, 'test-fact')
+        self.assertEqual(facts.host_fact('test-fact'), 'liberty')
+        self.assertEqual(facts.host_fact('test-fact'), 'liberty')
+        self.assertEqual(compute.call_count, 1)
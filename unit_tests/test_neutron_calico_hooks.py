@@ -1,5 +1,5 @@
 
-from mock import MagicMock, patch, call
+from mock import MagicMock, patch
 from test_utils import CharmTestCase
 
 
@@ -19,16 +19,20 @@ utils.register_configs = _reg
 utils.restart_map = _map
 
 TO_PATCH = [
-    'apt_update',
-    'apt_install',
+    'apt_update_if_needed',
     'config',
     'CONFIGS',
-    'determine_packages',
+    'install_packages',
+    'install_etcd_package',
     'log',
-    'relation_set',
     'additional_install_locations',
     'register_configs',
-    'force_etcd_restart',
+    'restart_etcd_proxy',
+    'configure_dhcp_agents',
+    'maybe_create_felix_cfg',
+    'update_route_reflectors',
+    'update_cluster',
+    'leader_settings_rendered',
 ]
 NEUTRON_CONF_DIR = "/etc/neutron"
 
@@ -47,13 +51,10 @@ class NeutronCalicoHooksTests(CharmTestCase):
             'hooks/{}'.format(hookname)])
 
     def test_install_hook(self):
-        _pkgs = ['foo', 'bar']
-        self.determine_packages.return_value = [_pkgs]
         self._call_hook('install')
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_has_calls([
-            call(_pkgs, fatal=True),
-        ])
+        self.apt_update_if_needed.assert_called_with()
+        self.install_packages.assert_called_once_with()
+        self.install_etcd_package.assert_called_once_with()
 
     def test_config_changed(self):
         self.register_configs.return_value = self.CONFIGS
@@ -61,13 +62,26 @@ class NeutronCalicoHooksTests(CharmTestCase):
         self.assertTrue(self.CONFIGS.write_all.called)
         self.assertTrue(self.register_configs.called)
 
-    def test_amqp_joined(self):
-        self._call_hook('amqp-relation-joined')
-        self.relation_set.assert_called_with(
-            username='neutron',
-            vhost='openstack',
-            relation_id=None
-        )
+    def test_cluster_departed(self):
+        self.update_cluster.return_value = True
+        self._call_hook('cluster-relation-departed')
+        self.update_cluster.assert_called_once_with()
+        self.assertTrue(self.CONFIGS.write_all.called)
+
+    def test_cluster_changed_follower(self):
+        self.update_cluster.return_value = False
+        self._call_hook('cluster-relation-changed')
+        self.assertFalse(self.CONFIGS.write_all.called)
+
+    def test_leader_settings_changed(self):
+        self.leader_settings_rendered.return_value = False
+        self._call_hook('leader-settings-changed')
+        self.assertTrue(self.CONFIGS.write_all.called)
+
+    def test_leader_settings_unchanged(self):
+        self.leader_settings_rendered.return_value = True
+        self._call_hook('leader-settings-changed')
+        self.assertFalse(self.CONFIGS.write_all.called)
 
     def test_amqp_changed(self):
         self.CONFIGS.complete_contexts.return_value = ['amqp']
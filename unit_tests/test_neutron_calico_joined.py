@@ -0,0 +1,73 @@
+from mock import patch
+
+from charmhelpers.contrib.network.addresses import Address, AddressSnapshot
+
+import neutron_calico_facts
+import neutron_calico_joined as joined
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'config',
+    'relation_set',
+    'unit_private_ip',
+]
+
+
+class JoinedHooksTest(CharmTestCase):
+
+    def setUp(self):
+        super(JoinedHooksTest, self).setUp(joined, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.unit_private_ip.return_value = '10.0.0.5'
+
+    def tearDown(self):
+        super(JoinedHooksTest, self).tearDown()
+        neutron_calico_facts.facts.invalidate()
+
+    def _call_hook(self, hookname):
+        joined.hooks.execute(['hooks/{}'.format(hookname)])
+
+    def _snapshot(self, *addrs):
+        entries = [Address(iface, 6, addr, 64, None, 0)
+                   for iface, addr in addrs]
+        snapshot = AddressSnapshot(['eth0', 'tap0a1b2c3d'], entries)
+        patcher = patch.object(joined, 'address_snapshot',
+                               return_value=snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_amqp_joined(self):
+        self._call_hook('amqp-relation-joined')
+        self.relation_set.assert_called_with(
+            username='neutron',
+            vhost='openstack',
+            relation_id=None
+        )
+
+    def test_neutron_plugin_joined(self):
+        self._call_hook('neutron-plugin-relation-joined')
+        self.relation_set.assert_called_with(relation_id=None,
+                                             **{'enable-metadata': 'True'})
+
+    @patch.object(joined, 'host_fact')
+    def test_cluster_joined(self, host_fact):
+        host_fact.return_value = 'aa::4'
+        self._call_hook('cluster-relation-joined')
+        host_fact.assert_called_once_with('local-ipv6-address')
+        self.relation_set.assert_called_with(relation_id=None,
+                                             addr='10.0.0.5', addr6='aa::4')
+
+    def test_local_ipv6_address_one_addr(self):
+        self._snapshot(('eth0', 'fe80::01'), ('eth0', 'aa::04'))
+        addr = joined.local_ipv6_address()
+        self.assertEqual(addr, 'aa::4')
+
+    def test_local_ipv6_address_no_addr(self):
+        self._snapshot(('eth0', 'fe80::01'), ('lo', '::1'))
+        addr = joined.local_ipv6_address()
+        self.assertEqual(addr, None)
+
+    def test_local_ipv6_address_skips_taps(self):
+        self._snapshot(('tap0a1b2c3d', 'bb::1'), ('eth0', 'aa::4'))
+        addr = joined.local_ipv6_address()
+        self.assertEqual(addr, 'aa::4')
@@ -0,0 +1,137 @@
+import subprocess
+
+from mock import patch
+
+from charmhelpers.core import unitdata
+
+import neutron_calico_readiness as readiness
+from neutron_calico_etcd import EtcdError
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'EtcdClient',
+    'log',
+    'service_running',
+]
+
+STATUS = 'BIRD 1.5.0\nRouter ID is 10.0.0.1\nDaemon is up and running\n'
+PROTOCOLS = '''name     proto    table    state  since       info
+kernel1  Kernel   master   up     12:00:00
+device1  Device   master   up     12:00:00
+N10_0_0_2 BGP      master   up     12:00:03    Established
+N10_0_0_3 BGP      master   start  12:00:00    Connect
+'''
+
+
+class PollTest(CharmTestCase):
+
+    def setUp(self):
+        super(PollTest, self).setUp(readiness, ['time'])
+        self.now = [0.0]
+        self.sleeps = []
+        self.time.time.side_effect = lambda: self.now[0]
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now[0] += seconds
+        self.time.sleep.side_effect = sleep
+
+    def test_backoff(self):
+        self.assertFalse(readiness.poll(lambda: False, 10))
+        self.assertEqual(self.sleeps, [0.25, 0.5, 1, 2, 4, 2.25])
+
+    def test_ready(self):
+        checks = iter([False, False, True])
+        self.assertTrue(readiness.poll(lambda: next(checks), 10))
+        self.assertEqual(self.sleeps, [0.25, 0.5])
+
+
+class ProbesTest(CharmTestCase):
+
+    def setUp(self):
+        super(ProbesTest, self).setUp(readiness, TO_PATCH)
+        self.outputs = {('birdc', 'show', 'status'): STATUS,
+                        ('birdc', 'show', 'protocols'): PROTOCOLS}
+        patcher = patch.object(subprocess, 'check_output',
+                               side_effect=self._check_output)
+        self.check_output = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = self.EtcdClient.return_value
+        self.service_running.return_value = True
+
+    def _check_output(self, cmd, stderr=None):
+        output = self.outputs.get(tuple(cmd))
+        if output is None:
+            raise subprocess.CalledProcessError(1, cmd, 'Unable to connect')
+        return output
+
+    def test_bird_up(self):
+        self.assertTrue(readiness.bird_ready('bird', 0))
+
+    def test_bird_up_without_established_sessions(self):
+        # Sessions depend on the peers, so they are not waited for.
+        self.outputs[('birdc', 'show', 'protocols')] = PROTOCOLS.replace(
+            'Established', 'Active')
+        self.assertTrue(readiness.bird_ready('bird', 0))
+        self.check_output.assert_called_once_with(
+            ['birdc', 'show', 'status'], stderr=subprocess.STDOUT)
+
+    def test_bird_starting(self):
+        self.outputs[('birdc', 'show', 'status')] = STATUS.replace(
+            'Daemon is up and running', 'Reconfiguration in progress')
+        self.assertFalse(readiness.bird_ready('bird', 0))
+
+    def test_bird_not_answering(self):
+        del self.outputs[('birdc', 'show', 'status')]
+        self.assertFalse(readiness.bird_ready('bird', 0))
+
+    def test_etcd(self):
+        self.client.healthy.return_value = True
+        self.client.members.return_value = [{'name': 'etcd0'}]
+        self.assertTrue(readiness.etcd_ready('etcd', 0))
+        self.client.members.return_value = []
+        self.assertFalse(readiness.etcd_ready('etcd', 0))
+        self.client.members.side_effect = EtcdError
+        self.assertFalse(readiness.etcd_ready('etcd', 0))
+
+    def test_felix_reported_since_restart(self):
+        self.client.get_value.return_value = {
+            'time': '2016-08-15T12:00:30Z', 'uptime': 20}
+        restarted = readiness._utc_timestamp('2016-08-15T12:00:10Z')
+        self.assertTrue(readiness.felix_ready('calico-felix', restarted))
+        self.assertFalse(readiness.felix_ready('calico-felix',
+                                               restarted + 60))
+
+    def test_felix_not_reporting(self):
+        self.client.get_value.return_value = None
+        self.assertTrue(readiness.felix_ready('calico-felix', 0))
+        self.service_running.return_value = False
+        self.assertFalse(readiness.felix_ready('calico-felix', 0))
+
+
+class TimeToReadyTest(CharmTestCase):
+
+    def setUp(self):
+        super(TimeToReadyTest, self).setUp(readiness, TO_PATCH + ['poll'])
+        self.db = unitdata.Storage(':memory:')
+        patcher = patch.object(unitdata, 'kv', return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wait_until_ready(self):
+        self.poll.side_effect = lambda check, timeout: check()
+        self.service_running.return_value = False
+        ready, seconds = readiness.wait_until_ready('nova-api-metadata', 0)
+        self.assertFalse(ready)
+        self.service_running.assert_called_once_with('nova-api-metadata')
+        self.assertEqual(self.poll.call_args[0][1], readiness.DEFAULT_TIMEOUT)
+        readiness.wait_until_ready('calico-felix', 0)
+        self.assertEqual(self.poll.call_args[0][1], 60)
+
+    def test_recorded(self):
+        readiness.record_time_to_ready({'bird': (True, 1.23456),
+                                        'calico-felix': (False, 60.0)})
+        self.assertTrue(readiness.is_ready('bird'))
+        self.assertFalse(readiness.is_ready('calico-felix'))
+        self.assertFalse(readiness.is_ready('etcd'))
+        self.assertEqual(readiness.time_to_ready()['bird']['seconds'], 1.235)
@@ -0,0 +1,103 @@
+import socket
+import threading
+import time
+import unittest
+
+from collections import OrderedDict
+
+from mock import patch
+
+from charmhelpers.core.unitdata import Storage
+import neutron_calico_resolver as resolver
+
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Storage(':memory:')
+        self.resolver = resolver.Resolver(db=self.db, ttl=60, threads=4)
+        self.answers = {'peer-%d' % i: '10.0.0.%d' % i for i in range(8)}
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        patcher = patch.object(resolver.socket, 'getaddrinfo',
+                               side_effect=self._getaddrinfo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ('atexit', 'log'):
+            patcher = patch.object(resolver, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def _getaddrinfo(self, name, port, family):
+        with self.lock:
+            self.calls.append(name)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.05)
+            if name not in self.answers:
+                raise socket.gaierror(-2, 'Name or service not known')
+            return [(family, 1, 6, '', (self.answers[name], 0))]
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def test_concurrent_and_bounded(self):
+        names = sorted(self.answers)
+        start = time.time()
+        results = self.resolver.resolve(names)
+        self.assertEqual(results, self.answers)
+        # Eight 50ms lookups on four threads: two rounds, not eight.
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertTrue(1 < self.peak <= 4)
+        self.assertEqual(self.resolver.stats()['lookups'], 8)
+
+    def test_cached_within_ttl(self):
+        self.resolver.resolve(['peer-1'])
+        other = resolver.Resolver(db=self.db, ttl=60)
+        self.assertEqual(other.resolve(['peer-1']), {'peer-1': '10.0.0.1'})
+        self.assertEqual(self.calls, ['peer-1'])
+        self.assertEqual(other.stats()['cached'], 1)
+        self.assertFalse(other._atexit_registered)
+
+    def test_expired_entry_resolved_again(self):
+        self.resolver.resolve(['peer-1'])
+        self.resolver.ttl = 0
+        self.answers['peer-1'] = '10.0.1.1'
+        self.assertEqual(self.resolver.resolve(['peer-1']),
+                         {'peer-1': '10.0.1.1'})
+
+    def test_falls_back_to_last_good_answer(self):
+        self.resolver.resolve(['peer-1'])
+        self.resolver.ttl = 0
+        del self.answers['peer-1']
+        self.assertEqual(self.resolver.resolve(['peer-1', 'unknown']),
+                         {'peer-1': '10.0.0.1', 'unknown': None})
+        stats = self.resolver.stats()
+        self.assertEqual((stats['stale'], stats['failed']), (1, 1))
+
+    def test_addresses_not_looked_up(self):
+        self.assertEqual(self.resolver.resolve(['10.1.2.3']),
+                         {'10.1.2.3': '10.1.2.3'})
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.atexit.called)
+
+    def test_flush_and_report_at_exit(self):
+        self.resolver.resolve(['peer-1'])
+        self.resolver.resolve(['peer-2'])
+        self.assertEqual(self.atexit.call_count, 2)
+        self.resolver._report()
+        self.assertEqual(self.log.call_args[1], {'level': resolver.DEBUG})
+
+    def test_resolve_values_keeps_order(self):
+        with patch.object(resolver, 'resolver', self.resolver):
+            names = OrderedDict([('calico/3', 'peer-3'), ('calico/4', 'nope'),
+                                 ('calico/1', 'peer-1')])
+            self.assertEqual(
+                resolver.resolve_values(names).items(),
+                [('calico/3', '10.0.0.3'), ('calico/1', '10.0.0.1')])
+            self.assertEqual(resolver.resolve_address('nope', '1.1.1.1'),
+                             '1.1.1.1')
+            self.assertEqual(resolver.resolve_address(None), None)
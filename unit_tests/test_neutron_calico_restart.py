@@ -0,0 +1,132 @@
+import threading
+import time
+
+import mock
+from mock import call
+
+import neutron_calico_restart as restart
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'init_is_systemd',
+    'is_rolling',
+    'log',
+    'record_time_to_ready',
+    'service_restart',
+    'subprocess',
+    'wait_until_ready',
+]
+
+
+class RestartServicesTest(CharmTestCase):
+
+    def setUp(self):
+        super(RestartServicesTest, self).setUp(restart, TO_PATCH)
+        self.events = []
+        self.init_is_systemd.return_value = False
+        self.service_restart.side_effect = self._restart
+        self.subprocess.call.side_effect = (
+            lambda cmd: self.events.append(tuple(cmd)) or 0)
+        self.ready = {}
+        self.wait_until_ready.side_effect = self._wait_until_ready
+        self.is_rolling.return_value = False
+
+    def _restart(self, service):
+        self.events.append(service)
+        return True
+
+    def _wait_until_ready(self, service, since):
+        if service == 'etcd':
+            self.events.append('etcd ready')
+        return self.ready.get(service, True), 0.5
+
+    def test_stages(self):
+        self.assertEqual(
+            restart.restart_stages(['calico-felix', 'bird', 'etcd',
+                                    'calico-dhcp-agent', 'nova-api-metadata',
+                                    'bird']),
+            [['bird', 'etcd', 'nova-api-metadata'],
+             ['calico-felix', 'calico-dhcp-agent']])
+        self.assertEqual(restart.restart_stages(['calico-felix']),
+                         [['calico-felix']])
+
+    def test_dependents_wait_for_ready(self):
+        timings = restart.restart_services(['calico-felix', 'etcd',
+                                            'calico-dhcp-agent'])
+        self.assertEqual(self.events[:2], ['etcd', 'etcd ready'])
+        self.assertEqual(sorted(self.events[2:]),
+                         ['calico-dhcp-agent', 'calico-felix'])
+        # Nothing depends on Felix and the DHCP agent: not waited for.
+        self.assertEqual(list(timings),
+                         ['etcd', 'etcd ready', 'calico-felix',
+                          'calico-dhcp-agent'])
+        self.record_time_to_ready.assert_called_once_with(
+            {'etcd': (True, 0.5)})
+
+    def test_dependents_restart_when_not_ready(self):
+        self.ready['etcd'] = False
+        restart.restart_services(['etcd', 'calico-felix'])
+        self.assertEqual(self.events,
+                         ['etcd', 'etcd ready', 'calico-felix'])
+        self.log.assert_any_call('etcd not ready after restart, restarting '
+                                 'its dependents anyway',
+                                 level=restart.WARNING)
+
+    def test_independent_services_restart_concurrently(self):
+        started = []
+        barrier = threading.Event()
+
+        def slow_restart(service):
+            started.append(service)
+            if len(started) == 3:
+                barrier.set()
+            # Would time out if the restarts ran one after the other.
+            return barrier.wait(5)
+        self.service_restart.side_effect = slow_restart
+        start = time.time()
+        timings = restart.restart_services(['bird', 'bird6',
+                                            'nova-api-metadata'])
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(sorted(started),
+                         ['bird', 'bird6', 'nova-api-metadata'])
+        self.assertEqual(sorted(timings),
+                         ['bird', 'bird6', 'nova-api-metadata'])
+
+    def test_systemd_batch(self):
+        self.init_is_systemd.return_value = True
+        restart.restart_services(['calico-felix', 'etcd',
+                                  'nova-api-metadata'])
+        self.assertEqual(self.subprocess.call.call_args_list, [
+            call(['systemctl', 'restart', 'etcd', 'nova-api-metadata']),
+            call(['systemctl', 'restart', 'calico-felix'])])
+        self.assertFalse(self.service_restart.called)
+
+    def test_restart_functions(self):
+        wiped = []
+        restart.restart_services(['etcd', 'calico-felix'],
+                                 {'etcd': wiped.append})
+        self.assertEqual(wiped, ['etcd'])
+        self.assertEqual(self.events, ['etcd ready', 'calico-felix'])
+
+    def test_leaf_services_not_waited_for(self):
+        reloaded = []
+        restart.restart_services(['bird', 'bird6'],
+                                 {'bird': reloaded.append,
+                                  'bird6': reloaded.append})
+        self.assertEqual(reloaded, ['bird', 'bird6'])
+        self.assertFalse(self.wait_until_ready.called)
+        self.assertFalse(self.record_time_to_ready.called)
+
+    def test_rolling_services_waited_for(self):
+        self.is_rolling.side_effect = lambda service: service != 'bird'
+        timings = restart.restart_services(['bird', 'calico-felix'])
+        self.wait_until_ready.assert_called_once_with('calico-felix',
+                                                      mock.ANY)
+        self.record_time_to_ready.assert_called_once_with(
+            {'calico-felix': (True, 0.5)})
+        self.assertEqual(timings['calico-felix ready'], 0.5)
+
+    def test_restart_function_failure_logged(self):
+        restart.restart_services(['bird'], {'bird': lambda service: False})
+        self.log.assert_any_call('New configuration of bird not applied',
+                                 level='WARNING')
@@ -0,0 +1,156 @@
+import json
+
+import neutron_calico_rolling as rolling
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'config',
+    'is_leader',
+    'leader_get',
+    'leader_set',
+    'local_unit',
+    'log',
+    'related_units',
+    'relation_get',
+    'relation_ids',
+    'relation_set',
+    'is_ready',
+    'status_set',
+    'time',
+]
+
+
+class RollingRestartTest(CharmTestCase):
+
+    def setUp(self):
+        super(RollingRestartTest, self).setUp(rolling, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.test_config.set('rolling-restart-batch', 2)
+        self.units = ['neutron-calico/%d' % i for i in range(5)]
+        self.settings = dict((unit, {}) for unit in self.units)
+        self.leader = {}
+        self.unit = 'neutron-calico/0'
+        self.local_unit.side_effect = lambda: self.unit
+        self.is_leader.side_effect = lambda: self.unit == 'neutron-calico/0'
+        self.relation_ids.return_value = ['cluster:1']
+        self.related_units.side_effect = lambda rid: [
+            unit for unit in self.units if unit != self.unit]
+        self.relation_get.side_effect = (
+            lambda rid=None, unit=None: dict(self.settings[unit]))
+        self.relation_set.side_effect = (
+            lambda relation_id=None, relation_settings=None:
+            self.settings[self.unit].update(relation_settings))
+        self.leader_get.side_effect = self.leader.get
+        self.leader_set.side_effect = self.leader.update
+        self.time.time.return_value = 1000.0
+        self.is_ready.return_value = True
+
+    def _as(self, unit):
+        self.unit = unit
+
+    def _granted(self):
+        return rolling.restart_tokens()['units']
+
+    def test_off_without_peers_or_leadership(self):
+        self.relation_ids.return_value = []
+        self.assertEqual(rolling.rolling_batch(), 0)
+        self.relation_ids.return_value = ['cluster:1']
+        self.leader_get.side_effect = NotImplementedError
+        self.assertEqual(rolling.rolling_batch(), 0)
+        self.assertFalse(rolling.is_rolling('calico-felix'))
+
+    def test_only_disruptive_services_roll(self):
+        self.assertTrue(rolling.is_rolling('calico-felix'))
+        self.assertFalse(rolling.is_rolling('bird'))
+
+    def test_batches(self):
+        for unit in reversed(self.units):
+            self._as(unit)
+            rolling.request_restart_token()
+            rolling.request_restart_token()
+        self._as('neutron-calico/0')
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(),
+                         ['neutron-calico/0', 'neutron-calico/1'])
+        self.assertTrue(rolling.holds_restart_token())
+
+        # Nothing more until the whole batch has restarted.
+        rolling.release_restart_token(['calico-felix'])
+        self.assertFalse(rolling.coordinate_restarts())
+        self._as('neutron-calico/1')
+        self.assertTrue(rolling.holds_restart_token())
+        rolling.release_restart_token(['calico-felix'])
+        self._as('neutron-calico/0')
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(),
+                         ['neutron-calico/2', 'neutron-calico/3'])
+        self.status_set.assert_called_with(
+            'active', 'Rolling restart: 2 restarting, 1 waiting')
+
+    def test_unit_not_ready_does_not_report(self):
+        self.is_ready.return_value = False
+        rolling.request_restart_token()
+        self.assertFalse(rolling.release_restart_token(['calico-felix']))
+        self.is_ready.assert_called_once_with('calico-felix')
+        self.assertEqual(rolling.waiting_units(), ['neutron-calico/0'])
+
+    def test_stuck_batch_times_out(self):
+        for unit in self.units[:3]:
+            self._as(unit)
+            rolling.request_restart_token()
+        self._as('neutron-calico/0')
+        rolling.coordinate_restarts()
+        self.time.time.return_value = 1000.0 + rolling.ROLLING_TIMEOUT
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(), ['neutron-calico/2'])
+
+    def test_timed_out_unit_is_skipped(self):
+        for unit in self.units[:3]:
+            self._as(unit)
+            rolling.request_restart_token()
+        self._as('neutron-calico/0')
+        rolling.coordinate_restarts()
+        rolling.release_restart_token(['calico-felix'])
+        self.time.time.return_value = 1000.0 + rolling.ROLLING_TIMEOUT
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(), ['neutron-calico/2'])
+        self.assertEqual(rolling.skipped_units(),
+                         {'neutron-calico/1': '1000.000000'})
+
+        # neutron-calico/1 still has not reported, but is not granted a
+        # token again.
+        self._as('neutron-calico/2')
+        rolling.release_restart_token(['calico-felix'])
+        self._as('neutron-calico/0')
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(), [])
+        self.assertFalse(rolling.coordinate_restarts())
+
+        # Until it asks again.
+        self._as('neutron-calico/1')
+        self.time.time.return_value = 2000.0
+        rolling.request_restart_token()
+        self._as('neutron-calico/0')
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(), ['neutron-calico/1'])
+        self.assertEqual(rolling.skipped_units(), {})
+
+    def test_tokens_outstanding(self):
+        self.assertFalse(rolling.tokens_outstanding())
+        self._as('neutron-calico/3')
+        rolling.request_restart_token()
+        self._as('neutron-calico/0')
+        rolling.coordinate_restarts()
+        self.assertTrue(rolling.tokens_outstanding())
+        self._as('neutron-calico/3')
+        self.assertFalse(rolling.tokens_outstanding())
+
+    def test_tokens_cleared_when_done(self):
+        rolling.request_restart_token()
+        rolling.coordinate_restarts()
+        rolling.release_restart_token(['calico-felix'])
+        self.assertTrue(rolling.coordinate_restarts())
+        self.assertEqual(self._granted(), [])
+        self.assertFalse(rolling.coordinate_restarts())
+        self.assertEqual(json.loads(self.leader['restart-tokens'])['units'],
+                         [])
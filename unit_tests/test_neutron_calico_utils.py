@@ -1,10 +1,8 @@
 
-from mock import MagicMock, patch
+from mock import patch
 from collections import OrderedDict
 import charmhelpers.contrib.openstack.templating as templating
 
-templating.OSConfigRenderer = MagicMock()
-
 import neutron_calico_utils as nutils
 
 from test_utils import (
@@ -12,17 +10,22 @@ from test_utils import (
 )
 import charmhelpers
 import charmhelpers.core.hookenv as hookenv
-import netifaces
+import neutron_calico_facts
 
 
 TO_PATCH = [
     'os_release',
+    'get_os_codename_install_source',
     'neutron_plugin_attribute',
     'config',
     'service_stop',
     'service_start',
+    'restart_services',
     'glob',
     'shutil',
+    'filter_installed_packages',
+    'filter_upgradable_packages',
+    'apt_install_all',
 ]
 
 head_pkg = 'linux-headers-3.15.0-5-generic'
@@ -60,11 +63,16 @@ class TestNeutronCalicoUtils(CharmTestCase):
 
     def setUp(self):
         super(TestNeutronCalicoUtils, self).setUp(nutils, TO_PATCH)
+        _renderer = patch.object(templating, 'OSConfigRenderer')
+        _renderer.start()
+        self.addCleanup(_renderer.stop)
         self.neutron_plugin_attribute.side_effect = _mock_npa
+        self.get_os_codename_install_source.return_value = 'icehouse'
 
     def tearDown(self):
         # Reset cached cache
-        hookenv.cache = {}
+        hookenv.cache.clear()
+        neutron_calico_facts.facts.invalidate()
 
     @patch.object(charmhelpers.contrib.openstack.neutron, 'os_release')
     @patch.object(charmhelpers.contrib.openstack.neutron, 'headers_package')
@@ -75,6 +83,107 @@ class TestNeutronCalicoUtils(CharmTestCase):
         expect = [['calico-compute', 'bird', 'neutron-dhcp-agent'], [head_pkg]]
         self.assertItemsEqual(pkg_list, expect)
 
+    @patch.object(nutils, 'determine_packages')
+    def test_install_packages(self, _determine_packages):
+        _determine_packages.return_value = [['calico-compute', 'bird'],
+                                            'linux-headers']
+        self.filter_installed_packages.return_value = ['bird']
+        self.filter_upgradable_packages.return_value = ['dnsmasq-base']
+        nutils.install_packages()
+        self.filter_installed_packages.assert_called_once_with(
+            ['calico-compute', 'bird', 'linux-headers', 'dnsmasq-base'])
+        self.filter_upgradable_packages.assert_called_once_with(
+            ['dnsmasq-base'])
+        self.apt_install_all.assert_called_once_with(
+            ['bird', 'dnsmasq-base'], fatal=True)
+
+    @patch.object(nutils, 'determine_packages')
+    def test_install_packages_missing_dnsmasq(self, _determine_packages):
+        _determine_packages.return_value = [['calico-compute', 'bird']]
+        self.filter_installed_packages.side_effect = (
+            lambda pkgs: [p for p in pkgs if p == 'dnsmasq-base'])
+        # Not installed, so not upgradable either.
+        self.filter_upgradable_packages.return_value = []
+        nutils.install_packages()
+        self.apt_install_all.assert_called_once_with(['dnsmasq-base'],
+                                                     fatal=True)
+
+    @patch.object(nutils, 'determine_packages')
+    def test_install_packages_provisioned(self, _determine_packages):
+        _determine_packages.return_value = [['calico-compute', 'bird']]
+        self.filter_installed_packages.return_value = []
+        self.filter_upgradable_packages.return_value = []
+        nutils.install_packages()
+        self.assertFalse(self.apt_install_all.called)
+
+    @patch.object(nutils, 'determine_packages')
+    @patch.object(nutils, 'apt_dependency_closure')
+    @patch.object(nutils, 'apt_upgradable_packages')
+    @patch.object(nutils, 'apt_cache')
+    def test_scoped_upgrade(self, _apt_cache, _upgradable, _closure,
+                            _determine_packages):
+        _determine_packages.return_value = [['calico-compute', 'bird']]
+        _upgradable.return_value = ['bird', 'python-etcd', 'openssh-server',
+                                    'libvirt-bin']
+        _closure.return_value = set(['calico-compute', 'bird', 'etcd',
+                                     'python-etcd', 'dnsmasq-base'])
+        with patch.object(nutils, 'log') as _log:
+            nutils.scoped_upgrade()
+        _closure.assert_called_once_with(
+            ['calico-compute', 'bird', 'dnsmasq-base', 'bird', 'etcd'],
+            _apt_cache.return_value)
+        self.apt_install_all.assert_called_once_with(
+            ['bird', 'python-etcd'],
+            options=nutils.SCOPED_UPGRADE_OPTIONS, fatal=True)
+        self.assertIn('upgraded 2 of 4 upgradable packages',
+                      _log.call_args[0][0])
+
+    @patch.object(nutils, 'scoped_upgrade')
+    @patch.object(nutils, 'apt_upgrade')
+    @patch.object(nutils, 'apt_update_if_needed')
+    @patch.object(nutils, 'add_source')
+    @patch.object(nutils, 'host_fact')
+    def test_additional_install_locations_scoped(self, _host_fact,
+                                                 _add_source, _update,
+                                                 _apt_upgrade, _scoped):
+        _host_fact.return_value = 'liberty'
+        self.test_config.set('upgrade-scope', 'calico')
+        self.config.side_effect = self.test_config.get
+        nutils.additional_install_locations()
+        self.assertTrue(_scoped.called)
+        self.assertFalse(_apt_upgrade.called)
+        self.test_config.set('upgrade-scope', 'full')
+        nutils.additional_install_locations()
+        self.assertTrue(_apt_upgrade.called)
+
+    @patch.object(nutils, 'subprocess')
+    @patch.object(nutils, 'dpkg_status_index')
+    @patch.object(nutils, 'ArchiveUrlFetchHandler')
+    def test_install_etcd_package(self, _handler, _index, _subprocess):
+        conf = {'etcd-package-url': 'http://example.com/etcd_2.3.7_amd64.deb',
+                'etcd-package-checksum': 'abc'}
+        self.config.side_effect = conf.get
+        _handler.return_value.download_cached.return_value = '/cache/etcd.deb'
+        _subprocess.check_output.return_value = ('Package: etcd\n'
+                                                 'Version: 2.3.7\n')
+        _index.return_value.installed_version.return_value = '2.2.5'
+        nutils.install_etcd_package()
+        _handler.return_value.download_cached.assert_called_once_with(
+            'http://example.com/etcd_2.3.7_amd64.deb', checksum='abc')
+        _subprocess.check_call.assert_called_once_with(
+            ['dpkg', '-i', '/cache/etcd.deb'])
+
+        _subprocess.check_call.reset_mock()
+        _index.return_value.installed_version.return_value = '2.3.7'
+        nutils.install_etcd_package()
+        self.assertFalse(_subprocess.check_call.called)
+
+    @patch.object(nutils, 'ArchiveUrlFetchHandler')
+    def test_install_etcd_package_unset(self, _handler):
+        self.config.return_value = None
+        nutils.install_etcd_package()
+        self.assertFalse(_handler.called)
+
     def test_register_configs(self):
         class _mock_OSConfigRenderer():
             def __init__(self, templates_dir=None, openstack_release=None):
@@ -147,32 +256,6 @@ class TestNeutronCalicoUtils(CharmTestCase):
             self.assertTrue(item in _restart_map)
             self.assertEqual(expect[item], _restart_map[item])
 
-    @patch.object(netifaces, 'interfaces')
-    @patch.object(netifaces, 'ifaddresses')
-    def test_local_ipv6_address_one_addr(self, ifaddresses, interfaces):
-        interfaces.return_value = ['eth0']
-        ifaddresses.return_value = {
-            netifaces.AF_INET6: [
-                {'addr': 'fe80::01%eth0'}, {'addr': 'aa::04'}
-            ]
-        }
-
-        addr = nutils.local_ipv6_address()
-        self.assertEqual(addr, 'aa::4')
-
-    @patch.object(netifaces, 'interfaces')
-    @patch.object(netifaces, 'ifaddresses')
-    def test_local_ipv6_address_no_addr(self, ifaddresses, interfaces):
-        interfaces.return_value = ['eth0']
-        ifaddresses.return_value = {
-            netifaces.AF_INET6: [
-                {'addr': 'fe80::01%eth0'}
-            ]
-        }
-
-        addr = nutils.local_ipv6_address()
-        self.assertEqual(addr, None)
-
     def test_force_etcd_restart(self):
         self.glob.glob.return_value = [
             '/var/lib/etcd/one', '/var/lib/etcd/two'
@@ -183,3 +266,24 @@ class TestNeutronCalicoUtils(CharmTestCase):
         self.shutil.rmtree.assert_any_call('/var/lib/etcd/one')
         self.shutil.rmtree.assert_any_call('/var/lib/etcd/two')
         self.service_start.assert_called_once_with('etcd')
+
+    def test_restart_etcd_proxy_in_place(self):
+        nutils.restart_etcd_proxy()
+        self.restart_services.assert_called_once_with(
+            ['etcd', 'calico-felix'], {})
+        self.assertFalse(self.shutil.rmtree.called)
+
+    def test_restart_etcd_proxy_wipe(self):
+        self.glob.glob.return_value = ['/var/lib/etcd/proxy']
+        nutils.restart_etcd_proxy(wipe=True)
+        services, functions = self.restart_services.call_args[0]
+        self.assertEqual(services, ['etcd', 'calico-felix'])
+        functions['etcd']('etcd')
+        self.shutil.rmtree.assert_called_once_with('/var/lib/etcd/proxy')
+        self.service_start.assert_called_once_with('etcd')
+
+    def test_restart_etcd_proxy_calico_dhcp_agent(self):
+        self.get_os_codename_install_source.return_value = 'liberty'
+        nutils.restart_etcd_proxy()
+        self.restart_services.assert_called_once_with(
+            ['etcd', 'calico-felix', 'calico-dhcp-agent'], {})
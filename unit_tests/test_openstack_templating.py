@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+import charmhelpers.contrib.openstack.templating as templating
+
+
+class _Context(object):
+    interfaces = ['test']
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'value': self.value}
+
+
+class ContextMemoisationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.templates = os.path.join(self.tmpdir, 'templates')
+        os.mkdir(self.templates)
+        for name in ('a.conf', 'b.conf'):
+            with open(os.path.join(self.templates, name), 'w') as f:
+                f.write('value = {{ value }}\n')
+        for name in ('log', 'atexit'):
+            patcher = patch.object(templating, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.renderer = templating.OSConfigRenderer(
+            templates_dir=self.templates, openstack_release='kilo')
+        self.shared = _Context('shared')
+        self.a = os.path.join(self.tmpdir, 'a.conf')
+        self.b = os.path.join(self.tmpdir, 'b.conf')
+        self.renderer.register(self.a, [self.shared])
+        self.renderer.register(self.b, [self.shared])
+
+    def test_shared_generator_evaluated_once(self):
+        self.assertEqual(self.renderer.complete_contexts(), ['test', 'test'])
+        self.assertEqual(self.renderer.write_all(), set([self.a, self.b]))
+        self.assertEqual(self.shared.calls, 1)
+        self.assertEqual(self.renderer.evaluations, 1)
+        self.assertEqual(self.renderer.evaluations_avoided, 3)
+        with open(self.b) as f:
+            self.assertEqual(f.read(), 'value = shared')
+
+    def test_distinct_generators_evaluated_separately(self):
+        other = _Context('other')
+        self.renderer.register(self.b, [other])
+        self.renderer.write_all()
+        self.assertEqual((self.shared.calls, other.calls), (1, 1))
+
+    def test_reset_contexts(self):
+        self.renderer.write_all()
+        self.shared.value = 'changed'
+        self.renderer.reset_contexts()
+        self.assertEqual(self.renderer.write_all(), set([self.a, self.b]))
+        self.assertEqual(self.shared.calls, 2)
+
+    def test_unchanged_files_not_reported(self):
+        self.renderer.write_all()
+        self.assertEqual(self.renderer.write_all(), set())
+
+    def test_report(self):
+        self.renderer.write_all()
+        self.atexit.assert_called_once_with(self.renderer._report)
+        self.renderer._report()
+        self.log.assert_called_with(
+            'Context generators: 1 evaluated, 1 evaluations avoided',
+            level=templating.DEBUG)
+
+    def test_plain_template_evaluates_directly(self):
+        generator = MagicMock(return_value={'x': 1})
+        generator.interfaces = []
+        template = templating.OSConfigTemplate('/etc/x.conf', generator)
+        template.context()
+        template.context()
+        self.assertEqual(generator.call_count, 2)